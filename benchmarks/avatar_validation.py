@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+頭像驗證與解碼成本測量
+
+以產生的測試圖片（一般照片、大張照片、decompression bomb）比較：
+- imagefield：原本 DRF ImageField 的驗證（Pillow open + verify）
+- header：validators.validate_avatar_image（只讀取檔頭）
+- render-full：產生縮圖時完整解碼 JPEG
+- render-draft：產生縮圖時以 draft mode 縮小解碼（avatar_processing.render_renditions）
+
+每個（模式, 圖片）組合在獨立子行程中執行，回報延遲中位數與峰值 RSS 增量。
+
+使用方式：
+    python benchmarks/avatar_validation.py
+    python benchmarks/avatar_validation.py --repeat 10
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+MODES = ('imagefield', 'header', 'render-full', 'render-draft')
+
+
+def build_corpus(directory):
+    """產生測試圖片，回傳 {名稱: 路徑}"""
+    from PIL import Image
+
+    corpus = {}
+
+    def save(name, image, image_format, **options):
+        path = os.path.join(directory, name)
+        image.save(path, image_format, **options)
+        corpus[name] = path
+
+    gradient = Image.linear_gradient('L').resize((1024, 1024))
+    photo = Image.merge('RGB', (gradient, gradient.rotate(90), gradient.rotate(180)))
+    save('avatar-512.jpg', photo.resize((512, 512)), 'JPEG', quality=90)
+    save('photo-4000x3000.jpg', photo.resize((4000, 3000)), 'JPEG', quality=90)
+    save('photo-2000.png', photo.resize((2000, 2000)), 'PNG')
+    # 約 150KB 的 PNG，解碼後需要 144MB
+    save('bomb-12000.png', Image.new('L', (12000, 12000)), 'PNG', optimize=True)
+    return corpus
+
+
+def current_rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def run_case(mode, path, repeat):
+    """在子行程中執行，回傳統計結果"""
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+    django.setup()
+
+    from unittest import mock
+
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import JpegImagePlugin
+    from rest_framework import serializers
+
+    from edit_profile.avatar_processing import get_rendition_sizes, render_renditions
+    from edit_profile.validators import validate_avatar_image
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    name = os.path.basename(path)
+
+    def operation():
+        upload = SimpleUploadedFile(name, content)
+        if mode == 'imagefield':
+            serializers.ImageField().run_validation(upload)
+        elif mode == 'header':
+            validate_avatar_image(upload)
+        elif mode == 'render-full':
+            with mock.patch.object(JpegImagePlugin.JpegImageFile, 'draft', lambda *args: None):
+                render_renditions(io.BytesIO(content), get_rendition_sizes())
+        else:
+            render_renditions(io.BytesIO(content), get_rendition_sizes())
+
+    baseline = current_rss_kb()
+    timings = []
+    outcome = 'ok'
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            operation()
+        except serializers.ValidationError:
+            outcome = 'rejected'
+        timings.append(time.perf_counter() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        'mode': mode,
+        'file': name,
+        'size': len(content),
+        'outcome': outcome,
+        'ms': round(statistics.median(timings) * 1000, 2),
+        'peak_rss_kb': max(peak - baseline, 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='頭像驗證與解碼成本測量')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    parser.add_argument('--build', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.build:
+        print(json.dumps(build_corpus(args.build)))
+        return
+    if args.mode:
+        print(json.dumps(run_case(args.mode, args.file, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory(prefix='bench-avatar-') as directory:
+        # 峰值 RSS 會由子行程繼承，產生圖片也在獨立子行程中進行
+        output = subprocess.run(
+            [sys.executable, __file__, '--build', directory],
+            check=True, capture_output=True, text=True
+        ).stdout
+        corpus = json.loads(output.strip().splitlines()[-1])
+        results = []
+        for name, path in corpus.items():
+            for mode in MODES:
+                # 未通過驗證的圖片不會進入產生縮圖的階段
+                if mode.startswith('render') and name.startswith('bomb'):
+                    continue
+                output = subprocess.run(
+                    [sys.executable, __file__, '--mode', mode, '--file', path,
+                     '--repeat', str(args.repeat)],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'file':<22}{'bytes':>10}  {'mode':<14}{'result':<10}{'ms':>10}{'peak RSS KB':>14}")
+    for r in results:
+        print(f"{r['file']:<22}{r['size']:>10}  {r['mode']:<14}{r['outcome']:<10}"
+              f"{r['ms']:>10}{r['peak_rss_kb']:>14}")
+
+
+if __name__ == '__main__':
+    main()
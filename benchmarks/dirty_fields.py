@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+DirtyFieldsMixin 效益測量
+
+以 OTP 流程與個人資料 PATCH 的模擬工作負載，比較：
+- full：原本的整列寫入（繞過 DirtyFieldsMixin，等同 Django 預設 save()）
+- dirty：只寫入有變動的欄位，沒有變動時略過 UPDATE
+
+每種模式使用獨立的 SQLite WAL 資料庫，統計 UPDATE 次數、寫入列數與 WAL 成長的位元組數。
+
+使用方式：
+    python benchmarks/dirty_fields.py
+    python benchmarks/dirty_fields.py --users 500 --rounds 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def run_workload(mode, users, rounds):
+    """在子行程中執行，回傳統計結果"""
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+    from django.conf import settings
+
+    workdir = tempfile.mkdtemp(prefix='bench-dirty-')
+    db_path = os.path.join(workdir, 'bench.sqlite3')
+    django.setup()
+    settings.DATABASES['default']['NAME'] = db_path
+
+    from django.core.management import call_command
+    from django.db import connection, models
+    from django.utils import timezone
+
+    from edit_profile.models import UserProfile
+    from phone_auth.models import CustomUser
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+    for i in range(users):
+        CustomUser.objects.create(username=f'bench{i}', phone_number=f'+8869{i:08d}')
+
+    def save(obj):
+        if mode == 'full':
+            models.Model.save(obj)
+        else:
+            obj.save()
+
+    stats = {'updates': 0, 'rows': 0}
+
+    def count_writes(execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if sql.startswith('UPDATE'):
+            stats['updates'] += 1
+            stats['rows'] += max(context['cursor'].rowcount, 0)
+        return result
+
+    # 重新連線，避免 migrate 留下未結束的 statement 導致無法切換 journal mode
+    connection.close()
+    with connection.cursor() as cursor:
+        for pragma in ('journal_mode=WAL', 'wal_autocheckpoint=0', 'wal_checkpoint(TRUNCATE)'):
+            cursor.execute(f'PRAGMA {pragma}')
+            cursor.fetchall()
+    wal_path = db_path + '-wal'
+    wal_before = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+    start = time.perf_counter()
+    with connection.execute_wrapper(count_writes):
+        for _ in range(rounds):
+            for user in CustomUser.objects.all():
+                # send_otp
+                user.verification_status = CustomUser.VerificationStatus.OTP_SENT
+                user.last_otp_sent_at = timezone.now()
+                user.otp_attempts = 0
+                save(user)
+                # verify_otp
+                user.phone_verified = True
+                user.verification_status = CustomUser.VerificationStatus.VERIFIED
+                user.otp_attempts = 0
+                save(user)
+            for profile in UserProfile.objects.all():
+                # PATCH 送出與現有資料相同的值（常見於前端送整份表單）
+                profile.nickname = profile.nickname
+                profile.gender = profile.gender
+                save(profile)
+                # PATCH 只修改一個欄位
+                profile.motivation_1 = f'round-{time.perf_counter_ns()}'
+                save(profile)
+    elapsed = time.perf_counter() - start
+
+    wal_after = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    return {
+        'mode': mode,
+        'updates': stats['updates'],
+        'rows_written': stats['rows'],
+        'wal_bytes': wal_after - wal_before,
+        'seconds': round(elapsed, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DirtyFieldsMixin 效益測量')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--mode', choices=['full', 'dirty'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_workload(args.mode, args.users, args.rounds)))
+        return
+
+    results = []
+    for mode in ('full', 'dirty'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode,
+             '--users', str(args.users), '--rounds', str(args.rounds)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<8}{'UPDATE':>10}{'rows':>10}{'WAL bytes':>14}{'seconds':>10}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['updates']:>10}{r['rows_written']:>10}"
+              f"{r['wal_bytes']:>14}{r['seconds']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+圖片處理對同一行程其他請求的影響
+
+模擬一個多執行緒 worker：數個「請求」執行緒持續處理小型工作
+（序列化一份個人資料），同時有執行緒不斷產生頭像縮圖（4000x3000 JPEG）。
+
+比較三種模式下請求執行緒的吞吐量與延遲：
+- idle：沒有圖片處理
+- inline：在同一行程中處理圖片（IMAGE_POOL WORKERS=0）
+- pool：交給 image_pool 的子行程處理
+
+每種模式在獨立子行程中執行。
+
+使用方式：
+    python benchmarks/image_pool.py
+    python benchmarks/image_pool.py --duration 10 --threads 8 --renderers 4
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+MODES = ('idle', 'inline', 'pool')
+
+PROFILE = {
+    'id': 1,
+    'nickname': '測試使用者',
+    'gender': 'other',
+    'age': 30,
+    'education': 'bachelor',
+    'motivations': ['交友', '學習', '工作'] * 5,
+    'avatar_renditions': {
+        str(size): {'webp': f'https://example.com/avatars/{size}.webp',
+                    'jpeg': f'https://example.com/avatars/{size}.jpg'}
+        for size in (64, 128, 512)
+    },
+}
+
+
+def handle_request():
+    """模擬一次請求的 CPU 工作（約數百微秒的純 Python 處理）"""
+    for _ in range(20):
+        json.loads(json.dumps(PROFILE, ensure_ascii=False))
+
+
+def run_mode(mode, duration, threads, renderers):
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from PIL import Image
+
+    from edit_profile import image_pool
+    from edit_profile.imaging import render_renditions
+
+    settings.IMAGE_POOL = {'WORKERS': 0 if mode == 'inline' else renderers}
+
+    gradient = Image.linear_gradient('L').resize((1024, 1024))
+    photo = Image.merge('RGB', (gradient, gradient.rotate(90), gradient.rotate(180)))
+    buffer = io.BytesIO()
+    photo.resize((4000, 3000)).save(buffer, 'JPEG', quality=90)
+    content = buffer.getvalue()
+
+    if mode == 'pool':
+        # 預先啟動子行程，不計入測量時間
+        image_pool.run(os.getpid)
+
+    stop = threading.Event()
+    latencies = []
+    rendered = [0]
+
+    def request_loop():
+        local = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            handle_request()
+            local.append(time.perf_counter() - start)
+        latencies.extend(local)
+
+    def render_loop():
+        while not stop.is_set():
+            image_pool.run(render_renditions, io.BytesIO(content), (64, 128, 512))
+            rendered[0] += 1
+
+    workers = [threading.Thread(target=request_loop) for _ in range(threads)]
+    if mode != 'idle':
+        workers += [threading.Thread(target=render_loop) for _ in range(renderers)]
+    for worker in workers:
+        worker.start()
+    time.sleep(duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    image_pool.shutdown()
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'requests_per_sec': round(len(latencies) / duration, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        'renders': rendered[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='圖片處理對其他請求的影響')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--threads', type=int, default=4, help='請求執行緒數')
+    parser.add_argument('--renderers', type=int, default=2, help='圖片處理執行緒數（pool 模式的子行程數）')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.duration, args.threads, args.renderers)))
+        return
+
+    results = []
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--duration', str(args.duration),
+             '--threads', str(args.threads), '--renderers', str(args.renderers)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'renders':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['requests_per_sec']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['renders']:>10}")
+
+
+if __name__ == '__main__':
+    main()
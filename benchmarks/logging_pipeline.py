@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+日誌 I/O 對 request 延遲的影響
+
+以多個執行緒（模擬 gunicorn 的 gthread worker）同時呼叫：
+- send_otp：使用者剛發送過 OTP，每次都回傳 429 並記錄「請求過於頻繁」的 WARNING
+- GET /api/user/profile/：每次記錄一筆 INFO
+
+比較 settings.LOGGING 的三種設定：
+- sync：logger 直接連到 console 與檔案 handler，在 request 的執行緒中寫入（原本的設定）
+- queued：logger 只連到 QueuedHandler，由背景執行緒寫入，WARNING 經 RateLimitFilter 取樣
+- queued+json：同上，輸出 JSON
+
+console 寫到子行程的 stderr（由父行程讀取），檔案寫到暫存目錄。
+回報 request 的延遲，以及 queued 模式在最後等待佇列寫完的時間（drain ms）。
+
+使用方式：
+    python benchmarks/logging_pipeline.py
+    python benchmarks/logging_pipeline.py --threads 8 --requests 1000
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+MODES = ('sync', 'queued', 'queued+json')
+
+
+def logging_config(mode, log_path):
+    """以 settings.LOGGING 為基礎建立各模式的設定"""
+    from django.conf import settings
+
+    config = copy.deepcopy(settings.LOGGING)
+    config['handlers']['file']['filename'] = log_path
+    if mode == 'sync':
+        del config['handlers']['queue']
+        config['filters'] = {}
+        for logger in config['loggers'].values():
+            logger['handlers'] = ['console', 'file']
+    formatter = 'json' if mode == 'queued+json' else 'verbose'
+    for name in ('console', 'file'):
+        config['handlers'][name]['formatter'] = formatter
+    return config
+
+
+def run_mode(mode, threads, requests):
+    """在子行程中執行，回傳統計結果"""
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+    from django.conf import settings
+
+    workdir = tempfile.mkdtemp(prefix='bench-logging-')
+    django.setup()
+    settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+    settings.DATABASES['otp_logs']['NAME'] = os.path.join(workdir, 'otp_logs.sqlite3')
+    from phone_auth.log_handlers import configure_logging
+    configure_logging(logging_config(mode, os.path.join(workdir, 'phone_auth.log')))
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.utils import timezone
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from edit_profile.views import profile_view
+    from phone_auth.models import CustomUser
+    from phone_auth.views import send_otp
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    call_command('migrate', database='otp_logs', verbosity=0)
+    CustomUser.objects.bulk_create(
+        CustomUser(username=f'log{i}', last_otp_sent_at=timezone.now() + timedelta(days=1))
+        for i in range(threads)
+    )
+    users = list(CustomUser.objects.order_by('pk'))
+    factory = APIRequestFactory()
+
+    def call(view, request, user):
+        force_authenticate(request, user=user)
+        return view(request)
+
+    # 預先建立個人資料
+    for user in users:
+        call(profile_view, factory.get('/api/user/profile/'), user)
+    connection.close()
+
+    latencies = [[] for _ in users]
+
+    def worker(index):
+        user = users[index]
+        for i in range(requests):
+            if i % 2:
+                request = factory.post(
+                    '/auth/phone/send-otp/', {'country_code': '+886', 'phone_number': '912345678'},
+                    format='json'
+                )
+                view = send_otp
+            else:
+                request = factory.get('/api/user/profile/')
+                view = profile_view
+            start = time.perf_counter()
+            call(view, request, user)
+            latencies[index].append(time.perf_counter() - start)
+        connection.close()
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # 等待背景執行緒寫完佇列中的記錄
+    drain_start = time.perf_counter()
+    for handler in logging.getLogger('phone_auth').handlers:
+        handler.flush()
+    drain = time.perf_counter() - drain_start
+
+    timings = sorted(t for worker_latencies in latencies for t in worker_latencies)
+    return {
+        'mode': mode,
+        'requests': len(timings),
+        'requests_per_sec': round(len(timings) / elapsed, 1),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99)] * 1000, 3),
+        'drain_ms': round(drain * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='日誌 I/O 對 request 延遲的影響')
+    parser.add_argument('--threads', type=int, default=4, help='同時執行的執行緒數')
+    parser.add_argument('--requests', type=int, default=500, help='每個執行緒的 request 數')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.threads, args.requests)))
+        return
+
+    results = []
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode,
+             '--threads', str(args.threads), '--requests', str(args.requests)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<14}{'requests':>10}{'req/s':>10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'drain ms':>10}")
+    for r in results:
+        print(f"{r['mode']:<14}{r['requests']:>10}{r['requests_per_sec']:>10}{r['mean_ms']:>10}"
+              f"{r['p50_ms']:>10}{r['p99_ms']:>10}{r['drain_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+SQLite 在 OTP 端點併發寫入下的表現
+
+以多個行程（模擬 gunicorn worker）同時對不同使用者呼叫 send_otp 與 verify_otp，
+每次請求都會更新 CustomUser 並新增 OTPVerificationLog（otp_logs 資料庫）。比較：
+- default：SQLite 預設設定（rollback journal、synchronous=FULL），SQLITE_PRAGMAS = {}
+- tuned：settings.SQLITE_PRAGMAS（WAL、synchronous=NORMAL、busy_timeout 等）
+
+Firebase 的 ID Token 驗證以固定結果取代，只測量資料庫的部分。
+每種模式使用獨立的暫存 SQLite 檔案，回報吞吐量、延遲與失敗（database is locked）次數。
+
+使用方式：
+    python benchmarks/sqlite_otp.py
+    python benchmarks/sqlite_otp.py --workers 8 --users 100
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+MODES = ('default', 'tuned')
+
+
+def phone_of(index):
+    return f'9{index:08d}'
+
+
+def otp_worker(user_ids):
+    """在 fork 出的子行程中依序處理分配到的使用者，回傳 (延遲列表, 失敗次數)"""
+    from unittest import mock
+
+    from django.db import OperationalError
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from phone_auth import views
+    from phone_auth.models import CustomUser
+
+    factory = APIRequestFactory()
+    latencies = []
+    errors = 0
+
+    def call(view, user_id, data):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            # 與 session 認證相同，每個請求重新讀取使用者
+            user = CustomUser.objects.get(pk=user_id)
+            request = factory.post('/', data, format='json')
+            force_authenticate(request, user=user)
+            response = view(request)
+            if response.status_code >= 500:
+                errors += 1
+        except OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+    for user_id, index in user_ids:
+        call(views.send_otp, user_id, {'country_code': '+886', 'phone_number': phone_of(index)})
+        token = {'uid': f'uid-{index}', 'phone_number': f'+886{phone_of(index)}'}
+        with mock.patch('phone_auth.firebase_service.auth.verify_id_token', return_value=token):
+            call(views.verify_otp, user_id, {'verification_id': 'token', 'otp_code': '123456'})
+    return latencies, errors
+
+
+def run_mode(mode, workers, users):
+    """在子行程中執行，回傳統計結果"""
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+    from django.conf import settings
+
+    workdir = tempfile.mkdtemp(prefix='bench-sqlite-')
+    django.setup()
+    settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+    settings.DATABASES['otp_logs']['NAME'] = os.path.join(workdir, 'otp_logs.sqlite3')
+    if mode == 'default':
+        settings.SQLITE_PRAGMAS = {}
+    # 關閉 INFO 日誌，避免日誌 I/O 影響結果
+    logging.disable(logging.INFO)
+
+    from django.core.management import call_command
+    from django.db import connections
+
+    from phone_auth.models import CustomUser
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    call_command('migrate', database='otp_logs', verbosity=0)
+    CustomUser.objects.bulk_create(
+        CustomUser(username=f'otp{i}') for i in range(workers * users)
+    )
+    ids = list(CustomUser.objects.order_by('pk').values_list('pk', flat=True))
+    assignments = [
+        [(ids[w * users + i], w * users + i) for i in range(users)]
+        for w in range(workers)
+    ]
+    # fork 前關閉連線，每個子行程建立自己的連線
+    connections.close_all()
+
+    start = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        results = pool.map(otp_worker, assignments)
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(t for worker_latencies, _ in results for t in worker_latencies)
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 在 OTP 端點併發寫入下的表現')
+    parser.add_argument('--workers', type=int, default=4, help='同時執行的行程數')
+    parser.add_argument('--users', type=int, default=100, help='每個行程處理的使用者數')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.workers, args.users)))
+        return
+
+    results = []
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode,
+             '--workers', str(args.workers), '--users', str(args.users)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['requests']:>10}{r['errors']:>8}{r['requests_per_sec']:>10}"
+              f"{r['p50_ms']:>10}{r['p99_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+資料庫 router
+
+OTPLogRouter：OTPVerificationLog 存放在獨立的資料庫（settings.DATABASES['otp_logs']），
+大量的記錄寫入不會與認證、個人資料的查詢競爭，也不會增加主資料庫的備份大小。
+
+PrimaryReplicaRouter：edit_profile 與 phone_auth 的讀取送往唯讀 replica
+（settings.DATABASE_REPLICAS），寫入一律送往 primary（default）。
+
+replica 會落後 primary，為了讓使用者看到自己剛寫入的資料（read-your-writes）：
+- read_your_writes() 範圍內（一個 request、一筆背景工作）寫入後，範圍內之後的讀取都使用 primary；
+  離開範圍時還原，範圍外的寫入不會讓整個行程（管理指令、worker）都改讀 primary
+- use_primary() 範圍內的讀取一律使用 primary（例如建立會被快取的資料）
+- primary 上有進行中的 transaction（transaction.atomic）時，讀取也使用 primary
+- PrimaryPinningMiddleware：每個 request 都是一個 read_your_writes() 範圍；
+  寫入的 request 會在回應中設定 cookie，之後 settings.DATABASE_PIN_SECONDS 秒內，
+  同一個 client 的 request 都只讀 primary；POST / PUT / PATCH / DELETE request 整個 request 都讀 primary
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+OTP_LOG_DB_ALIAS = 'otp_logs'
+
+PIN_COOKIE_NAME = 'db_pin'
+
+DEFAULT_PIN_SECONDS = 5
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class PinState:
+    """一個 read_your_writes() 範圍的狀態（可變物件，複製的 context 中寫入也會反映回範圍）"""
+
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+# 目前的 read_your_writes() 範圍
+_scope = ContextVar('db_pin_scope', default=None)
+# 是否在 use_primary() 範圍內
+_use_primary = ContextVar('db_use_primary', default=False)
+
+
+def get_replicas():
+    return tuple(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def get_pin_seconds():
+    return getattr(settings, 'DATABASE_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+
+@contextmanager
+def read_your_writes(pinned=False):
+    """
+    read-your-writes 的範圍：範圍內寫入後，之後的讀取都使用 primary
+
+    Args:
+        pinned: 是否一開始就只讀 primary
+
+    Yields:
+        PinState
+    """
+    state = PinState(pinned)
+    token = _scope.set(state)
+    try:
+        yield state
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """範圍內的讀取一律使用 primary"""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def pin_to_primary():
+    """目前的 read_your_writes() 範圍之後的讀取都使用 primary（範圍外不做任何事）"""
+    state = _scope.get()
+    if state is not None:
+        state.pinned = True
+
+
+def is_pinned():
+    if _use_primary.get():
+        return True
+    state = _scope.get()
+    return state is not None and state.pinned
+
+
+class OTPLogRouter:
+    """OTPVerificationLog 的讀寫與 migration 只在 otp_logs 資料庫"""
+
+    app_label = 'phone_auth'
+    model_name = 'otpverificationlog'
+
+    def _is_log(self, model):
+        # model 可以是 model class 或 instance（包含 request.user 的 SimpleLazyObject）
+        return model._meta.app_label == self.app_label and model._meta.model_name == self.model_name
+
+    def db_for_read(self, model, **hints):
+        if self._is_log(model) and OTP_LOG_DB_ALIAS in settings.DATABASES:
+            return OTP_LOG_DB_ALIAS
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 記錄只以 user_id 關聯使用者（沒有外鍵約束）
+        if self._is_log(obj1) or self._is_log(obj2):
+            return True
+        return None
+
+    @staticmethod
+    def _has_user_constraint(model):
+        return model is not None and model._meta.get_field('user').db_constraint
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if OTP_LOG_DB_ALIAS not in settings.DATABASES:
+            return None
+        is_log = app_label == self.app_label and model_name == self.model_name
+        if db == OTP_LOG_DB_ALIAS:
+            if is_log and self._has_user_constraint(hints.get('model')):
+                # 0001 的 OTPVerificationLog 有使用者的外鍵約束，但使用者資料表不在此資料庫，
+                # 資料表改由 0003 建立（沒有約束）
+                return False
+            return is_log
+        if is_log:
+            return False
+        return None
+
+
+class PrimaryReplicaRouter:
+    """讀取送往 replica、寫入送往 primary"""
+
+    route_app_labels = {'edit_profile', 'phone_auth'}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in self.route_app_labels:
+            return None
+        replicas = get_replicas()
+        if not replicas or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in self.route_app_labels:
+            return None
+        state = _scope.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica 與 primary 是同一份資料
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replica 由資料庫本身的複寫同步，不執行 migration
+        if db in get_replicas():
+            return False
+        return None
+
+
+class PrimaryPinningMiddleware:
+    """
+    read-your-writes：每個 request 是一個 read_your_writes() 範圍，
+    寫入後的一段時間內，同一個 client 只讀 primary
+
+    需放在 SessionMiddleware 與 AuthenticationMiddleware 之前，
+    session 與使用者的讀取才會依 pin 狀態選擇資料庫。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned_until = self._pinned_until(request)
+        pinned = request.method in UNSAFE_METHODS or pinned_until > time.time()
+        with read_your_writes(pinned) as state:
+            response = self.get_response(request)
+        if state.wrote:
+            seconds = get_pin_seconds()
+            response.set_cookie(
+                PIN_COOKIE_NAME,
+                str(int(time.time() + seconds)),
+                max_age=seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def _pinned_until(self, request):
+        try:
+            return int(request.COOKIES.get(PIN_COOKIE_NAME, 0))
+        except ValueError:
+            return 0
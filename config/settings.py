@@ -6,8 +6,11 @@ Django 設定檔
 """
 
 import os
+from datetime import timedelta
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
+
+from .database import database_config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,12 +45,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'phone_auth.metrics.MetricsMiddleware',  # 每個 view 的處理時間（需在最前面）
     'django.middleware.security.SecurityMiddleware',
+    'phone_auth.query_metrics.QueryMetricsMiddleware',  # 每個端點的查詢次數與資料庫時間（需在 Session/Auth 之前）
+    'phone_auth.slow_queries.SlowQueryMiddleware',  # 慢查詢記錄與 EXPLAIN（背景執行，需在 QueryMetricsMiddleware 之後）
     'corsheaders.middleware.CorsMiddleware',  # CORS 中介層（需在 CommonMiddleware 之前）
+    'config.routers.PrimaryPinningMiddleware',  # 寫入後短時間內只讀 primary（需在 Session/Auth 之前）
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'phone_auth.timing.PhaseTimingMiddleware',  # Server-Timing 與 access log（需在 AuthenticationMiddleware 之後）
+    'phone_auth.profiling.ProfilingMiddleware',  # staff 的 X-Profile request 效能分析（需在 AuthenticationMiddleware 之後）
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,12 +84,53 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# 以 DATABASE_URL 指定（見 config/database.py），未設定時使用專案目錄下的 SQLite
+
+# 連線設定（default 與 replica 共用）
+database_options = {
+    'base_dir': BASE_DIR,
+    # 連線保留秒數，避免每個 request 重新建立連線（0 表示每次關閉）
+    'conn_max_age': config('DB_CONN_MAX_AGE', default=60, cast=int),
+    'conn_health_checks': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+    # PostgreSQL 單一 SQL 的執行時間上限（毫秒）
+    'statement_timeout': config('DB_STATEMENT_TIMEOUT', default=5000, cast=int),
+    # 經由本機 pgbouncer（transaction pooling）連線
+    'pooler': config('DB_POOLER', default=False, cast=bool),
+}
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+    'default': database_config(config('DATABASE_URL', default='sqlite:///db.sqlite3'), **database_options)
+}
+
+# 唯讀 replica（以逗號分隔的 DATABASE_URL），edit_profile 與 phone_auth 的讀取會送往 replica
+# 測試時 replica 指向 default 的測試資料庫（TEST MIRROR）
+DATABASE_REPLICAS = []
+for index, replica_url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv()), start=1):
+    DATABASES[f'replica_{index}'] = {
+        **database_config(replica_url, **database_options),
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+# OTP 驗證記錄（OTPVerificationLog）使用獨立的資料庫，需另外執行 migrate --database otp_logs
+DATABASES['otp_logs'] = database_config(
+    config('OTP_LOG_DATABASE_URL', default='sqlite:///otp_logs.sqlite3'), **database_options
+)
+
+DATABASE_ROUTERS = ['config.routers.OTPLogRouter', 'config.routers.PrimaryReplicaRouter']
+
+# 寫入後固定讀取 primary 的秒數（read-your-writes，見 config/routers.py）
+DATABASE_PIN_SECONDS = 5
+
+# SQLite 連線調校（phone_auth/sqlite.py），只對 SQLite 連線生效；設為 {} 表示不調整
+# WAL 檔由 python manage.py sqlite_checkpoint 定期寫回並截斷
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),  # 毫秒
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,  # 負數表示 KiB（約 20MB）
+    'temp_store': 'MEMORY',
 }
 
 
@@ -130,6 +180,42 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 
+# 頭像檔案大小上限（上傳時以串流方式檢查）
+AVATAR_MAX_UPLOAD_SIZE = config('AVATAR_MAX_UPLOAD_SIZE', default=5 * 1024 * 1024, cast=int)
+
+# 頭像長寬上限（只讀取檔頭檢查，避免 decompression bomb）
+AVATAR_MAX_IMAGE_DIMENSION = 6000
+AVATAR_MAX_IMAGE_PIXELS = 24_000_000
+
+# 頭像縮圖（由 python manage.py process_avatar_jobs 在背景產生）
+AVATAR_RENDITION_SIZES = (64, 128, 512)
+AVATAR_DEFAULT_RENDITION_SIZE = 128
+
+# 圖片處理行程池（edit_profile/image_pool.py），WORKERS=0 表示在目前行程中執行
+IMAGE_POOL = {
+    'WORKERS': config('IMAGE_POOL_WORKERS', default=2, cast=int),
+    'TIMEOUT': config('IMAGE_POOL_TIMEOUT', default=30, cast=int),
+    'QUEUE_TIMEOUT': 5,
+}
+
+# 頭像檔案提供（edit_profile/serving.py）
+# AVATAR_SENDFILE_BACKEND：'nginx'（X-Accel-Redirect）、'apache'（X-Sendfile），空字串表示由 Django 以 FileResponse 回傳
+AVATAR_SENDFILE_BACKEND = config('AVATAR_SENDFILE_BACKEND', default='')
+AVATAR_SENDFILE_PREFIX = config('AVATAR_SENDFILE_PREFIX', default='/protected-media/')
+AVATAR_SERVE_REQUIRE_AUTH = config('AVATAR_SERVE_REQUIRE_AUTH', default=True, cast=bool)
+AVATAR_SERVE_TOKEN_MAX_AGE = 3600  # sign_avatar_url 產生的簽章 URL 有效秒數
+
+# 頭像直傳（edit_profile/direct_upload.py），預設以本機檔案系統模擬儲存服務
+AVATAR_DIRECT_UPLOAD_BACKEND = config(
+    'AVATAR_DIRECT_UPLOAD_BACKEND',
+    default='edit_profile.direct_upload.LocalDirectUploadBackend'
+)
+AVATAR_DIRECT_UPLOAD_EXPIRES = 300  # 上傳 URL 有效秒數
+
+# 可續傳的分段上傳 session 有效時間（過期後由 cleanup_avatar_uploads 清除）
+AVATAR_UPLOAD_SESSION_TTL = timedelta(hours=24)
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -148,8 +234,8 @@ REST_FRAMEWORK = {
     
     # 預設認證方式
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'phone_auth.authentication.SessionAuthentication',
+        'phone_auth.authentication.BasicAuthentication',
     ],
     
     # OpenAPI Schema 設定
@@ -225,10 +311,90 @@ FIREBASE_CREDENTIALS_PATH = config(
 )
 
 
+# ============================================================
+# 後端服務設定
+# ============================================================
+
+# 內部服務呼叫用的 token，格式：服務名稱:token，以逗號分隔
+# 例如：SERVICE_API_TOKENS=matching:xxxx,counseling:yyyy
+SERVICE_API_TOKENS = dict(
+    item.split(':', 1)
+    for item in config('SERVICE_API_TOKENS', default='', cast=Csv())
+    if ':' in item
+)
+
+# 批次查詢個人資料時一次最多可指定的 ID 數量
+PROFILE_BULK_MAX_IDS = config('PROFILE_BULK_MAX_IDS', default=500, cast=int)
+
+
+# ============================================================
+# 快取設定
+# ============================================================
+
+# 多個 worker 部署時請改用 Redis / Memcached 等共用快取
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': config('CACHE_LOCATION', default='phone-auth-default'),
+    }
+}
+
+# 個人資料回應快取（edit_profile/cache.py）
+PROFILE_CACHE = {
+    'ENABLED': config('PROFILE_CACHE_ENABLED', default=True, cast=bool),
+    'TIMEOUT': config('PROFILE_CACHE_TIMEOUT', default=300, cast=int),
+    'LOCAL_MAX_ENTRIES': 1024,
+    'BETA': 1.0,
+}
+
+# 行程內 metrics 與 /metrics/ 端點（phone_auth/metrics.py）
+# 多個 gunicorn worker 時設定 METRICS_DIRECTORY，各 worker 的數值寫入該目錄下的 mmap 檔案後加總
+METRICS = {
+    'ENABLED': config('METRICS_ENABLED', default=True, cast=bool),
+    'DIRECTORY': config('METRICS_DIRECTORY', default=''),
+}
+
+# 每個端點的查詢次數與資料庫時間（phone_auth/query_metrics.py）
+QUERY_METRICS = {
+    'ENABLED': config('QUERY_METRICS_ENABLED', default=True, cast=bool),
+}
+
+# 每個 request 的階段時間：Server-Timing header 與 access log（phone_auth/timing.py）
+SERVER_TIMING = {
+    'ENABLED': config('SERVER_TIMING_ENABLED', default=False, cast=bool),
+    'ACCESS_LOG': True,
+}
+
+# staff 以 X-Profile header 或 ?_profile=1 要求的 request 效能分析（phone_auth/profiling.py）
+# 結果在 /debug/profiles/ 列出與下載；多個 worker 共用同一個目錄，只保留最新的 MAX_DUMPS 個
+PROFILING = {
+    'ENABLED': config('PROFILING_ENABLED', default=True, cast=bool),
+    'DIRECTORY': config('PROFILING_DIRECTORY', default=os.path.join(BASE_DIR, 'logs', 'profiles')),
+    'MAX_DUMPS': config('PROFILING_MAX_DUMPS', default=20, cast=int),
+}
+
+# 慢查詢記錄（phone_auth/slow_queries.py），以 python manage.py slow_queries 查看
+SLOW_QUERIES = {
+    'ENABLED': config('SLOW_QUERY_ENABLED', default=True, cast=bool),
+    'THRESHOLD_MS': config('SLOW_QUERY_THRESHOLD_MS', default=100, cast=int),
+    'EXPLAIN': True,
+}
+
+
 # ============================================================
 # Logging 設定
 # ============================================================
 
+# 日誌：logger 只把記錄放進佇列，由每個 worker 的背景執行緒寫入 console 與檔案（phone_auth/log_handlers.py）
+# LOG_FORMAT=json 時每筆記錄輸出一行 JSON（含 access log 的 view、status、phases、queries）
+LOG_FORMAT = config('LOG_FORMAT', default='verbose')
+
+# Python 3.11 的 dictConfig 不會解析 QueueHandler 的 handlers（3.12 起內建），由 configure_logging 補上
+LOGGING_CONFIG = 'phone_auth.log_handlers.configure_logging'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -237,26 +403,50 @@ LOGGING = {
             'format': '[{levelname}] {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'phone_auth.log_handlers.JSONFormatter',
+        },
+    },
+    'filters': {
+        # 相同的 WARNING 訊息每 LOG_WARNING_PERIOD 秒只保留前 LOG_WARNING_RATE 筆
+        'warning_rate_limit': {
+            '()': 'phone_auth.log_handlers.RateLimitFilter',
+            'rate': config('LOG_WARNING_RATE', default=10, cast=int),
+            'per': config('LOG_WARNING_PERIOD', default=60, cast=int),
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'formatter': LOG_FORMAT,
         },
         'file': {
             'class': 'logging.FileHandler',
             'filename': os.path.join(BASE_DIR, 'logs', 'phone_auth.log'),
-            'formatter': 'verbose',
+            'formatter': LOG_FORMAT,
+        },
+        'queue': {
+            'class': 'phone_auth.log_handlers.QueuedHandler',
+            'handlers': ['console', 'file'],
+            'respect_handler_level': True,
+            # 佇列已滿時捨棄記錄
+            'queue': {'()': 'queue.Queue', 'maxsize': 10000},
+            'filters': ['warning_rate_limit'],
         },
     },
     'loggers': {
         'phone_auth': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'edit_profile': {
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False,
         },
         'firebase_admin': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'WARNING',
             'propagate': False,
         },
@@ -14,6 +14,10 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from edit_profile.serving import serve_avatar
+from phone_auth.metrics import metrics_view
+from phone_auth.profiling import profile_download, profile_list
+
 urlpatterns = [
     # Django Admin
     path('admin/', admin.site.urls),
@@ -24,6 +28,16 @@ urlpatterns = [
     # 個人資料編輯 API
     path('api/user/', include('edit_profile.urls')),
     
+    # 頭像檔案（授權後交由前端代理傳送，見 edit_profile/serving.py）
+    path(f"{settings.MEDIA_URL.lstrip('/')}avatars/<path:path>", serve_avatar, name='serve_avatar'),
+    
+    # Prometheus metrics（只限 staff，見 phone_auth/metrics.py）
+    path('metrics/', metrics_view, name='metrics'),
+    
+    # request 效能分析結果（只限 staff，見 phone_auth/profiling.py）
+    path('debug/profiles/', profile_list, name='profile_list'),
+    path('debug/profiles/<str:profile_id>/', profile_download, name='profile_download'),
+    
     # OpenAPI Schema (JSON/YAML)
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     
@@ -3,7 +3,7 @@
 """
 
 from django.contrib import admin
-from .models import UserProfile
+from .models import AvatarBlob, AvatarProcessingJob, UserProfile
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -14,3 +14,16 @@ class UserProfileAdmin(admin.ModelAdmin):
     def created_at(self, obj):
         return obj.user.date_joined
     created_at.short_description = '建立時間'
+
+
+@admin.register(AvatarProcessingJob)
+class AvatarProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ('profile', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
+
+@admin.register(AvatarBlob)
+class AvatarBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'ref_count', 'created_at')
+    search_fields = ('name',)
@@ -10,3 +10,7 @@ class EditProfileConfig(AppConfig):
     name = 'edit_profile'
     verbose_name = '個人資料編輯'
 
+    def ready(self):
+        # 註冊 signal（快取失效）
+        from . import signals  # noqa: F401
+
@@ -0,0 +1,62 @@
+"""
+後端服務認證
+
+提供給內部服務（例如配對、諮商服務）呼叫的認證方式，
+以 settings.SERVICE_API_TOKENS 中設定的 token 辨識呼叫的服務。
+
+Request Header:
+    Authorization: Service <token>
+"""
+
+import hmac
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import BasePermission
+
+from phone_auth.timing import phase
+
+
+class ServiceClient:
+    """已通過認證的後端服務（放在 request.auth）"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class ServiceTokenAuthentication(BaseAuthentication):
+    """以 `Authorization: Service <token>` 認證後端服務"""
+
+    keyword = 'Service'
+
+    def authenticate(self, request):
+        with phase('auth'):
+            return self._authenticate(request)
+
+    def _authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Service token 格式錯誤')
+
+        token = auth[1].decode(errors='ignore')
+        for name, expected in getattr(settings, 'SERVICE_API_TOKENS', {}).items():
+            if expected and hmac.compare_digest(token, expected):
+                return (AnonymousUser(), ServiceClient(name))
+        raise exceptions.AuthenticationFailed('無效的 service token')
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class IsServiceClient(BasePermission):
+    """只允許通過 ServiceTokenAuthentication 的後端服務"""
+
+    def has_permission(self, request, view):
+        return isinstance(request.auth, ServiceClient)
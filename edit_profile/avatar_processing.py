@@ -0,0 +1,248 @@
+"""
+頭像背景處理
+
+上傳頭像時 request 只負責儲存原始檔並建立 AvatarProcessingJob，
+由背景 worker（python manage.py process_avatar_jobs）產生固定尺寸的縮圖：
+
+- 尺寸：64 / 128 / 512（settings.AVATAR_RENDITION_SIZES）
+- 格式：WebP，另附 JPEG 給不支援 WebP 的客戶端
+- 依 EXIF 方向轉正後輸出，縮圖不含任何 EXIF（包含 GPS 等個資）
+
+縮圖與原始檔一樣以內容雜湊命名（見 storage.py），並由 AvatarBlob 計算參照。
+完成後將縮圖 URL 寫入 UserProfile.avatar_renditions，
+avatar_url 改為指向預設尺寸（settings.AVATAR_DEFAULT_RENDITION_SIZE）的 WebP 縮圖。
+圖片的解碼與編碼（imaging.py）交給 image_pool 的子行程執行。
+"""
+
+import io
+import logging
+from datetime import timedelta
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from config.routers import read_your_writes
+
+from . import image_pool
+from .cache import invalidate_profile
+from .imaging import RENDITION_FORMATS, render_renditions
+from .models import AvatarBlob, AvatarProcessingJob, UserProfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RENDITION_SIZES = (64, 128, 512)
+DEFAULT_RENDITION_SIZE = 128
+
+# 失敗後最多重試次數
+MAX_ATTEMPTS = 3
+
+# 第 n 次失敗後延後 RETRY_BACKOFF * 2^(n-1) 再重試，避免暫時性錯誤在瞬間耗盡重試次數
+RETRY_BACKOFF = timedelta(seconds=30)
+
+# RUNNING 超過此時間視為 worker 已中斷，重新排入佇列
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+
+
+def get_rendition_sizes():
+    return tuple(getattr(settings, 'AVATAR_RENDITION_SIZES', DEFAULT_RENDITION_SIZES))
+
+
+def get_default_rendition_size():
+    return getattr(settings, 'AVATAR_DEFAULT_RENDITION_SIZE', DEFAULT_RENDITION_SIZE)
+
+
+def enqueue_avatar_processing(profile, base_url):
+    """
+    建立頭像處理工作
+
+    Args:
+        profile: 已儲存新頭像的 UserProfile
+        base_url: 網站根網址（例如 request.build_absolute_uri('/')）
+    """
+    return AvatarProcessingJob.objects.create(
+        profile=profile,
+        source_name=profile.avatar.name,
+        base_url=base_url
+    )
+
+
+def requeue_stale_jobs():
+    """將 worker 中斷而卡在 RUNNING 的工作重新排入佇列"""
+    return AvatarProcessingJob.objects.filter(
+        status=AvatarProcessingJob.Status.RUNNING,
+        started_at__lt=timezone.now() - STALE_JOB_TIMEOUT
+    ).update(status=AvatarProcessingJob.Status.PENDING)
+
+
+def claim_next_job():
+    """
+    取得下一筆待處理工作
+
+    以條件式 UPDATE 搶占工作（WHERE status='PENDING'），
+    多個 worker 同時執行時同一筆工作只會被一個 worker 取得。
+    失敗後等待重試（run_after 在未來）的工作不會被取得。
+
+    Returns:
+        AvatarProcessingJob | None
+    """
+    candidates = (
+        AvatarProcessingJob.objects.filter(
+            status=AvatarProcessingJob.Status.PENDING,
+            run_after__lte=timezone.now()
+        )
+        .order_by('created_at')
+        .values_list('pk', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = AvatarProcessingJob.objects.filter(
+            pk=job_id,
+            status=AvatarProcessingJob.Status.PENDING
+        ).update(
+            status=AvatarProcessingJob.Status.RUNNING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            try:
+                return AvatarProcessingJob.objects.select_related('profile').get(pk=job_id)
+            except Exception:
+                # 已搶占但無法載入，放回佇列而不是等 requeue_stale_jobs
+                AvatarProcessingJob.objects.filter(pk=job_id).update(status=AvatarProcessingJob.Status.PENDING)
+                raise
+    return None
+
+
+# 不再處理的狀態（才記錄完成時間）
+TERMINAL_STATUSES = {
+    AvatarProcessingJob.Status.DONE,
+    AvatarProcessingJob.Status.FAILED,
+    AvatarProcessingJob.Status.SUPERSEDED,
+}
+
+
+def _finish(job, status, error_message=None, run_after=None):
+    job.status = status
+    job.error_message = error_message
+    job.finished_at = timezone.now() if status in TERMINAL_STATUSES else None
+    update_fields = ['status', 'error_message', 'finished_at']
+    if run_after is not None:
+        job.run_after = run_after
+        update_fields.append('run_after')
+    job.save(update_fields=update_fields)
+
+
+def process_job(job):
+    """
+    處理一筆頭像工作：產生縮圖、儲存並寫回 UserProfile
+
+    若處理期間使用者已上傳新頭像，結果會被捨棄（SUPERSEDED）。
+    任何步驟失敗時放回佇列，延後（指數退避）重試，超過 MAX_ATTEMPTS 次後標記為 FAILED。
+    """
+    try:
+        _process_job(job)
+    except Exception as e:
+        logger.error("頭像處理工作 %s 失敗（第 %s 次）：%s", job.pk, job.attempts, e)
+        if job.attempts < MAX_ATTEMPTS:
+            run_after = timezone.now() + RETRY_BACKOFF * 2 ** max(job.attempts - 1, 0)
+            _finish(job, AvatarProcessingJob.Status.PENDING, str(e), run_after=run_after)
+        else:
+            _finish(job, AvatarProcessingJob.Status.FAILED, str(e))
+
+
+def _process_job(job):
+    profile = job.profile
+    if profile.avatar.name != job.source_name:
+        _finish(job, AvatarProcessingJob.Status.SUPERSEDED)
+        return
+
+    storage = profile.avatar.storage
+    with storage.open(job.source_name, 'rb') as source:
+        data = source.read()
+    # 解碼、縮放與編碼在 image_pool 的子行程中執行
+    rendered = image_pool.run(render_renditions, io.BytesIO(data), get_rendition_sizes())
+
+    renditions = {}
+    files = []
+    for size, outputs in rendered.items():
+        renditions[str(size)] = {}
+        for key, data in outputs.items():
+            extension = RENDITION_FORMATS[key][1]
+            name = storage.save(
+                f'avatars/renditions/{profile.pk}/{job.pk}_{size}.{extension}',
+                ContentFile(data)
+            )
+            files.append(name)
+            renditions[str(size)][key] = urljoin(job.base_url, storage.url(name))
+    # 儲存到一半失敗時已寫入的檔案沒有參照，由 gc_avatars 清除
+    AvatarBlob.objects.acquire(files)
+
+    try:
+        replaced = _swap_renditions(profile, job, renditions, files)
+    except BaseException:
+        AvatarBlob.objects.release(files, storage)
+        raise
+
+    if replaced is None:
+        AvatarBlob.objects.release(files, storage)
+        _finish(job, AvatarProcessingJob.Status.SUPERSEDED)
+        return
+
+    invalidate_profile(profile.user_id)
+    _finish(job, AvatarProcessingJob.Status.DONE)
+    logger.info("頭像處理工作 %s 完成：profile=%s", job.pk, profile.pk)
+
+
+def _swap_renditions(profile, job, renditions, files):
+    """
+    將縮圖寫入 UserProfile，並釋放被取代的縮圖
+
+    鎖定資料列後讀取目前的縮圖清單、寫入新縮圖並釋放舊縮圖，三者在同一個交易中完成，
+    同一個頭像的兩筆工作並行完成時，各自釋放的都是實際被自己取代的清單。
+    只在頭像仍是這次處理的原始檔時寫入，避免覆蓋之後上傳的頭像。
+
+    Returns:
+        list | None: 被取代的縮圖檔案；頭像已更換時回傳 None
+    """
+    default_size = str(get_default_rendition_size())
+    default_url = renditions.get(default_size, {}).get('webp')
+
+    values = {
+        'avatar_renditions': renditions,
+        'avatar_rendition_files': files,
+        'version': F('version') + 1,
+    }
+    if default_url:
+        values['avatar_url'] = default_url
+
+    db = router.db_for_write(UserProfile)
+    with transaction.atomic(using=db):
+        queryset = UserProfile.objects.using(db).filter(pk=profile.pk, avatar=job.source_name)
+        replaced = queryset.select_for_update().values_list('avatar_rendition_files', flat=True).first()
+        if replaced is None:
+            return None
+        queryset.update(**values)
+        AvatarBlob.objects.release(replaced or [], profile.avatar.storage)
+    return replaced
+
+
+def run_pending_jobs(max_jobs=None):
+    """
+    處理佇列中的工作直到佇列清空（或達到 max_jobs）
+
+    Returns:
+        int: 處理的工作數
+    """
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        # 每筆工作是一個 read-your-writes 範圍：搶占後讀取 primary，處理完不影響下一筆的讀取
+        with read_your_writes():
+            job = claim_next_job()
+            if job is None:
+                break
+            process_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,218 @@
+"""
+個人資料回應快取
+
+將序列化後的個人資料（ProfileResponseSerializer 的輸出）放進兩層快取：
+
+1. L1：行程內 LRU，省去每次向快取伺服器取值與反序列化的成本
+2. L2：Django cache backend（settings.CACHES），跨 worker 共用
+
+快取 key 以「每位使用者的版本號」組成，更新資料時只需遞增版本號，
+舊的 key 自然失效，不必逐一刪除。
+
+為避免熱門 key 過期時大量請求同時打到資料庫（cache stampede）：
+- 使用 probabilistic early refresh（XFetch），在過期前由少數請求提前重建
+- 以 cache.add 實作的 per-key lock，確保同一時間只有一個請求重建
+"""
+
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# 預設設定，可在 settings.PROFILE_CACHE 中覆寫
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',   # 使用的 Django cache alias（L2）
+    'TIMEOUT': 300,             # 快取存活秒數
+    'LOCAL_MAX_ENTRIES': 1024,  # L1 LRU 最大筆數（0 表示停用 L1）
+    'BETA': 1.0,                # XFetch 係數，越大越早重建
+    'LOCK_TIMEOUT': 10,         # 重建鎖的存活秒數
+    'LOCK_WAIT': 0.5,           # 等待其他請求重建的最長秒數
+    'KEY_PREFIX': 'profile',
+}
+
+
+def get_setting(name):
+    """讀取 PROFILE_CACHE 設定，未設定時使用預設值"""
+    return getattr(settings, 'PROFILE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class LocalLRUCache:
+    """
+    執行緒安全的行程內 LRU 快取（L1）
+
+    只存放帶版本號的 key，因此不需要主動清除；
+    版本號改變後舊資料會被 LRU 自然淘汰。
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalLRUCache(get_setting('LOCAL_MAX_ENTRIES'))
+
+
+def _backend():
+    return caches[get_setting('CACHE_ALIAS')]
+
+
+def _version_key(user_id):
+    return f"{get_setting('KEY_PREFIX')}:ver:{user_id}"
+
+
+def _data_key(user_id, version):
+    return f"{get_setting('KEY_PREFIX')}:data:{user_id}:{version}"
+
+
+def _lock_key(data_key):
+    return f"{data_key}:lock"
+
+
+def _new_version():
+    # 以毫秒時間戳作為版本號，即使版本 key 被淘汰也不會撞到舊的資料 key
+    return int(time.time() * 1000)
+
+
+def get_version(user_id):
+    """取得使用者目前的快取版本號，不存在時建立"""
+    backend = _backend()
+    key = _version_key(user_id)
+    version = backend.get(key)
+    if version is None:
+        backend.add(key, _new_version(), None)
+        version = backend.get(key)
+    return version
+
+
+def _bump_version(user_id):
+    backend = _backend()
+    key = _version_key(user_id)
+    try:
+        backend.incr(key)
+    except ValueError:
+        # 版本 key 不存在（尚未快取或已被淘汰）
+        backend.set(key, _new_version(), None)
+
+
+def invalidate_profile(user_id):
+    """
+    使指定使用者的個人資料快取失效
+
+    立即遞增一次版本號，並在交易提交後再遞增一次，
+    避免交易提交前有其他請求把舊資料重新寫回快取。
+    """
+    if not get_setting('ENABLED'):
+        return
+    _bump_version(user_id)
+    transaction.on_commit(lambda: _bump_version(user_id))
+
+
+def _should_refresh_early(entry):
+    """XFetch：依重建耗時與剩餘時間，機率性地提前重建"""
+    _, delta, expiry = entry
+    beta = get_setting('BETA')
+    return time.time() - delta * beta * math.log(random.random()) >= expiry
+
+
+def _rebuild(data_key, builder):
+    start = time.time()
+    payload = builder()
+    delta = time.time() - start
+    timeout = get_setting('TIMEOUT')
+    entry = (payload, delta, time.time() + timeout)
+    _backend().set(data_key, entry, timeout)
+    local_cache.set(data_key, entry)
+    return payload
+
+
+def _lookup(data_key):
+    """依序查詢 L1、L2，L2 命中時回填 L1"""
+    entry = local_cache.get(data_key)
+    if entry is None or entry[2] <= time.time():
+        entry = _backend().get(data_key)
+        if entry is not None:
+            local_cache.set(data_key, entry)
+    return entry
+
+
+def peek_profile_payload(user_id):
+    """
+    只讀取快取中的個人資料 payload，未命中時不重建
+
+    Returns:
+        dict | None
+    """
+    if not get_setting('ENABLED'):
+        return None
+    entry = _lookup(_data_key(user_id, get_version(user_id)))
+    return entry[0] if entry is not None else None
+
+
+def get_profile_payload(user_id, builder):
+    """
+    取得快取的個人資料 payload
+
+    Args:
+        user_id: 使用者 ID
+        builder: 無參數函式，快取未命中時呼叫以產生 payload（需可 pickle）
+
+    Returns:
+        dict: 個人資料 payload
+    """
+    if not get_setting('ENABLED'):
+        return builder()
+
+    backend = _backend()
+    data_key = _data_key(user_id, get_version(user_id))
+
+    entry = _lookup(data_key)
+    if entry is not None and not _should_refresh_early(entry):
+        return entry[0]
+
+    lock_key = _lock_key(data_key)
+    if backend.add(lock_key, 1, get_setting('LOCK_TIMEOUT')):
+        try:
+            return _rebuild(data_key, builder)
+        finally:
+            backend.delete(lock_key)
+
+    # 其他請求正在重建：有舊資料就先回傳舊資料
+    if entry is not None:
+        return entry[0]
+
+    # 沒有舊資料時短暫等待重建結果，逾時則自行產生（不寫入快取）
+    deadline = time.time() + get_setting('LOCK_WAIT')
+    while time.time() < deadline:
+        time.sleep(0.02)
+        entry = backend.get(data_key)
+        if entry is not None:
+            local_cache.set(data_key, entry)
+            return entry[0]
+    return builder()
@@ -0,0 +1,277 @@
+"""
+頭像直傳（presigned upload）
+
+客戶端不經過 Django worker 上傳圖片內容：
+
+1. POST /api/user/avatar/direct/：取得短效的簽章上傳 URL 與 upload_id
+2. 客戶端以 PUT 將圖片直接上傳到該 URL（儲存服務）
+3. POST /api/user/avatar/direct/confirm/：帶回 upload_id，
+   伺服器只讀取物件開頭（HEAD_READ_BYTES）檢查格式與長寬，
+   通過後依儲存服務在上傳時計算的 SHA-256 將物件移到頭像 storage 的內容定址檔名
+   （avatars/ab/cd/<sha256>.<ext>）並更新頭像，圖片內容同樣不經過 Django worker
+
+儲存服務由 settings.AVATAR_DIRECT_UPLOAD_BACKEND 指定。
+LocalDirectUploadBackend 以本機檔案系統模擬，供開發與測試使用；
+正式環境可實作相同介面對接物件儲存（例如 S3 的 presigned PUT URL）。
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+# 上傳 URL 的有效秒數
+DEFAULT_UPLOAD_EXPIRES = 300
+
+# upload_id 的有效秒數（上傳完成後需在此時間內確認）
+DEFAULT_CONFIRM_WINDOW = 3600
+
+UPLOAD_ID_SALT = 'edit_profile.direct_upload.confirm'
+
+KEY_RE = re.compile(r'^\d+/[0-9a-f]{32}$')
+
+# 確認時讀取的物件開頭大小（圖片檔頭與 EXIF 等 metadata 都在此範圍內）
+HEAD_READ_BYTES = 256 * 1024
+
+
+def get_upload_expires():
+    return getattr(settings, 'AVATAR_DIRECT_UPLOAD_EXPIRES', DEFAULT_UPLOAD_EXPIRES)
+
+
+def get_direct_upload_backend():
+    path = getattr(
+        settings,
+        'AVATAR_DIRECT_UPLOAD_BACKEND',
+        'edit_profile.direct_upload.LocalDirectUploadBackend'
+    )
+    return import_string(path)()
+
+
+def make_upload_id(user, key):
+    """將物件 key 與使用者綁定後簽章，確認時只接受同一位使用者"""
+    return signing.dumps({'u': user.pk, 'k': key}, salt=UPLOAD_ID_SALT)
+
+
+def read_upload_id(user, upload_id):
+    """
+    驗證 upload_id
+
+    Returns:
+        str | None: 物件 key；簽章錯誤、過期或不屬於該使用者時回傳 None
+    """
+    max_age = getattr(settings, 'AVATAR_DIRECT_UPLOAD_CONFIRM_WINDOW', DEFAULT_CONFIRM_WINDOW)
+    try:
+        data = signing.loads(upload_id, salt=UPLOAD_ID_SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    if data.get('u') != user.pk or not KEY_RE.match(data.get('k', '')):
+        return None
+    return data['k']
+
+
+def new_object_key(user):
+    return f'{user.pk}/{uuid.uuid4().hex}'
+
+
+class LocalDirectUploadBackend:
+    """
+    以本機檔案系統模擬物件儲存的直傳服務
+
+    上傳 URL 指向 local_direct_upload view（帶有簽章 token），
+    檔案存放在 settings.AVATAR_DIRECT_UPLOAD_ROOT（預設 BASE_DIR/private/direct-uploads/）。
+    尚未驗證的內容不可放在 MEDIA_ROOT 下，否則可經由 static() 或代理直接以 URL 存取；
+    此目錄應與 MEDIA_ROOT 位於同一個檔案系統，確認時才能以改名移動物件。
+
+    每個物件旁有一個 <key>.sha256 紀錄檔：第一次 PUT 時以 O_EXCL 建立（之後的 PUT 一律拒絕，
+    簽章 URL 在有效期間內也只能使用一次），上傳完成後寫入內容的 SHA-256，
+    對應物件儲存在上傳時計算的 checksum（例如 S3 的 x-amz-checksum-sha256）。
+    """
+
+    token_salt = 'edit_profile.direct_upload.local'
+
+    @property
+    def root(self):
+        return getattr(settings, 'AVATAR_DIRECT_UPLOAD_ROOT', None) or os.path.join(
+            settings.BASE_DIR, 'private', 'direct-uploads'
+        )
+
+    def path(self, key):
+        if not KEY_RE.match(key):
+            raise ValueError(f'不合法的物件 key：{key}')
+        return os.path.join(self.root, *key.split('/'))
+
+    def _digest_path(self, key):
+        return self.path(key) + '.sha256'
+
+    def create_upload(self, request, key, content_type, max_size):
+        """
+        產生上傳資訊
+
+        Returns:
+            dict: url、method 與客戶端需帶上的 headers
+        """
+        token = signing.dumps({'k': key, 'm': max_size, 't': content_type}, salt=self.token_salt)
+        url = request.build_absolute_uri(
+            reverse('edit_profile:local_direct_upload', args=[token])
+        )
+        return {'url': url, 'method': 'PUT', 'headers': {'Content-Type': content_type}}
+
+    def read_token(self, token):
+        return signing.loads(token, salt=self.token_salt, max_age=get_upload_expires())
+
+    def claim(self, key):
+        """
+        標記 key 已被使用（第一次 PUT 時呼叫）
+
+        Returns:
+            bool: 已被使用過時回傳 False
+        """
+        path = self._digest_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        except FileExistsError:
+            return False
+        return True
+
+    def save(self, key, stream, length):
+        """
+        將上傳內容寫入暫存檔並計算 SHA-256，完成後才改名為物件路徑
+
+        須先以 claim() 取得 key；寫入失敗時釋放，客戶端可用同一個 URL 重新上傳。
+        """
+        path = self.path(key)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.part-')
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as temp_file:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(64 * 1024, remaining))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    remaining -= len(chunk)
+            if remaining:
+                raise IOError('上傳內容不完整')
+            os.replace(temp_path, path)
+            with open(self._digest_path(key), 'w') as digest_file:
+                digest_file.write(digest.hexdigest())
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if not os.path.exists(path):
+                os.remove(self._digest_path(key))
+            raise
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def digest(self, key):
+        """物件內容的 SHA-256（hex），於上傳時計算"""
+        with open(self._digest_path(key)) as digest_file:
+            return digest_file.read().strip()
+
+    def read(self, key, length):
+        """讀取物件開頭最多 length bytes（對應物件儲存的 Range GET）"""
+        with open(self.path(key), 'rb') as stored:
+            return stored.read(length)
+
+    def move(self, key, storage, name):
+        """
+        將物件移到 storage 中的 name（對應物件儲存的伺服器端複製，內容不經過 worker）
+
+        name 為內容定址檔名，已存在時表示內容相同，直接刪除物件。
+
+        Returns:
+            str: storage 中的檔名
+        """
+        target = storage.path(name)
+        if os.path.exists(target):
+            self.delete(key)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(self.path(key), target)
+            os.chmod(target, storage.file_permissions_mode or 0o644)
+        # 更新 mtime，讓 gc_avatars 在保留期限內不會刪除剛設定為頭像的檔案
+        os.utime(target)
+        return name
+
+    def delete(self, key):
+        """刪除物件（保留 .sha256 紀錄檔，key 在清除前不能再被上傳）"""
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self, max_age):
+        """
+        刪除超過 max_age 秒仍未確認的物件與其紀錄檔
+
+        Returns:
+            int: 刪除的檔案數
+        """
+        cutoff = time.time() - max_age
+        deleted = 0
+        if not os.path.isdir(self.root):
+            return deleted
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        if not name.endswith('.sha256'):
+                            deleted += 1
+                except FileNotFoundError:
+                    continue
+        return deleted
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+def local_direct_upload(request, token):
+    """
+    LocalDirectUploadBackend 的上傳端點（模擬儲存服務的 presigned PUT URL）
+
+    以 URL 中的簽章 token 授權，不需要登入；每個 URL 只能成功上傳一次。
+    """
+    backend = LocalDirectUploadBackend()
+    try:
+        data = backend.read_token(token)
+    except signing.BadSignature:
+        return HttpResponseForbidden('上傳 URL 無效或已過期')
+
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return HttpResponseBadRequest('Content-Length 無效')
+    if length <= 0:
+        return HttpResponseBadRequest('缺少上傳內容')
+    if length > data['m']:
+        return HttpResponse('檔案過大', status=413)
+    if request.content_type != data['t']:
+        return HttpResponseForbidden('Content-Type 與簽章不符')
+
+    if not backend.claim(data['k']):
+        return HttpResponseForbidden('上傳 URL 已使用')
+    backend.save(data['k'], request, length)
+    return HttpResponse(status=200)
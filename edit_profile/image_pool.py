@@ -0,0 +1,122 @@
+"""
+圖片處理行程池
+
+Pillow 的解碼、縮放與編碼是 CPU 密集工作，在同一個行程中執行會佔用 GIL，
+拖慢同一行程中其他執行緒。run() 將工作交給獨立的子行程執行：
+
+- 第一次使用時才建立行程池（spawn 方式啟動，不繼承父行程的連線與執行緒）
+- 行程 fork 後（例如 gunicorn --preload）會在子行程中重新建立
+- 同時送出的工作數有上限，已滿時等待 QUEUE_TIMEOUT 秒後拋出 ImagePoolBusy
+- 每個工作有執行時間上限，逾時時終止行程池並拋出 ImagePoolTimeout
+
+設定見 settings.IMAGE_POOL；WORKERS 為 0 時直接在目前行程中執行。
+送出的函式與參數需可 pickle，且函式所在模組不可依賴 Django（例如 imaging.py）。
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 預設設定，可在 settings.IMAGE_POOL 中覆寫
+DEFAULTS = {
+    'WORKERS': 2,           # 子行程數（0 表示不使用行程池）
+    'MAX_PENDING': None,    # 同時送出的工作上限（None 表示 WORKERS 的兩倍）
+    'TIMEOUT': 30,          # 單一工作的執行秒數上限
+    'QUEUE_TIMEOUT': 5,     # 行程池已滿時等待的秒數
+    'MAX_TASKS_PER_CHILD': 200,
+}
+
+
+class ImagePoolBusy(Exception):
+    """行程池已滿，無法在等待時間內送出工作"""
+
+
+class ImagePoolTimeout(Exception):
+    """工作超過執行時間上限"""
+
+
+def get_setting(name):
+    """讀取 IMAGE_POOL 設定，未設定時使用預設值"""
+    return getattr(settings, 'IMAGE_POOL', {}).get(name, DEFAULTS[name])
+
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_pid = None
+
+
+def _get_pool():
+    """取得目前行程的行程池與工作名額，必要時建立"""
+    global _pool, _slots, _pid
+    with _lock:
+        if _pool is None or _pid != os.getpid():
+            # fork 後繼承的行程池屬於父行程，不可使用
+            workers = get_setting('WORKERS')
+            max_pending = get_setting('MAX_PENDING') or workers * 2
+            _pool = multiprocessing.get_context('spawn').Pool(
+                processes=workers,
+                maxtasksperchild=get_setting('MAX_TASKS_PER_CHILD')
+            )
+            _slots = threading.BoundedSemaphore(max_pending)
+            _pid = os.getpid()
+        return _pool, _slots
+
+
+def shutdown(terminate=False, pool=None):
+    """
+    關閉行程池；下次呼叫 run() 時會重新建立
+
+    指定 pool 時只在它仍是目前的行程池時關閉（避免關閉其他執行緒剛重建的行程池）。
+    """
+    global _pool, _slots, _pid
+    with _lock:
+        if _pool is None or (pool is not None and pool is not _pool):
+            return
+        pool, _pool, _slots = _pool, None, None
+        owner, _pid = _pid, None
+    if owner != os.getpid():
+        return
+    if terminate:
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+
+
+atexit.register(shutdown, terminate=True)
+
+
+def run(func, *args):
+    """
+    在行程池中執行 func(*args) 並回傳結果
+
+    func 拋出的例外會在呼叫端重新拋出。
+
+    Raises:
+        ImagePoolBusy: 行程池已滿
+        ImagePoolTimeout: 超過執行時間上限
+    """
+    if get_setting('WORKERS') <= 0:
+        return func(*args)
+
+    pool, slots = _get_pool()
+    if not slots.acquire(timeout=get_setting('QUEUE_TIMEOUT')):
+        raise ImagePoolBusy('圖片處理忙碌中，請稍後再試')
+    try:
+        result = pool.apply_async(func, args)
+        try:
+            return result.get(timeout=get_setting('TIMEOUT'))
+        except multiprocessing.TimeoutError:
+            # 無法只終止單一工作，終止整個行程池（其他執行中的工作也會逾時）
+            logger.error("圖片處理逾時（%s 秒），重新建立行程池", get_setting('TIMEOUT'))
+            shutdown(terminate=True, pool=pool)
+            raise ImagePoolTimeout('圖片處理逾時')
+    finally:
+        slots.release()
@@ -0,0 +1,60 @@
+"""
+頭像圖片處理（只使用 Pillow）
+
+本模組不依賴 Django，可在 image_pool 的子行程中匯入與執行。
+"""
+
+import io
+
+from PIL import Image, ImageOps
+
+# 輸出格式：key -> (Pillow 格式, 副檔名, 儲存參數)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def _flatten(image):
+    """去除透明度（JPEG 不支援），以白色為背景"""
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render_renditions(source, sizes):
+    """
+    產生各尺寸的正方形縮圖（只使用 Pillow，不存取資料庫）
+
+    Args:
+        source: 圖片檔案路徑或 file-like 物件
+        sizes: 縮圖邊長列表
+
+    Returns:
+        dict: {邊長: {'webp': bytes, 'jpeg': bytes}}
+    """
+    with Image.open(source) as original:
+        # JPEG 以 draft mode 直接解碼為不小於最大縮圖的縮小版本（1/2、1/4、1/8），
+        # 大幅減少解碼時間與記憶體
+        if original.format == 'JPEG':
+            target = max(sizes)
+            original.draft('RGB', (target, target))
+        # 依 EXIF 方向轉正；之後輸出時不帶 exif 參數，縮圖不含 EXIF
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    results = {}
+    for size in sorted(sizes, reverse=True):
+        fitted = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        # 由大到小縮，下一個尺寸以較小的圖為來源
+        image = fitted
+        results[size] = {}
+        for key, (pil_format, _, options) in RENDITION_FORMATS.items():
+            output = _flatten(fitted) if pil_format == 'JPEG' else fitted
+            buffer = io.BytesIO()
+            output.save(buffer, pil_format, **options)
+            results[size][key] = buffer.getvalue()
+    return results
@@ -0,0 +1,60 @@
+"""
+為較早產生、沒有 AvatarBlob 紀錄的頭像縮圖補建參照計數
+
+改用內容定址儲存前產生的縮圖（avatars/renditions/<profile>/<job>_<size>.<ext>）
+只記錄在 UserProfile.avatar_rendition_files，gc_avatars 只比對 UserProfile.avatar 與 AvatarBlob，
+第一次執行 gc_avatars 前須先執行本指令。這些縮圖各自只屬於一個 Profile，
+補建的計數即為出現次數；已有紀錄的檔案不會重複計算，可重複執行。
+
+使用方式：
+    python manage.py backfill_avatar_blobs
+    python manage.py backfill_avatar_blobs --batch-size 1000
+"""
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from edit_profile.models import AvatarBlob, UserProfile
+
+
+class Command(BaseCommand):
+    help = '為沒有 AvatarBlob 紀錄的頭像縮圖補建參照計數'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='每批處理的 Profile 數（預設 500）'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        created = 0
+        last_pk = None
+        while True:
+            # 以主鍵分頁（keyset pagination），避免一次載入所有 Profile
+            queryset = UserProfile.objects.exclude(avatar_rendition_files=[]).order_by('pk')
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            rows = list(queryset.values_list('pk', 'avatar_rendition_files')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            counts = Counter(name for _, files in rows for name in (files or ()) if name)
+            existing = set(
+                AvatarBlob.objects.filter(name__in=list(counts)).values_list('name', flat=True)
+            )
+            missing = [
+                AvatarBlob(name=name, ref_count=count)
+                for name, count in counts.items()
+                if name not in existing
+            ]
+            # ignore_conflicts：與背景處理同時建立時以既有紀錄為準
+            AvatarBlob.objects.bulk_create(missing, ignore_conflicts=True)
+            created += len(missing)
+
+        self.stdout.write(self.style.SUCCESS(f'已補建 {created} 筆 AvatarBlob'))
@@ -0,0 +1,49 @@
+"""
+為尚未擁有 UserProfile 的既有使用者補建個人資料
+
+使用方式：
+    python manage.py backfill_profiles
+    python manage.py backfill_profiles --batch-size 1000
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from edit_profile.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = '為尚未擁有 UserProfile 的既有使用者補建個人資料'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='每批建立的筆數（預設 500）'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        User = get_user_model()
+
+        created = 0
+        last_pk = 0
+        while True:
+            # 以主鍵分頁（keyset pagination），避免一次載入所有使用者
+            user_ids = list(
+                User.objects.filter(profile__isnull=True, pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            # ignore_conflicts：與線上請求同時建立時不會失敗
+            UserProfile.objects.bulk_create(
+                [UserProfile(user_id=user_id) for user_id in user_ids],
+                ignore_conflicts=True
+            )
+            created += len(user_ids)
+            last_pk = user_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'已補建 {created} 筆 UserProfile'))
@@ -0,0 +1,32 @@
+"""
+清除過期的頭像上傳暫存資料
+
+- 過期的分段上傳 session（AvatarUploadSession）與暫存檔
+- 直傳（direct upload）後未確認的物件
+
+使用方式：
+    python manage.py cleanup_avatar_uploads
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from edit_profile.direct_upload import DEFAULT_CONFIRM_WINDOW, get_direct_upload_backend
+from edit_profile.resumable_upload import cleanup_expired_sessions
+
+
+class Command(BaseCommand):
+    help = '清除過期的頭像上傳暫存資料'
+
+    def handle(self, *args, **options):
+        sessions = cleanup_expired_sessions()
+
+        backend = get_direct_upload_backend()
+        confirm_window = getattr(
+            settings, 'AVATAR_DIRECT_UPLOAD_CONFIRM_WINDOW', DEFAULT_CONFIRM_WINDOW
+        )
+        objects = backend.cleanup(confirm_window) if hasattr(backend, 'cleanup') else 0
+
+        self.stdout.write(self.style.SUCCESS(
+            f'已清除 {sessions} 個過期的上傳 session、{objects} 個未確認的直傳檔案'
+        ))
@@ -0,0 +1,200 @@
+"""
+清除沒有任何參照的頭像檔案
+
+以多個執行緒（os.scandir）平行走訪 MEDIA_ROOT/avatars/，
+每累積一批超過保留期限的檔案，就以一次查詢比對 UserProfile.avatar 與 AvatarBlob，
+刪除沒有被參照的檔案。走訪結果經由有上限的佇列傳遞，檔案數量再多也不會全部載入記憶體。
+
+縮圖只以 AvatarBlob 判斷是否被參照；較早產生、沒有 AvatarBlob 的縮圖
+須先以 python manage.py backfill_avatar_blobs 補建紀錄。
+
+使用方式：
+    python manage.py gc_avatars --dry-run
+    python manage.py gc_avatars --grace-hours 48 --batch-size 2000 --workers 16
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from edit_profile.models import AvatarBlob, UserProfile
+
+# 走訪結束的標記
+_DONE = object()
+
+
+def walk_files(root, workers=8, max_pending=10000):
+    """
+    以執行緒池平行走訪目錄，逐一產生 (完整路徑, mtime, 大小)
+
+    Args:
+        root: 起始目錄
+        workers: 執行緒數
+        max_pending: 尚未被取出的檔案上限（超過時走訪執行緒會等待）
+    """
+    files = queue.Queue(maxsize=max_pending)
+    directories = queue.Queue()
+    directories.put(root)
+    pending = [1]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                files.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan():
+        while True:
+            path = directories.get()
+            if path is None:
+                return
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if stop.is_set():
+                            break
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                with lock:
+                                    pending[0] += 1
+                                directories.put(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                stat = entry.stat(follow_symlinks=False)
+                                put((entry.path, stat.st_mtime, stat.st_size))
+                        except OSError:
+                            continue
+            except OSError:
+                pass
+            finally:
+                with lock:
+                    pending[0] -= 1
+                    finished = pending[0] == 0
+                if finished:
+                    for _ in range(workers):
+                        directories.put(None)
+                    put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gc-avatars') as executor:
+        for _ in range(workers):
+            executor.submit(scan)
+        try:
+            while True:
+                item = files.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+            for _ in range(workers):
+                directories.put(None)
+
+
+def find_referenced(names):
+    """回傳 names 中仍被 UserProfile.avatar 或 AvatarBlob 參照的檔案名稱"""
+    referenced = set(
+        UserProfile.objects.filter(avatar__in=names).values_list('avatar', flat=True)
+    )
+    referenced.update(
+        AvatarBlob.objects.filter(name__in=names, ref_count__gt=0).values_list('name', flat=True)
+    )
+    return referenced
+
+
+class Command(BaseCommand):
+    help = '清除沒有任何參照的頭像檔案'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只列出會被刪除的檔案，不實際刪除'
+        )
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=24,
+            help='只刪除超過此時數未修改的檔案，避免刪除上傳中的檔案（預設 24）'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批比對資料庫的檔案數（預設 1000）'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='走訪目錄的執行緒數（預設 8）'
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.cutoff = time.time() - options['grace_hours'] * 3600
+        batch_size = options['batch_size']
+
+        self.media_root = os.path.realpath(settings.MEDIA_ROOT)
+        root = os.path.join(self.media_root, 'avatars')
+        self.stats = {'scanned': 0, 'candidates': 0, 'deleted': 0, 'freed': 0, 'errors': 0}
+
+        started = time.monotonic()
+        if os.path.isdir(root):
+            batch = []
+            for path, mtime, size in walk_files(root, workers=options['workers'], max_pending=batch_size * 4):
+                self.stats['scanned'] += 1
+                if mtime >= self.cutoff:
+                    continue
+                name = os.path.relpath(path, self.media_root).replace(os.sep, '/')
+                batch.append((name, path, size))
+                if len(batch) >= batch_size:
+                    self._collect(batch)
+                    batch = []
+            if batch:
+                self._collect(batch)
+        elapsed = time.monotonic() - started
+
+        rate = self.stats['scanned'] / elapsed if elapsed else 0
+        action = '可刪除' if self.dry_run else '已刪除'
+        self.stdout.write(self.style.SUCCESS(
+            f"掃描 {self.stats['scanned']} 個檔案（{rate:.0f} 檔/秒，{elapsed:.2f} 秒），"
+            f"超過保留期限 {self.stats['candidates']} 個，"
+            f"{action} {self.stats['deleted']} 個（{self.stats['freed']} bytes），"
+            f"錯誤 {self.stats['errors']} 個"
+        ))
+
+    def _collect(self, batch):
+        self.stats['candidates'] += len(batch)
+        referenced = find_referenced([name for name, _, _ in batch])
+
+        for name, path, size in batch:
+            if name in referenced:
+                continue
+            if self.dry_run:
+                if self.verbosity > 1:
+                    self.stdout.write(f'[dry-run] {name}')
+                self.stats['deleted'] += 1
+                self.stats['freed'] += size
+                continue
+            try:
+                # 比對期間若有相同內容被重新上傳（storage 會更新 mtime），保留檔案
+                if os.stat(path).st_mtime >= self.cutoff:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                self.stats['errors'] += 1
+                self.stderr.write(f'刪除 {name} 失敗：{str(e)}')
+                continue
+            self.stats['deleted'] += 1
+            self.stats['freed'] += size
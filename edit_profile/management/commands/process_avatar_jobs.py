@@ -0,0 +1,61 @@
+"""
+處理頭像背景工作（產生各尺寸縮圖）
+
+使用方式：
+    python manage.py process_avatar_jobs            # 持續執行，佇列空時輪詢
+    python manage.py process_avatar_jobs --once     # 處理完目前佇列後結束
+    python manage.py process_avatar_jobs --sleep 5 --max-jobs 100
+
+可同時執行多個 worker，工作以條件式 UPDATE 搶占，不會重複處理。
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from edit_profile.avatar_processing import requeue_stale_jobs, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = '處理頭像背景工作（產生各尺寸縮圖）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='處理完目前佇列中的工作後結束'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help='佇列為空時的輪詢間隔秒數（預設 2）'
+        )
+        parser.add_argument(
+            '--max-jobs',
+            type=int,
+            default=None,
+            help='最多處理的工作數，達到後結束'
+        )
+
+    def handle(self, *args, **options):
+        max_jobs = options['max_jobs']
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'重新排入 {requeued} 筆中斷的工作')
+
+        total = 0
+        while max_jobs is None or total < max_jobs:
+            remaining = None if max_jobs is None else max_jobs - total
+            processed = run_pending_jobs(max_jobs=remaining)
+            total += processed
+            if options['once']:
+                break
+            if not processed:
+                # 長時間執行時避免使用已斷線的資料庫連線
+                close_old_connections()
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'已處理 {total} 筆頭像工作'))
@@ -2,13 +2,22 @@
 編輯個人資料相關的模型
 """
 
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F
 from django.conf import settings
+from django.utils import timezone
+import logging
 import uuid
 
+from phone_auth.mixins import DirtyFieldsMixin
 
-class UserProfile(models.Model):
-    ''' User Profile '''
+from .storage import get_avatar_storage
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfile(DirtyFieldsMixin, models.Model):
+    ''' User Profile（save() 只寫入有變動的欄位） '''
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, 
@@ -29,8 +38,10 @@ class UserProfile(models.Model):
     monkey_try = models.IntegerField(default=0)
     
     # 頭像相關欄位
+    # 檔名由內容雜湊決定（avatars/ab/cd/<sha256>.<ext>），見 storage.py
     avatar = models.ImageField(
-        upload_to='avatars/%Y/%m/%d/',
+        upload_to='avatars/',
+        storage=get_avatar_storage,
         blank=True,
         null=True,
         verbose_name='個人照片',
@@ -52,5 +63,285 @@ class UserProfile(models.Model):
         help_text='最後一次上傳頭像的時間'
     )
     
+    # 頭像縮圖（由背景處理產生，見 avatar_processing.py）
+    # 格式：{"64": {"webp": "<url>", "jpeg": "<url>"}, "128": {...}, "512": {...}}
+    avatar_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='頭像縮圖',
+        help_text='各尺寸頭像縮圖的 URL'
+    )
+    
+    # 縮圖檔案在 storage 中的名稱（內部使用，更換或刪除頭像時清除檔案）
+    avatar_rendition_files = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='頭像縮圖檔案'
+    )
+    
+    # 樂觀鎖版本號：個人資料回應的內容（欄位、頭像、縮圖、使用者的手機驗證結果）變動時遞增，對應回應的 ETag
+    version = models.PositiveIntegerField(
+        default=1,
+        verbose_name='版本號',
+        help_text='樂觀並行控制使用的版本號'
+    )
+    
     def __str__(self):
         return f"{self.user.username}'s Profile"
+    
+    def save_if_version(self, expected_version=None):
+        """
+        以單一 UPDATE 寫入有變動的欄位並遞增 version（樂觀並行控制）
+        
+        執行 UPDATE ... WHERE id=? [AND version=?]，不使用資料列鎖。
+        
+        Args:
+            expected_version: 預期的版本號；None 表示不檢查版本
+        
+        Returns:
+            bool: 是否成功寫入（版本不符時回傳 False；沒有變動時視為成功）
+        """
+        dirty_fields = self.get_dirty_fields()
+        if not dirty_fields:
+            return expected_version is None or expected_version == self.version
+        
+        queryset = UserProfile.objects.filter(pk=self.pk)
+        if expected_version is not None:
+            queryset = queryset.filter(version=expected_version)
+        
+        values = {field: getattr(self, field) for field in dirty_fields}
+        db = router.db_for_write(UserProfile, instance=self)
+        with transaction.atomic(using=db, savepoint=False):
+            if not queryset.using(db).update(version=F('version') + 1, **values):
+                return False
+            if expected_version is not None:
+                self.version = expected_version + 1
+            else:
+                # 未指定版本時其他寫入可能同時遞增 version，在同一個交易中（資料列已鎖定）讀回實際的版本號
+                self.version = UserProfile.objects.using(db).values_list('version', flat=True).get(pk=self.pk)
+        
+        self.reset_dirty_state()
+        return True
+
+
+class AvatarProcessingJob(models.Model):
+    """
+    頭像背景處理工作（DB-backed job queue）
+    
+    上傳頭像後建立一筆工作，由 `python manage.py process_avatar_jobs`
+    產生各尺寸縮圖並寫回 UserProfile。
+    """
+    
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', '等待處理'
+        RUNNING = 'RUNNING', '處理中'
+        DONE = 'DONE', '已完成'
+        FAILED = 'FAILED', '處理失敗'
+        SUPERSEDED = 'SUPERSEDED', '已被新頭像取代'
+    
+    profile = models.ForeignKey(
+        UserProfile,
+        on_delete=models.CASCADE,
+        related_name='avatar_jobs',
+        verbose_name='個人資料'
+    )
+    
+    source_name = models.CharField(
+        max_length=255,
+        verbose_name='原始檔案',
+        help_text='原始頭像在 storage 中的名稱'
+    )
+    
+    base_url = models.CharField(
+        max_length=255,
+        verbose_name='網站網址',
+        help_text='組成縮圖絕對 URL 用的網站根網址'
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name='狀態'
+    )
+    
+    attempts = models.IntegerField(
+        default=0,
+        verbose_name='嘗試次數'
+    )
+    
+    error_message = models.TextField(
+        blank=True,
+        null=True,
+        verbose_name='錯誤訊息'
+    )
+    
+    # 失敗重試時延後執行（指數退避），worker 只搶占已到時間的工作
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='可執行時間'
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='建立時間'
+    )
+    
+    started_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='開始時間'
+    )
+    
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='完成時間'
+    )
+    
+    class Meta:
+        verbose_name = '頭像處理工作'
+        verbose_name_plural = '頭像處理工作列表'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    def __str__(self):
+        return f"{self.profile_id} - {self.status}"
+
+
+class AvatarUploadSession(models.Model):
+    """
+    可續傳的分段頭像上傳 session（見 resumable_upload.py）
+    
+    offset 為伺服器已收到的 bytes，客戶端中斷後從此位置繼續上傳。
+    完成（finalize）後即刪除。
+    """
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='avatar_upload_sessions',
+        verbose_name='使用者'
+    )
+    
+    size = models.PositiveIntegerField(
+        verbose_name='檔案大小',
+        help_text='客戶端宣告的檔案大小（bytes）'
+    )
+    
+    sha256 = models.CharField(
+        max_length=64,
+        verbose_name='SHA-256',
+        help_text='客戶端宣告的檔案 SHA-256（hex）'
+    )
+    
+    offset = models.PositiveIntegerField(
+        default=0,
+        verbose_name='已接收大小'
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='建立時間'
+    )
+    
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name='過期時間'
+    )
+    
+    class Meta:
+        verbose_name = '頭像上傳 session'
+        verbose_name_plural = '頭像上傳 session 列表'
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.offset}/{self.size}"
+
+
+class AvatarBlobManager(models.Manager):
+    
+    def acquire(self, names):
+        """
+        增加檔案的參照計數（紀錄不存在時建立）
+        
+        先以 ignore_conflicts 建立計數為 0 的紀錄，再統一遞增，
+        並行上傳相同內容時不會漏算。
+        """
+        names = [name for name in dict.fromkeys(names) if name]
+        if not names:
+            return
+        self.bulk_create(
+            [AvatarBlob(name=name, ref_count=0) for name in names],
+            ignore_conflicts=True
+        )
+        self.filter(name__in=names).update(ref_count=F('ref_count') + 1)
+    
+    def release(self, names, storage):
+        """
+        減少檔案的參照計數，沒有任何參照的檔案在交易提交後刪除
+        
+        沒有 AvatarBlob 紀錄的檔案（改用內容定址前上傳的舊檔）只屬於單一 Profile，
+        同樣視為已無參照。
+        """
+        names = [name for name in dict.fromkeys(names) if name]
+        if not names:
+            return
+        self.filter(name__in=names).update(ref_count=F('ref_count') - 1)
+        counts = dict(self.filter(name__in=names).values_list('name', 'ref_count'))
+        unreferenced = [name for name in names if counts.get(name, 0) <= 0]
+        if not unreferenced:
+            return
+        if any(name in counts for name in unreferenced):
+            self.filter(name__in=unreferenced, ref_count__lte=0).delete()
+        transaction.on_commit(lambda: self._delete_files(unreferenced, storage))
+    
+    def _delete_files(self, names, storage):
+        # 刪除前再確認一次，避免期間有人上傳了相同內容
+        referenced = set(self.filter(name__in=names).values_list('name', flat=True))
+        for name in names:
+            if name in referenced:
+                continue
+            try:
+                storage.delete(name)
+            except Exception as e:
+                logger.warning("刪除頭像檔案 %s 失敗：%s", name, e)
+
+
+class AvatarBlob(models.Model):
+    """
+    內容定址頭像檔案的參照計數
+    
+    同一份內容可能被多個 Profile 的頭像或縮圖使用，
+    計數歸零時才刪除實際檔案。
+    """
+    
+    name = models.CharField(
+        max_length=255,
+        primary_key=True,
+        verbose_name='檔案名稱',
+        help_text='檔案在 storage 中的名稱（avatars/ab/cd/<sha256>.<ext>）'
+    )
+    
+    ref_count = models.IntegerField(
+        default=0,
+        verbose_name='參照數'
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='建立時間'
+    )
+    
+    objects = AvatarBlobManager()
+    
+    class Meta:
+        verbose_name = '頭像檔案'
+        verbose_name_plural = '頭像檔案列表'
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
@@ -0,0 +1,119 @@
+"""
+可續傳的分段頭像上傳
+
+行動網路不穩定時，上傳中斷後可從伺服器已收到的位置繼續：
+
+1. POST /api/user/avatar/sessions/：宣告檔案大小與 SHA-256，建立上傳 session
+2. PUT /api/user/avatar/sessions/<id>/：帶 Upload-Offset header 上傳一段內容，
+   附加到暫存檔；中斷時以 GET 查詢目前的 offset 後繼續
+3. POST /api/user/avatar/sessions/<id>/finalize/：比對 SHA-256，
+   再以與一般上傳相同的檢查與流程更新頭像
+
+暫存檔位於 settings.AVATAR_UPLOAD_SESSION_ROOT（預設 BASE_DIR/private/upload-sessions/），
+不放在 MEDIA_ROOT 下，未完成、未驗證的內容無法經由 static() 或代理以 URL 存取。
+過期的 session 由 python manage.py cleanup_avatar_uploads 清除。
+"""
+
+import hashlib
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AvatarUploadSession
+
+logger = logging.getLogger(__name__)
+
+# session 有效時間
+DEFAULT_SESSION_TTL = timedelta(hours=24)
+
+# 每次從 request 讀取的大小
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_session_ttl():
+    return getattr(settings, 'AVATAR_UPLOAD_SESSION_TTL', DEFAULT_SESSION_TTL)
+
+
+def get_session_root():
+    return getattr(settings, 'AVATAR_UPLOAD_SESSION_ROOT', None) or os.path.join(
+        settings.BASE_DIR, 'private', 'upload-sessions'
+    )
+
+
+def session_path(session_id):
+    return os.path.join(get_session_root(), f'{session_id}.part')
+
+
+def write_chunk(session_id, offset, stream, length):
+    """
+    將 stream 中最多 length bytes 寫入暫存檔的 offset 位置
+
+    連線中斷時保留已寫入的部分，客戶端可從回傳的位置繼續。
+
+    Returns:
+        int: 實際寫入的 bytes
+    """
+    path = session_path(session_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as part:
+        part.seek(offset)
+        try:
+            while written < length:
+                chunk = stream.read(min(READ_CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                part.write(chunk)
+                written += len(chunk)
+        except OSError as e:
+            logger.warning("上傳 session %s 讀取中斷：%s", session_id, e)
+        part.truncate(offset + written)
+    return written
+
+
+def file_digest(session_id):
+    digest = hashlib.sha256()
+    with open(session_path(session_id), 'rb') as part:
+        for chunk in iter(lambda: part.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def discard(session_id):
+    try:
+        os.remove(session_path(session_id))
+    except FileNotFoundError:
+        pass
+
+
+def cleanup_expired_sessions(now=None):
+    """
+    刪除過期的 session 與暫存檔
+
+    另外清除超過有效時間、但已沒有對應 session 的暫存檔（例如 session 建立後程式中斷）。
+
+    Returns:
+        int: 刪除的 session 數
+    """
+    now = now or timezone.now()
+    expired = AvatarUploadSession.objects.filter(expires_at__lt=now)
+    deleted = 0
+    for session_id in expired.values_list('pk', flat=True).iterator():
+        discard(session_id)
+        deleted += 1
+    expired.delete()
+
+    root = get_session_root()
+    if os.path.isdir(root):
+        cutoff = (now - get_session_ttl()).timestamp()
+        with os.scandir(root) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+    return deleted
@@ -4,8 +4,11 @@
 定義請求/回應的數據序列化邏輯。
 """
 
+from django.conf import settings
 from rest_framework import serializers
 from .models import UserProfile
+from .upload_handlers import get_max_upload_size
+from .validators import validate_avatar_image
 
 class UpdateProfileSerializer(serializers.Serializer):
     """
@@ -136,6 +139,125 @@ class ProfileResponseSerializer(serializers.Serializer):
         allow_blank=True,
         help_text='頭像 URL'
     )
+    
+    avatar_renditions = serializers.JSONField(
+        help_text='各尺寸頭像縮圖（{"64": {"webp": url, "jpeg": url}, ...}），背景處理完成前為空物件'
+    )
+    
+    version = serializers.IntegerField(
+        help_text='個人資料版本號（與 ETag 相同），PATCH 時可透過 If-Match 帶回'
+    )
+
+
+# ProfileResponseSerializer 各欄位對應的查詢路徑（供 ?fields= 稀疏欄位使用）
+# 以 user__ 開頭的欄位需要 JOIN 使用者資料表
+PROFILE_FIELD_SOURCES = {
+    'id': 'id',
+    'username': 'user__username',
+    'email': 'user__email',
+    'nickname': 'nickname',
+    'gender': 'gender',
+    'age': 'age',
+    'degree': 'degree',
+    'motivation_1': 'motivation_1',
+    'motivation_2': 'motivation_2',
+    'motivation_3': 'motivation_3',
+    'phone_number': 'user__phone_number',
+    'phone_verified': 'user__phone_verified',
+    'avatar_url': 'avatar_url',
+    'avatar_renditions': 'avatar_renditions',
+    'version': 'version',
+}
+
+
+def parse_profile_fields(raw):
+    """
+    解析 ?fields= 參數（以逗號分隔）
+
+    Args:
+        raw: 查詢參數原始字串，None 表示回傳所有欄位
+
+    Returns:
+        list | None: 依 ProfileResponseSerializer 欄位順序排列的欄位名稱
+
+    Raises:
+        serializers.ValidationError: 包含未知欄位時
+    """
+    if raw is None:
+        return None
+    requested = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = requested - PROFILE_FIELD_SOURCES.keys()
+    if unknown:
+        raise serializers.ValidationError(
+            {'fields': [f'未知的欄位：{name}' for name in sorted(unknown)]}
+        )
+    if not requested:
+        raise serializers.ValidationError({'fields': ['至少需要指定一個欄位']})
+    return [name for name in PROFILE_FIELD_SOURCES if name in requested]
+
+
+def project_profile_row(row, fields):
+    """
+    將 QuerySet.values() 的結果轉換為與 ProfileResponseSerializer 相同格式的 dict
+
+    Args:
+        row: 以 PROFILE_FIELD_SOURCES 路徑為 key 的 dict
+        fields: 要輸出的欄位名稱
+    """
+    data = {}
+    for name in fields:
+        value = row[PROFILE_FIELD_SOURCES[name]]
+        data[name] = str(value) if name == 'id' else value
+    return data
+
+
+class BulkProfileRequestSerializer(serializers.Serializer):
+    """
+    批次查詢個人資料的請求格式（後端服務使用）
+    
+    API Endpoint: POST /api/user/profiles/bulk/
+    
+    使用範例：
+    {
+        "user_ids": [12, 7, 31],
+        "profile_ids": ["4f1c..."],
+        "fields": ["nickname", "avatar_url"]
+    }
+    """
+    
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        default=list,
+        help_text='使用者 ID 列表'
+    )
+    
+    profile_ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        required=False,
+        default=list,
+        help_text='Profile ID（UUID）列表'
+    )
+    
+    fields = serializers.ListField(
+        child=serializers.ChoiceField(choices=list(PROFILE_FIELD_SOURCES)),
+        required=False,
+        allow_empty=False,
+        help_text='只回傳指定欄位（可選，預設回傳所有欄位）'
+    )
+    
+    def validate(self, data):
+        total = len(data['user_ids']) + len(data['profile_ids'])
+        if total == 0:
+            raise serializers.ValidationError('至少需要指定一個 user_ids 或 profile_ids')
+        
+        max_ids = getattr(settings, 'PROFILE_BULK_MAX_IDS', 500)
+        if total > max_ids:
+            raise serializers.ValidationError(f'一次最多只能查詢 {max_ids} 筆')
+        
+        requested = set(data.get('fields') or PROFILE_FIELD_SOURCES)
+        data['fields'] = [name for name in PROFILE_FIELD_SOURCES if name in requested]
+        return data
 
 
 class AvatarUploadSerializer(serializers.Serializer):
@@ -145,12 +267,75 @@ class AvatarUploadSerializer(serializers.Serializer):
     用於驗證和序列化上傳頭像的請求數據。
     """
     
-    avatar = serializers.ImageField(
+    # 只讀取檔頭檢查格式與長寬（見 validators.py），不在 request 中解碼整張圖片
+    avatar = serializers.FileField(
         required=True,
+        validators=[validate_avatar_image],
         help_text='使用者頭像圖片'
     )
 
 
+class DirectUploadRequestSerializer(serializers.Serializer):
+    """
+    頭像直傳：取得上傳 URL 的請求
+    """
+    
+    content_type = serializers.ChoiceField(
+        choices=['image/jpeg', 'image/png', 'image/gif', 'image/webp'],
+        help_text='圖片的 MIME type，上傳時需帶上相同的 Content-Type'
+    )
+    
+    size = serializers.IntegerField(
+        min_value=1,
+        help_text='圖片大小（bytes）'
+    )
+    
+    def validate_size(self, value):
+        max_size = get_max_upload_size()
+        if value > max_size:
+            raise serializers.ValidationError(
+                f'圖片檔案過大，請上傳不超過 {max_size // (1024 * 1024)}MB 的圖片'
+            )
+        return value
+
+
+class DirectUploadConfirmSerializer(serializers.Serializer):
+    """
+    頭像直傳：上傳完成後的確認請求
+    """
+    
+    upload_id = serializers.CharField(
+        help_text='取得上傳 URL 時回傳的 upload_id'
+    )
+
+
+class AvatarUploadSessionCreateSerializer(serializers.Serializer):
+    """
+    建立可續傳分段上傳 session 的請求
+    """
+    
+    size = serializers.IntegerField(
+        min_value=1,
+        help_text='圖片大小（bytes）'
+    )
+    
+    sha256 = serializers.RegexField(
+        r'^[0-9a-fA-F]{64}$',
+        help_text='圖片的 SHA-256（hex），完成時用來檢查內容是否完整'
+    )
+    
+    def validate_size(self, value):
+        max_size = get_max_upload_size()
+        if value > max_size:
+            raise serializers.ValidationError(
+                f'圖片檔案過大，請上傳不超過 {max_size // (1024 * 1024)}MB 的圖片'
+            )
+        return value
+    
+    def validate_sha256(self, value):
+        return value.lower()
+
+
 class AvatarResponseSerializer(serializers.Serializer):
     """
     頭像上傳回應序列化器
@@ -0,0 +1,209 @@
+"""
+頭像檔案提供
+
+Django 只負責授權與計算快取相關 header，檔案內容交給前端代理傳送：
+
+- settings.AVATAR_SENDFILE_BACKEND = 'nginx'：回傳 X-Accel-Redirect
+  （內部路徑為 settings.AVATAR_SENDFILE_PREFIX + 檔名）
+- settings.AVATAR_SENDFILE_BACKEND = 'apache'：回傳 X-Sendfile（檔案的絕對路徑）
+- 未設定時以 FileResponse 回傳（WSGI server 會以 sendfile 傳送），
+  並自行處理 Range（單一範圍）
+
+兩種方式都支援 ETag / Last-Modified 條件請求（304）。
+
+授權只使用 session（AuthenticationMiddleware 已載入的 request.user）或
+sign_avatar_url 產生的短效簽章 token（?token=），每張圖片只需要一次 HMAC 驗證；
+不經過 DRF 的 Basic 認證（每次請求都要計算密碼雜湊）。
+"""
+
+import mimetypes
+import os
+import re
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .storage import IMMUTABLE_CACHE_CONTROL, get_avatar_storage
+
+# 內容定址的檔名（avatars/ab/cd/<sha256>.<ext>）
+HASHED_NAME_RE = re.compile(r'/(?P<digest>[0-9a-f]{64})(\.[a-z0-9]+)?$')
+
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+# 簽章 URL 的有效秒數
+DEFAULT_TOKEN_MAX_AGE = 3600
+
+TOKEN_SALT = 'edit_profile.serving.avatar'
+
+
+def get_token_max_age():
+    return getattr(settings, 'AVATAR_SERVE_TOKEN_MAX_AGE', DEFAULT_TOKEN_MAX_AGE)
+
+
+def sign_avatar_url(url):
+    """
+    為頭像 URL 加上短效簽章 token，供沒有 session 的客戶端（例如以 Basic 認證呼叫 API）下載頭像
+
+    token 綁定檔名，有效時間為 settings.AVATAR_SERVE_TOKEN_MAX_AGE 秒。
+    """
+    name = urlsplit(url).path[len(settings.MEDIA_URL):]
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}{urlencode({'token': signing.dumps(name, salt=TOKEN_SALT)})}"
+
+
+def _token_allows(request, name):
+    token = request.GET.get('token')
+    if not token:
+        return False
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=get_token_max_age()) == name
+    except signing.BadSignature:
+        return False
+
+
+def _etag(name, stat):
+    """內容定址檔案以雜湊作為 ETag，其他檔案以 mtime 與大小組成"""
+    match = HASHED_NAME_RE.search(name)
+    if match:
+        return quote_etag(match.group('digest'))
+    return quote_etag(f'{int(stat.st_mtime):x}-{stat.st_size:x}')
+
+
+def _cache_control(name):
+    if not HASHED_NAME_RE.search(name):
+        return 'no-cache'
+    if getattr(settings, 'AVATAR_SERVE_REQUIRE_AUTH', True):
+        return IMMUTABLE_CACHE_CONTROL.replace('public', 'private')
+    return IMMUTABLE_CACHE_CONTROL
+
+
+def _parse_range(header, size):
+    """
+    解析單一範圍的 Range header
+
+    Returns:
+        tuple | None: (start, end)，end 包含在內；無法滿足時回傳 None
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or not (match.group('start') or match.group('end')):
+        return None
+    if match.group('start'):
+        start = int(match.group('start'))
+        end = int(match.group('end')) if match.group('end') else size - 1
+    else:
+        # bytes=-N：最後 N 個位元組
+        start = max(size - int(match.group('end')), 0)
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+class _RangeFile:
+    """只讀取檔案中 [start, end] 範圍的 file-like 物件（不提供 fileno，避免送出整個檔案）"""
+
+    def __init__(self, file, start, end):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = end - start + 1
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _sendfile_response(name, path):
+    backend = getattr(settings, 'AVATAR_SENDFILE_BACKEND', '')
+    response = HttpResponse()
+    if backend == 'nginx':
+        prefix = getattr(settings, 'AVATAR_SENDFILE_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + name
+    else:
+        response['X-Sendfile'] = path
+    # 內容類型交由代理依副檔名決定；移除 Django 預設的 text/html
+    del response['Content-Type']
+    return response
+
+
+@require_safe
+def serve_avatar(request, path):
+    """
+    提供頭像檔案
+
+    URL: MEDIA_URL + avatars/<path>（見 config/urls.py）
+    """
+    name = f'avatars/{path}'
+    if getattr(settings, 'AVATAR_SERVE_REQUIRE_AUTH', True):
+        if not request.user.is_authenticated and not _token_allows(request, name):
+            return HttpResponseForbidden()
+
+    storage = get_avatar_storage()
+    try:
+        full_path = storage.path(name)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = _etag(name, stat)
+    last_modified = stat.st_mtime
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        if getattr(settings, 'AVATAR_SENDFILE_BACKEND', ''):
+            response = _sendfile_response(name, full_path)
+        else:
+            response = _file_response(request, full_path, stat, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = _cache_control(name)
+    return response
+
+
+def _file_response(request, full_path, stat, etag, last_modified):
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    range_header = request.headers.get('Range')
+    response_range = None
+    if range_header and request.method == 'GET' and _if_range_matches(request, etag, last_modified):
+        response_range = _parse_range(range_header, stat.st_size)
+        if response_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    file = open(full_path, 'rb')
+    if response_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = response_range
+        response = FileResponse(_RangeFile(file, start, end), status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
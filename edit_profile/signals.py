@@ -0,0 +1,56 @@
+"""
+個人資料相關的 signal 處理
+
+- 建立使用者時自動建立 UserProfile
+- 在使用者或個人資料變動時讓個人資料快取失效
+"""
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_profile
+from .models import UserProfile
+
+# 個人資料回應中來自 CustomUser 的欄位
+PROFILE_USER_FIELDS = {'username', 'email', 'phone_number', 'phone_verified'}
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_profile_for_new_user(sender, instance, created, raw=False, **kwargs):
+    """
+    建立使用者時一併建立 UserProfile
+
+    讓讀取路徑不必再使用 get_or_create；既有使用者請執行
+    `python manage.py backfill_profiles` 補建。
+    """
+    if created and not raw:
+        UserProfile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_on_user_save(sender, instance, created, update_fields=None, **kwargs):
+    """使用者資料（例如手機驗證結果）變動時遞增個人資料版本並讓快取失效"""
+    if created or update_fields is None or PROFILE_USER_FIELDS & set(update_fields):
+        if not created:
+            UserProfile.objects.filter(user_id=instance.pk).update(version=F('version') + 1)
+        invalidate_profile(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_on_user_delete(sender, instance, **kwargs):
+    invalidate_profile(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_on_profile_save(sender, instance, created, **kwargs):
+    """個人資料更新、頭像上傳或刪除時讓快取失效"""
+    # 新建立的 Profile 不可能已有快取，略過以免讓正在重建的快取立即失效
+    if not created:
+        invalidate_profile(instance.user_id)
+
+
+@receiver(post_delete, sender=UserProfile)
+def invalidate_on_profile_delete(sender, instance, **kwargs):
+    invalidate_profile(instance.user_id)
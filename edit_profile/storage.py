@@ -0,0 +1,103 @@
+"""
+內容定址（content-addressed）的頭像儲存
+
+檔名由檔案內容的 SHA-256 決定：
+
+    avatars/ab/cd/abcd1234....jpg
+
+- 相同內容只會儲存一份（重複上傳時不再寫入）
+- 內容不同檔名就不同，URL 永遠不會指向其他內容，
+  因此可以搭配一年期的 Cache-Control: immutable 提供
+- 參照計數由 AvatarBlob 管理（見 models.py），
+  storage 本身不會因為一筆參照被移除就刪除檔案
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# 內容定址檔案可永久快取
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    以內容雜湊命名檔案的 FileSystemStorage
+
+    傳入的檔名只用來決定最上層目錄（例如 avatars/）與副檔名。
+    """
+
+    hash_algorithm = 'sha256'
+
+    @staticmethod
+    def _top_level(name):
+        name = name.replace('\\', '/')
+        return name.split('/')[0] if '/' in name else ''
+
+    def hashed_name(self, name, digest):
+        """
+        依內容雜湊組成儲存路徑
+
+        Args:
+            name: 原始檔名（只取最上層目錄與副檔名）
+            digest: 內容雜湊（hex）
+        """
+        extension = os.path.splitext(name)[1].lower()
+        parts = [digest[:2], digest[2:4], f'{digest}{extension}']
+        top_level = self._top_level(name)
+        if top_level:
+            parts.insert(0, top_level)
+        return '/'.join(parts)
+
+    def get_available_name(self, name, max_length=None):
+        # 檔名由內容決定，同名即同內容，不需要加上亂數後綴
+        return name
+
+    def _save(self, name, content):
+        """
+        一邊寫入暫存檔一邊計算雜湊，完成後再改名為雜湊檔名
+
+        目標檔案已存在時（相同內容）直接捨棄暫存檔。
+        以 os.replace 改名，並行上傳相同內容也不會產生不完整的檔案。
+        """
+        directory = self.path(self._top_level(name) or '.')
+        os.makedirs(directory, exist_ok=True)
+
+        digest = hashlib.new(self.hash_algorithm)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            hashed = self.hashed_name(name, digest.hexdigest())
+            full_path = self.path(hashed)
+            if os.path.exists(full_path):
+                os.remove(temp_path)
+                # 更新 mtime，讓 gc_avatars 在保留期限內不會刪除剛被重新使用的檔案
+                os.utime(full_path)
+                return hashed
+
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+            return hashed
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+avatar_storage = ContentAddressedStorage()
+
+
+def get_avatar_storage():
+    """UserProfile.avatar 使用的 storage（以 callable 指定，位置跟隨 settings.MEDIA_ROOT）"""
+    return avatar_storage
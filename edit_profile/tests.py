@@ -2,13 +2,58 @@
 編輯個人資料 API 測試
 """
 
+import base64
+import hashlib
+import io
 import os
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock
+from PIL import Image
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from phone_auth.models import CustomUser
-from .models import UserProfile
+from .models import AvatarBlob, AvatarProcessingJob, AvatarUploadSession, UserProfile
+from . import cache as profile_cache
+from . import image_pool
+from .avatar_processing import (
+    claim_next_job,
+    enqueue_avatar_processing,
+    process_job,
+    render_renditions,
+    run_pending_jobs,
+)
+from .direct_upload import LocalDirectUploadBackend
+from .resumable_upload import get_session_root
+from .serving import _cache_control, sign_avatar_url
+from .storage import ContentAddressedStorage
+from .validators import inspect_image
+from .upload_handlers import (
+    AvatarUploadHandler,
+    AvatarUploadRejected,
+    MULTIPART_OVERHEAD,
+    sniff_image_format,
+)
+from .views import _validate_stored_avatar
+
+
+# 創建一個最小的有效 PNG 圖片數據（1x1）
+PNG_IMAGE_DATA = (
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+    b'\x00\x00\x00\nIDATx\x9cc\x00\x01\x00\x00\x05\x00\x01\r\n-\xb4\x00\x00\x00\x00IEND\xaeB`\x82'
+)
 
 
 class ProfileUpdateTest(TestCase):
@@ -22,7 +67,7 @@ class ProfileUpdateTest(TestCase):
             email='test@example.com',
             password='testpass123'
         )
-        # 不預先建立 UserProfile，測試自動建立功能
+        # UserProfile 由 signal 在建立使用者時自動建立
     
     def test_update_profile_success(self):
         """測試成功更新個人資料（自動建立 Profile）"""
@@ -87,11 +132,8 @@ class AvatarUploadTest(TestCase):
         )
         self.client.force_authenticate(user=self.user)
         
-        # 創建一個最小的有效 PNG 圖片數據
-        self.image_data = (
-            b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
-            b'\x00\x00\x00\nIDATx\x9cc\x00\x01\x00\x00\x05\x00\x01\r\n-\xb4\x00\x00\x00\x00IEND\xaeB`\x82'
-        )
+        # 最小的有效 PNG 圖片數據
+        self.image_data = PNG_IMAGE_DATA
     
     def test_upload_avatar_success(self):
         """測試成功上傳頭像"""
@@ -459,3 +501,1339 @@ class ProfileBoundaryTest(TestCase):
         
         # 驗證 Profile 已自動建立
         self.assertTrue(UserProfile.objects.filter(user=self.user).exists())
+
+
+class ProfileCacheTest(TestCase):
+    """個人資料快取測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        cache.clear()
+        profile_cache.local_cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='cachetest',
+            email='cache@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_second_get_served_from_cache(self):
+        """測試第二次獲取個人資料不查詢資料庫"""
+        self.client.get('/api/user/profile/')
+        
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/user/profile/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['username'], 'cachetest')
+    
+    def test_patch_invalidates_cache(self):
+        """測試更新個人資料後快取失效"""
+        self.client.get('/api/user/profile/')
+        self.client.patch('/api/user/profile/', {'nickname': 'Cached'}, format='json')
+        
+        response = self.client.get('/api/user/profile/')
+        
+        self.assertEqual(response.data['data']['nickname'], 'Cached')
+    
+    def test_phone_verification_invalidates_cache(self):
+        """測試手機驗證完成後快取失效"""
+        self.client.get('/api/user/profile/')
+        
+        self.user.phone_number = '+886987654321'
+        self.user.phone_verified = True
+        self.user.save()
+        
+        response = self.client.get('/api/user/profile/')
+        
+        self.assertEqual(response.data['data']['phone_number'], '+886987654321')
+        self.assertTrue(response.data['data']['phone_verified'])
+    
+    def test_avatar_delete_invalidates_cache(self):
+        """測試刪除頭像後快取失效"""
+        profile, _ = UserProfile.objects.get_or_create(user=self.user)
+        profile.avatar_url = 'http://testserver/media/avatars/old.png'
+        profile.save()
+        self.client.get('/api/user/profile/')
+        
+        self.client.delete('/api/user/avatar/')
+        
+        response = self.client.get('/api/user/profile/')
+        self.assertIsNone(response.data['data']['avatar_url'])
+    
+    def test_early_refresh_serves_stale_while_locked(self):
+        """測試提前重建時若已有其他請求持有鎖，直接回傳舊資料"""
+        builder = mock.Mock(return_value={'nickname': 'fresh'})
+        profile_cache.get_profile_payload(self.user.pk, lambda: {'nickname': 'stale'})
+        
+        version = profile_cache.get_version(self.user.pk)
+        data_key = profile_cache._data_key(self.user.pk, version)
+        cache.add(profile_cache._lock_key(data_key), 1)
+        
+        # random() 接近 0 時 XFetch 必定判定需要提前重建
+        with mock.patch.object(profile_cache.random, 'random', return_value=1e-300):
+            payload = profile_cache.get_profile_payload(self.user.pk, builder)
+        
+        self.assertEqual(payload, {'nickname': 'stale'})
+        builder.assert_not_called()
+
+
+@override_settings(PROFILE_CACHE={'ENABLED': False})
+class ProfileQueryBudgetTest(TestCase):
+    """個人資料端點查詢次數測試（超出預算即代表效能退化）"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='querytest',
+            email='query@example.com',
+            password='testpass123'
+        )
+        # 重新讀取使用者，模擬正式環境中每個請求載入的 request.user
+        self.client.force_authenticate(user=CustomUser.objects.get(pk=self.user.pk))
+        self.image_data = PNG_IMAGE_DATA
+    
+    def test_profile_created_with_user(self):
+        """測試建立使用者時自動建立 Profile"""
+        self.assertTrue(UserProfile.objects.filter(user=self.user).exists())
+    
+    def test_get_profile_query_count(self):
+        """測試獲取個人資料只需一次查詢（select_related）"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user/profile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_patch_profile_query_count(self):
+        """測試更新個人資料：讀取一次、寫入一次、讀回寫入後的版本號一次"""
+        with self.assertNumQueries(3):
+            response = self.client.patch(
+                '/api/user/profile/', {'nickname': 'Budget'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_upload_avatar_query_count(self):
+        """測試上傳頭像：讀取一次、檔案參照計數兩次、寫入並讀回版本號、建立縮圖工作一次"""
+        avatar_file = SimpleUploadedFile(
+            name='av_test.png',
+            content=self.image_data,
+            content_type='image/png'
+        )
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                '/api/user/avatar/upload/', {'avatar': avatar_file}, format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_delete_avatar_query_count(self):
+        """測試刪除頭像：讀取一次、釋放檔案參照兩次、寫入並讀回版本號"""
+        profile = UserProfile.objects.get(user=self.user)
+        profile.avatar = 'avatars/missing.png'
+        profile.avatar_url = 'http://testserver/media/avatars/missing.png'
+        profile.save()
+        
+        with self.assertNumQueries(5):
+            response = self.client.delete('/api/user/avatar/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_delete_avatar_without_avatar_skips_write(self):
+        """測試沒有頭像時刪除頭像不寫入資料庫"""
+        with self.assertNumQueries(1):
+            response = self.client.delete('/api/user/avatar/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_patch_with_unchanged_values_skips_write(self):
+        """測試送出與現有資料相同的值時不寫入資料庫"""
+        self.client.patch('/api/user/profile/', {'nickname': 'Same'}, format='json')
+        
+        with self.assertNumQueries(1):
+            response = self.client.patch(
+                '/api/user/profile/', {'nickname': 'Same'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_backfill_profiles_command(self):
+        """測試 backfill_profiles 為缺少 Profile 的使用者補建"""
+        UserProfile.objects.filter(user=self.user).delete()
+        
+        call_command('backfill_profiles', stdout=open(os.devnull, 'w'))
+        
+        self.assertTrue(UserProfile.objects.filter(user=self.user).exists())
+
+
+class ProfileConcurrencyTest(TestCase):
+    """個人資料樂觀並行控制（If-Match / ETag）測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='occtest',
+            email='occ@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_get_returns_etag(self):
+        """測試獲取個人資料時回傳 ETag"""
+        response = self.client.get('/api/user/profile/')
+        
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(response.data['data']['version'], 1)
+    
+    def test_patch_with_matching_if_match(self):
+        """測試 If-Match 版本相符時更新成功並遞增版本"""
+        response = self.client.patch(
+            '/api/user/profile/', {'nickname': 'Device A'},
+            format='json', HTTP_IF_MATCH='"1"'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(UserProfile.objects.get(user=self.user).version, 2)
+    
+    def test_patch_with_stale_if_match_returns_412(self):
+        """測試 If-Match 版本過期時回傳 412 且不更新"""
+        self.client.patch(
+            '/api/user/profile/', {'nickname': 'Device A'},
+            format='json', HTTP_IF_MATCH='"1"'
+        )
+        
+        response = self.client.patch(
+            '/api/user/profile/', {'nickname': 'Device B'},
+            format='json', HTTP_IF_MATCH='"1"'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response.data['error'], 'PRECONDITION_FAILED')
+        self.assertEqual(UserProfile.objects.get(user=self.user).nickname, 'Device A')
+    
+    def test_concurrent_write_between_read_and_update(self):
+        """測試讀取後被其他裝置搶先寫入時，條件式 UPDATE 不會覆蓋"""
+        profile = UserProfile.objects.get(user=self.user)
+        UserProfile.objects.filter(pk=profile.pk).update(nickname='Other', version=2)
+        
+        profile.nickname = 'Mine'
+        
+        self.assertFalse(profile.save_if_version(expected_version=1))
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).nickname, 'Other')
+    
+    def test_unconditional_save_returns_actual_version(self):
+        """測試未帶 If-Match 的寫入與其他寫入交錯時，回傳實際的版本號"""
+        profile = UserProfile.objects.get(user=self.user)
+        UserProfile.objects.filter(pk=profile.pk).update(nickname='Other', version=3)
+        
+        profile.nickname = 'Mine'
+        
+        self.assertTrue(profile.save_if_version())
+        self.assertEqual(profile.version, 4)
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).version, 4)
+    
+    def test_phone_verification_bumps_version(self):
+        """測試個人資料中來自使用者的欄位變動時遞增版本"""
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.phone_verified = True
+        user.save()
+        
+        self.assertEqual(UserProfile.objects.get(user=self.user).version, 2)
+    
+    def test_patch_with_if_match_query_count(self):
+        """測試帶 If-Match 的更新仍只需讀取一次、寫入一次"""
+        self.client.force_authenticate(user=CustomUser.objects.get(pk=self.user.pk))
+        
+        with self.assertNumQueries(2):
+            response = self.client.patch(
+                '/api/user/profile/', {'nickname': 'One Trip'},
+                format='json', HTTP_IF_MATCH='"1"'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(PROFILE_CACHE={'ENABLED': False})
+class ProfileSparseFieldsTest(TestCase):
+    """個人資料稀疏欄位（?fields=）測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='sparsetest',
+            email='sparse@example.com',
+            password='testpass123'
+        )
+        UserProfile.objects.filter(user=self.user).update(nickname='Sparse')
+        self.client.force_authenticate(user=self.user)
+    
+    def test_get_selected_fields_only(self):
+        """測試只回傳指定欄位"""
+        response = self.client.get('/api/user/profile/?fields=nickname,avatar_url')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'], {'nickname': 'Sparse', 'avatar_url': None})
+        self.assertEqual(response['ETag'], '"1"')
+    
+    def test_profile_fields_skip_user_join(self):
+        """測試未要求使用者欄位時不 JOIN 使用者資料表"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/user/profile/?fields=nickname,avatar_url')
+        
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('phone_auth_customuser', queries[0]['sql'])
+        self.assertNotIn('"motivation_1"', queries[0]['sql'])
+    
+    def test_user_fields_use_single_query(self):
+        """測試要求使用者欄位時以單一 JOIN 查詢取得"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user/profile/?fields=id,username,phone_verified')
+        
+        self.assertEqual(response.data['data']['username'], 'sparsetest')
+        self.assertFalse(response.data['data']['phone_verified'])
+        self.assertIsInstance(response.data['data']['id'], str)
+    
+    def test_unknown_field_returns_400(self):
+        """測試指定未知欄位時回傳驗證錯誤"""
+        response = self.client.get('/api/user/profile/?fields=nickname,password')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'VALIDATION_ERROR')
+    
+    @override_settings(PROFILE_CACHE={'ENABLED': True})
+    def test_fields_served_from_cached_payload(self):
+        """測試快取已有完整資料時直接從快取取出欄位"""
+        cache.clear()
+        profile_cache.local_cache.clear()
+        self.client.get('/api/user/profile/')
+        
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/user/profile/?fields=nickname')
+        
+        self.assertEqual(response.data['data'], {'nickname': 'Sparse'})
+
+
+@override_settings(SERVICE_API_TOKENS={'matching': 'matching-token'})
+class BulkProfileTest(TestCase):
+    """批次查詢個人資料（後端服務）測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Service matching-token')
+        self.users = [
+            CustomUser.objects.create_user(username=f'bulk{i}', password='testpass123')
+            for i in range(3)
+        ]
+        for i, user in enumerate(self.users):
+            UserProfile.objects.filter(user=user).update(nickname=f'Bulk {i}')
+    
+    def test_bulk_fetch_keeps_request_order(self):
+        """測試回傳順序與請求順序相同，且只用一次查詢"""
+        user_ids = [self.users[2].pk, self.users[0].pk, self.users[1].pk]
+        
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                '/api/user/profiles/bulk/', {'user_ids': user_ids}, format='json'
+            )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['user_id'] for item in response.data['data']], user_ids)
+        self.assertEqual(response.data['data'][0]['nickname'], 'Bulk 2')
+        self.assertEqual(response.data['data'][0]['username'], 'bulk2')
+    
+    def test_bulk_fetch_by_profile_id_with_sparse_fields(self):
+        """測試以 Profile ID 查詢並只回傳指定欄位"""
+        profile = UserProfile.objects.get(user=self.users[1])
+        
+        response = self.client.post(
+            '/api/user/profiles/bulk/',
+            {'profile_ids': [str(profile.pk)], 'fields': ['nickname']},
+            format='json'
+        )
+        
+        self.assertEqual(
+            response.data['data'],
+            [{'user_id': self.users[1].pk, 'nickname': 'Bulk 1'}]
+        )
+    
+    def test_bulk_fetch_reports_missing_and_dedupes(self):
+        """測試找不到的 ID 列在 missing，重複的 Profile 只回傳一次"""
+        profile = UserProfile.objects.get(user=self.users[0])
+        
+        response = self.client.post(
+            '/api/user/profiles/bulk/',
+            {'user_ids': [self.users[0].pk, 99999], 'profile_ids': [str(profile.pk)]},
+            format='json'
+        )
+        
+        self.assertEqual(len(response.data['data']), 1)
+        self.assertEqual(response.data['missing'], {'user_ids': [99999], 'profile_ids': []})
+    
+    @override_settings(PROFILE_BULK_MAX_IDS=2)
+    def test_bulk_fetch_too_many_ids(self):
+        """測試超過數量上限時回傳驗證錯誤"""
+        response = self.client.post(
+            '/api/user/profiles/bulk/',
+            {'user_ids': [user.pk for user in self.users]},
+            format='json'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'VALIDATION_ERROR')
+    
+    def test_bulk_fetch_requires_service_token(self):
+        """測試一般使用者或錯誤 token 無法呼叫"""
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        response = client.post(
+            '/api/user/profiles/bulk/', {'user_ids': [self.users[0].pk]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Service wrong-token')
+        response = client.post(
+            '/api/user/profiles/bulk/', {'user_ids': [self.users[0].pk]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AvatarUploadHandlerTest(TestCase):
+    """頭像上傳串流檢查測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='handlertest',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_rejects_by_content_length_before_reading(self):
+        """測試 Content-Length 超過上限時不讀取 body 直接拒絕"""
+        handler = AvatarUploadHandler(max_size=1024)
+        
+        with self.assertRaises(AvatarUploadRejected) as ctx:
+            handler.handle_raw_input(None, {}, 1024 + MULTIPART_OVERHEAD + 1, b'boundary')
+        
+        self.assertEqual(ctx.exception.detail['error'], 'FILE_TOO_LARGE')
+    
+    def test_aborts_mid_stream_when_limit_crossed(self):
+        """測試接收過程中超過上限立即中止"""
+        handler = AvatarUploadHandler(max_size=1024)
+        handler.new_file('avatar', 'a.png', 'image/png', None)
+        handler.receive_data_chunk(PNG_IMAGE_DATA + b'\x00' * 500, 0)
+        
+        with self.assertRaises(AvatarUploadRejected) as ctx:
+            handler.receive_data_chunk(b'\x00' * 600, 500)
+        
+        self.assertEqual(ctx.exception.detail['error'], 'FILE_TOO_LARGE')
+    
+    def test_rejects_non_image_header(self):
+        """測試檔頭不是圖片格式時中止"""
+        handler = AvatarUploadHandler()
+        handler.new_file('avatar', 'a.png', 'image/png', None)
+        
+        with self.assertRaises(AvatarUploadRejected):
+            handler.receive_data_chunk(b'MZ\x90\x00 not really a png', 0)
+    
+    def test_sniff_image_format(self):
+        """測試以 magic bytes 判斷圖片格式"""
+        self.assertEqual(sniff_image_format(PNG_IMAGE_DATA), 'PNG')
+        self.assertEqual(sniff_image_format(b'\xff\xd8\xff\xe0\x00\x10JFIF'), 'JPEG')
+        self.assertEqual(sniff_image_format(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'WEBP')
+        self.assertIsNone(sniff_image_format(b'This is not an image'))
+    
+    @override_settings(AVATAR_MAX_UPLOAD_SIZE=1024)
+    def test_upload_endpoint_rejects_oversized_upload(self):
+        """測試上傳端點依設定的上限拒絕過大的檔案"""
+        avatar_file = SimpleUploadedFile(
+            name='big.png',
+            content=PNG_IMAGE_DATA + b'\x00' * 2048,
+            content_type='image/png'
+        )
+        
+        response = self.client.post(
+            '/api/user/avatar/upload/', {'avatar': avatar_file}, format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.data['success'])
+        self.assertEqual(response.data['error'], 'FILE_TOO_LARGE')
+
+
+class AvatarProcessingTest(TestCase):
+    """頭像背景處理（縮圖）測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='renditiontest',
+            email='rendition@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def _jpeg_with_orientation(self, size=(40, 20), orientation=6, color=(200, 30, 30)):
+        """產生帶有 EXIF 方向與 GPS 資訊的 JPEG"""
+        image = Image.new('RGB', size, color)
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x8825] = {1: 'N'}
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+    
+    def _upload(self, content, name='photo.jpg', content_type='image/jpeg'):
+        return self.client.post(
+            '/api/user/avatar/upload/',
+            {'avatar': SimpleUploadedFile(name=name, content=content, content_type=content_type)},
+            format='multipart'
+        )
+    
+    def test_upload_enqueues_job_without_processing(self):
+        """測試上傳只建立工作，不在 request 中產生縮圖"""
+        response = self._upload(PNG_IMAGE_DATA, name='av_test.png', content_type='image/png')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        job = AvatarProcessingJob.objects.get(profile__user=self.user)
+        self.assertEqual(job.status, AvatarProcessingJob.Status.PENDING)
+        self.assertEqual(UserProfile.objects.get(user=self.user).avatar_renditions, {})
+    
+    def test_avatar_changes_bump_version(self):
+        """測試上傳、縮圖完成與刪除頭像都會改變 ETag"""
+        etags = [self.client.get('/api/user/profile/')['ETag']]
+        
+        self._upload(PNG_IMAGE_DATA, name='av_test.png', content_type='image/png')
+        etags.append(self.client.get('/api/user/profile/')['ETag'])
+        
+        process_job(AvatarProcessingJob.objects.get(profile__user=self.user))
+        etags.append(self.client.get('/api/user/profile/')['ETag'])
+        
+        self.client.delete('/api/user/avatar/')
+        etags.append(self.client.get('/api/user/profile/')['ETag'])
+        
+        self.assertEqual(etags, ['"1"', '"2"', '"3"', '"4"'])
+    
+    def test_render_renditions_sizes_and_formats(self):
+        """測試產生各尺寸的正方形 WebP 與 JPEG"""
+        rendered = render_renditions(io.BytesIO(self._jpeg_with_orientation()), (64, 128))
+        
+        self.assertEqual(set(rendered), {64, 128})
+        with Image.open(io.BytesIO(rendered[64]['webp'])) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (64, 64))
+        with Image.open(io.BytesIO(rendered[128]['jpeg'])) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (128, 128))
+    
+    @override_settings(AVATAR_RENDITION_SIZES=(16,))
+    def test_render_applies_orientation_and_strips_exif(self):
+        """測試依 EXIF 方向轉正，且輸出不含 EXIF"""
+        # 40x20 的橫向圖片，方向 6（需順時針旋轉 90 度）：左半紅、右半藍
+        image = Image.new('RGB', (40, 20), (255, 0, 0))
+        image.paste((0, 0, 255), (20, 0, 40, 20))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif, quality=95)
+        
+        rendered = render_renditions(io.BytesIO(buffer.getvalue()), (16,))
+        
+        with Image.open(io.BytesIO(rendered[16]['jpeg'])) as output:
+            self.assertEqual(len(output.getexif()), 0)
+            # 轉正後原本的左半（紅）在上方
+            top = output.convert('RGB').getpixel((8, 2))
+            bottom = output.convert('RGB').getpixel((8, 13))
+            self.assertGreater(top[0], top[2])
+            self.assertGreater(bottom[2], bottom[0])
+    
+    def test_worker_writes_renditions_to_profile(self):
+        """測試 worker 產生縮圖並更新 avatar_url"""
+        self._upload(self._jpeg_with_orientation())
+        
+        call_command('process_avatar_jobs', '--once', stdout=open(os.devnull, 'w'))
+        
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(set(profile.avatar_renditions), {'64', '128', '512'})
+        self.assertEqual(len(profile.avatar_rendition_files), 6)
+        self.assertEqual(profile.avatar_url, profile.avatar_renditions['128']['webp'])
+        self.assertTrue(profile.avatar_url.startswith('http://testserver/'))
+        job = AvatarProcessingJob.objects.get(profile=profile)
+        self.assertEqual(job.status, AvatarProcessingJob.Status.DONE)
+        
+        response = self.client.get('/api/user/profile/')
+        self.assertEqual(response.data['data']['avatar_renditions'], profile.avatar_renditions)
+    
+    def test_superseded_job_is_discarded(self):
+        """測試處理期間已上傳新頭像時捨棄舊工作的結果"""
+        self._upload(self._jpeg_with_orientation())
+        first_job = AvatarProcessingJob.objects.get(profile__user=self.user)
+        self._upload(self._jpeg_with_orientation(color=(30, 30, 200)), name='second.jpg')
+        
+        first_job.refresh_from_db()
+        process_job(first_job)
+        
+        first_job.refresh_from_db()
+        self.assertEqual(first_job.status, AvatarProcessingJob.Status.SUPERSEDED)
+        self.assertEqual(UserProfile.objects.get(user=self.user).avatar_renditions, {})
+    
+    @override_settings(IMAGE_POOL={'WORKERS': 0})
+    def test_failed_job_is_retried_then_marked_failed(self):
+        """測試處理失敗時重試，超過次數後標記為失敗"""
+        self._upload(self._jpeg_with_orientation())
+        
+        with mock.patch(
+            'edit_profile.avatar_processing.render_renditions',
+            side_effect=OSError('broken image')
+        ):
+            run_pending_jobs()
+            job = AvatarProcessingJob.objects.get(profile__user=self.user)
+            self.assertGreater(job.run_after, timezone.now())
+            # 重試前須等待退避時間
+            self.assertEqual(run_pending_jobs(), 0)
+            for _ in range(2):
+                AvatarProcessingJob.objects.update(run_after=timezone.now())
+                run_pending_jobs()
+        
+        job = AvatarProcessingJob.objects.get(profile__user=self.user)
+        self.assertEqual(job.status, AvatarProcessingJob.Status.FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(job.error_message, 'broken image')
+        self.assertIsNotNone(job.finished_at)
+    
+    def test_failure_before_processing_requeues_job(self):
+        """測試讀取原始檔等處理前的錯誤也會放回佇列，且未完成的工作沒有完成時間"""
+        self._upload(self._jpeg_with_orientation())
+        
+        with mock.patch(
+            'edit_profile.storage.ContentAddressedStorage.open',
+            side_effect=OSError('storage unavailable')
+        ):
+            run_pending_jobs(max_jobs=1)
+        
+        job = AvatarProcessingJob.objects.get(profile__user=self.user)
+        self.assertEqual(job.status, AvatarProcessingJob.Status.PENDING)
+        self.assertEqual(job.error_message, 'storage unavailable')
+        self.assertIsNone(job.finished_at)
+        
+        AvatarProcessingJob.objects.update(run_after=timezone.now())
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, AvatarProcessingJob.Status.DONE)
+    
+    def test_concurrent_jobs_release_replaced_renditions(self):
+        """測試同一個頭像的兩筆工作並行完成時，各自釋放實際被取代的縮圖"""
+        self._upload(self._jpeg_with_orientation())
+        profile = UserProfile.objects.get(user=self.user)
+        enqueue_avatar_processing(profile, 'http://testserver/')
+        
+        # 兩筆工作都在對方完成前被取得
+        jobs = [claim_next_job(), claim_next_job()]
+        for job in jobs:
+            process_job(job)
+        
+        files = UserProfile.objects.get(user=self.user).avatar_rendition_files
+        self.assertEqual(
+            set(AvatarBlob.objects.filter(name__in=files).values_list('ref_count', flat=True)),
+            {1}
+        )
+    
+    def test_failure_after_saving_releases_renditions(self):
+        """測試縮圖已儲存但寫回 Profile 前失敗時釋放縮圖"""
+        self._upload(self._jpeg_with_orientation())
+        
+        with self.captureOnCommitCallbacks(execute=True), mock.patch(
+            'edit_profile.avatar_processing.get_default_rendition_size',
+            side_effect=RuntimeError('boom')
+        ):
+            run_pending_jobs(max_jobs=1)
+        
+        job = AvatarProcessingJob.objects.get(profile__user=self.user)
+        self.assertEqual(job.status, AvatarProcessingJob.Status.PENDING)
+        self.assertFalse(AvatarBlob.objects.filter(name__startswith='avatars/renditions/').exists())
+        rendition_root = os.path.join(self.media_root, 'avatars', 'renditions')
+        self.assertEqual([name for _, _, names in os.walk(rendition_root) for name in names], [])
+    
+    def test_delete_avatar_removes_rendition_files(self):
+        """測試刪除頭像時一併刪除縮圖檔案"""
+        self._upload(self._jpeg_with_orientation())
+        run_pending_jobs()
+        files = UserProfile.objects.get(user=self.user).avatar_rendition_files
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/api/user/avatar/')
+        
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.avatar_renditions, {})
+        for name in files:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+
+class ImagePoolTest(TestCase):
+    """圖片處理行程池測試"""
+    
+    def setUp(self):
+        image_pool.shutdown(terminate=True)
+        self.addCleanup(image_pool.shutdown, terminate=True)
+    
+    def test_runs_in_child_process(self):
+        """測試工作在子行程中執行並回傳結果"""
+        self.assertNotEqual(image_pool.run(os.getpid), os.getpid())
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 20), (10, 20, 30)).save(buffer, 'JPEG')
+        rendered = image_pool.run(render_renditions, io.BytesIO(buffer.getvalue()), (16,))
+        self.assertEqual(Image.open(io.BytesIO(rendered[16]['webp'])).size, (16, 16))
+    
+    def test_exception_is_reraised(self):
+        """測試子行程中的例外在呼叫端重新拋出"""
+        with self.assertRaises(ValueError):
+            image_pool.run(int, 'not a number')
+    
+    @override_settings(IMAGE_POOL={'WORKERS': 0})
+    def test_runs_inline_when_disabled(self):
+        """測試 WORKERS 為 0 時在目前行程中執行"""
+        self.assertEqual(image_pool.run(os.getpid), os.getpid())
+    
+    @override_settings(IMAGE_POOL={'WORKERS': 1, 'TIMEOUT': 0.5})
+    def test_timeout_restarts_pool(self):
+        """測試逾時的工作被終止，之後重新建立行程池"""
+        with self.assertRaises(image_pool.ImagePoolTimeout):
+            image_pool.run(time.sleep, 10)
+        
+        self.assertNotEqual(image_pool.run(os.getpid), os.getpid())
+    
+    @override_settings(IMAGE_POOL={'WORKERS': 1, 'MAX_PENDING': 1, 'QUEUE_TIMEOUT': 0})
+    def test_saturated_pool_rejects_new_jobs(self):
+        """測試行程池已滿時不排隊等待，直接拋出 ImagePoolBusy"""
+        image_pool.run(os.getpid)
+        worker = threading.Thread(target=image_pool.run, args=(time.sleep, 1))
+        worker.start()
+        self.addCleanup(worker.join)
+        time.sleep(0.2)
+        
+        with self.assertRaises(image_pool.ImagePoolBusy):
+            image_pool.run(os.getpid)
+
+
+class ContentAddressedStorageTest(TestCase):
+    """內容定址頭像儲存與參照計數測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.storage = ContentAddressedStorage()
+        self.client = APIClient()
+        self.users = [
+            CustomUser.objects.create_user(
+                username=f'castest{i}',
+                email=f'cas{i}@example.com',
+                password='testpass123'
+            )
+            for i in range(2)
+        ]
+    
+    def _upload(self, user, content=PNG_IMAGE_DATA, name='Photo.PNG'):
+        self.client.force_authenticate(user=user)
+        return self.client.post(
+            '/api/user/avatar/upload/',
+            {'avatar': SimpleUploadedFile(name=name, content=content, content_type='image/png')},
+            format='multipart'
+        )
+    
+    def test_name_is_content_hash(self):
+        """測試檔名由內容雜湊決定，與原始檔名無關"""
+        first = self.storage.save('avatars/a.png', SimpleUploadedFile('a.png', b'same-bytes'))
+        second = self.storage.save('avatars/renamed.png', SimpleUploadedFile('b.png', b'same-bytes'))
+        other = self.storage.save('avatars/a.png', SimpleUploadedFile('a.png', b'other-bytes'))
+        
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^avatars/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(
+            [name for name in os.listdir(self.storage.path('avatars')) if name.startswith('.')],
+            []
+        )
+    
+    def test_identical_uploads_share_one_file(self):
+        """測試不同使用者上傳相同內容時只儲存一份"""
+        self._upload(self.users[0])
+        self._upload(self.users[1], name='other-name.png')
+        
+        names = set(UserProfile.objects.values_list('avatar', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(AvatarBlob.objects.get(name=names.pop()).ref_count, 2)
+    
+    def test_shared_file_deleted_after_last_reference(self):
+        """測試檔案在最後一個參照移除後才刪除"""
+        self._upload(self.users[0])
+        self._upload(self.users[1])
+        name = UserProfile.objects.get(user=self.users[0]).avatar.name
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.users[0])
+            self.client.delete('/api/user/avatar/')
+        self.assertTrue(self.storage.exists(name))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.users[1])
+            self.client.delete('/api/user/avatar/')
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(AvatarBlob.objects.filter(name=name).exists())
+    
+    def test_replacing_avatar_releases_previous_file(self):
+        """測試更換頭像時釋放舊檔案"""
+        self._upload(self.users[0])
+        old_name = UserProfile.objects.get(user=self.users[0]).avatar.name
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._upload(self.users[0], content=PNG_IMAGE_DATA + b'\x00')
+        
+        self.assertFalse(self.storage.exists(old_name))
+        self.assertNotEqual(UserProfile.objects.get(user=self.users[0]).avatar.name, old_name)
+
+
+class AvatarGarbageCollectionTest(TestCase):
+    """gc_avatars 管理指令測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        user = CustomUser.objects.create_user(
+            username='gctest',
+            email='gc@example.com',
+            password='testpass123'
+        )
+        # 較早產生的縮圖只記錄在 avatar_rendition_files，沒有 AvatarBlob
+        UserProfile.objects.filter(user=user).update(
+            avatar='avatars/2025/01/01/kept.png',
+            avatar_rendition_files=['avatars/renditions/legacy_128.webp'],
+        )
+        AvatarBlob.objects.create(name='avatars/ab/cd/shared.webp', ref_count=1)
+        
+        old = time.time() - 48 * 3600
+        self.paths = {}
+        for name, mtime in [
+            ('avatars/2025/01/01/kept.png', old),
+            ('avatars/ab/cd/shared.webp', old),
+            ('avatars/renditions/legacy_128.webp', old),
+            ('avatars/2025/01/01/orphan.png', old),
+            ('avatars/ef/01/orphan.jpg', old),
+            ('avatars/ef/01/recent.jpg', None),
+        ]:
+            path = os.path.join(self.media_root, *name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 10)
+            if mtime is not None:
+                os.utime(path, (mtime, mtime))
+            self.paths[name] = path
+    
+    def _run(self, *args):
+        call_command('backfill_avatar_blobs', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('gc_avatars', '--workers', '3', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+    
+    def test_dry_run_keeps_files(self):
+        """測試 dry-run 只統計不刪除"""
+        output = self._run('--dry-run')
+        
+        self.assertIn('掃描 6 個檔案', output)
+        self.assertIn('可刪除 2 個', output)
+        self.assertTrue(all(os.path.exists(path) for path in self.paths.values()))
+    
+    def test_deletes_only_old_unreferenced_files(self):
+        """測試只刪除超過保留期限且沒有參照的檔案"""
+        output = self._run()
+        
+        self.assertIn('已刪除 2 個（20 bytes）', output)
+        remaining = {name for name, path in self.paths.items() if os.path.exists(path)}
+        self.assertEqual(remaining, {
+            'avatars/2025/01/01/kept.png',
+            'avatars/ab/cd/shared.webp',
+            'avatars/renditions/legacy_128.webp',
+            'avatars/ef/01/recent.jpg',
+        })
+    
+    def test_backfill_avatar_blobs(self):
+        """測試只為沒有紀錄的縮圖補建 AvatarBlob，重複執行不會重複計算"""
+        call_command('backfill_avatar_blobs', '--batch-size', '1', stdout=io.StringIO())
+        call_command('backfill_avatar_blobs', stdout=io.StringIO())
+        
+        self.assertEqual(
+            AvatarBlob.objects.get(name='avatars/renditions/legacy_128.webp').ref_count, 1
+        )
+        self.assertEqual(AvatarBlob.objects.get(name='avatars/ab/cd/shared.webp').ref_count, 1)
+
+
+class AvatarServingTest(TestCase):
+    """頭像檔案提供（serve_avatar）測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='servetest',
+            email='serve@example.com',
+            password='testpass123'
+        )
+        self.client.force_login(self.user)
+        self.content = PNG_IMAGE_DATA
+        self.name = ContentAddressedStorage().save(
+            'avatars/a.png', SimpleUploadedFile('a.png', self.content)
+        )
+        self.url = f'/media/{self.name}'
+    
+    def test_serves_file_with_cache_headers(self):
+        """測試回傳檔案與 ETag、Last-Modified、Cache-Control"""
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['ETag'], f'"{self.name.rsplit("/", 1)[1][:64]}"')
+        self.assertIn('Last-Modified', response)
+        self.assertIn('immutable', response['Cache-Control'])
+    
+    def test_conditional_request_returns_304(self):
+        """測試 If-None-Match 相符時回傳 304"""
+        etag = self.client.get(self.url)['ETag']
+        
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_range_request(self):
+        """測試 Range 請求回傳 206 與指定範圍"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1-3')
+        
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.content[1:4])
+        self.assertEqual(response['Content-Range'], f'bytes 1-3/{len(self.content)}')
+        
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+    
+    @override_settings(AVATAR_SENDFILE_BACKEND='nginx', AVATAR_SENDFILE_PREFIX='/protected-media/')
+    def test_nginx_offload(self):
+        """測試設定 nginx 時只回傳 X-Accel-Redirect，不傳送檔案內容"""
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+    
+    def test_requires_login_and_existing_file(self):
+        """測試未登入時拒絕、檔案不存在或路徑不合法時回傳 404"""
+        self.assertEqual(self.client.get('/media/avatars/00/00/missing.png').status_code, 404)
+        self.assertEqual(self.client.get('/media/avatars/../../settings.py').status_code, 404)
+        
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_signed_url(self):
+        """測試以簽章 URL 下載頭像，token 與檔名不符或過期時拒絕"""
+        self.client.logout()
+        signed = sign_avatar_url(f'http://testserver{self.url}')
+        self.assertEqual(self.client.get(signed).status_code, status.HTTP_200_OK)
+        
+        other = self.url.replace(self.name.rsplit('/', 1)[1], '0' * 64 + '.png')
+        token = signed.split('?', 1)[1]
+        self.assertEqual(self.client.get(f'{other}?{token}').status_code, status.HTTP_403_FORBIDDEN)
+        
+        with override_settings(AVATAR_SERVE_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.client.get(signed).status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_basic_auth_not_accepted(self):
+        """測試不以 Basic 認證授權（避免每張圖片都計算密碼雜湊）"""
+        self.client.logout()
+        credentials = base64.b64encode(f'{self.user.username}:testpass123'.encode()).decode()
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Basic {credentials}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DirectUploadTest(TestCase):
+    """頭像直傳（presigned upload）測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.upload_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_root, ignore_errors=True)
+        upload_override = override_settings(AVATAR_DIRECT_UPLOAD_ROOT=self.upload_root)
+        upload_override.enable()
+        self.addCleanup(upload_override.disable)
+        
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='directtest',
+            email='direct@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def _create(self, content_type='image/png', size=len(PNG_IMAGE_DATA)):
+        return self.client.post(
+            '/api/user/avatar/direct/',
+            {'content_type': content_type, 'size': size},
+            format='json'
+        )
+    
+    def _put(self, data, content, content_type='image/png'):
+        return APIClient().put(data['upload_url'], data=content, content_type=content_type)
+    
+    def test_direct_upload_flow(self):
+        """測試取得上傳 URL、直接上傳、確認後更新頭像"""
+        data = self._create().data['data']
+        self.assertEqual(data['method'], 'PUT')
+        
+        self.assertEqual(self._put(data, PNG_IMAGE_DATA).status_code, status.HTTP_200_OK)
+        response = self.client.post(
+            '/api/user/avatar/direct/confirm/', {'upload_id': data['upload_id']}, format='json'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertTrue(profile.avatar.name.endswith('.png'))
+        self.assertIsNotNone(profile.avatar_uploaded_at)
+        self.assertEqual(response.data['data']['avatar_url'], profile.avatar_url)
+        self.assertTrue(AvatarProcessingJob.objects.filter(profile=profile).exists())
+        # 物件已移走，只留下標記 key 已使用的紀錄檔
+        self.assertEqual(
+            [name for name in os.listdir(os.path.join(self.upload_root, str(self.user.pk)))
+             if not name.endswith('.sha256')],
+            []
+        )
+    
+    def test_upload_url_is_single_use(self):
+        """測試簽章上傳 URL 成功上傳後不能再使用（確認前後皆同）"""
+        data = self._create().data['data']
+        self.assertEqual(self._put(data, PNG_IMAGE_DATA).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._put(data, PNG_IMAGE_DATA).status_code, status.HTTP_403_FORBIDDEN)
+        
+        self.client.post('/api/user/avatar/direct/confirm/', {'upload_id': data['upload_id']}, format='json')
+        self.assertEqual(self._put(data, PNG_IMAGE_DATA).status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_objects_are_not_stored_under_media_root(self):
+        """測試未驗證的上傳內容預設不放在 MEDIA_ROOT 下"""
+        with override_settings(AVATAR_DIRECT_UPLOAD_ROOT=None):
+            root = os.path.realpath(LocalDirectUploadBackend().root)
+        
+        self.assertFalse(root.startswith(os.path.realpath(self.media_root) + os.sep))
+    
+    def test_confirm_moves_object_without_reading_it(self):
+        """測試確認時只讀取物件開頭，並將物件移為頭像而不是複製內容"""
+        data = self._create().data['data']
+        self._put(data, PNG_IMAGE_DATA)
+        
+        with mock.patch.object(LocalDirectUploadBackend, 'open', side_effect=AssertionError('不應讀取整個物件')), \
+                mock.patch.object(ContentAddressedStorage, '_save', side_effect=AssertionError('不應複製物件')):
+            response = self.client.post(
+                '/api/user/avatar/direct/confirm/', {'upload_id': data['upload_id']}, format='json'
+            )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = UserProfile.objects.get(user=self.user)
+        digest = hashlib.sha256(PNG_IMAGE_DATA).hexdigest()
+        self.assertEqual(profile.avatar.name, f'avatars/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        with profile.avatar.open('rb') as stored:
+            self.assertEqual(stored.read(), PNG_IMAGE_DATA)
+        self.assertEqual(AvatarBlob.objects.get(name=profile.avatar.name).ref_count, 1)
+        self.assertIn('immutable', _cache_control(profile.avatar.name))
+    
+    def test_confirm_deduplicates_existing_content(self):
+        """測試直傳的內容已存在時參照同一個檔案"""
+        existing = ContentAddressedStorage().save('avatars/a.png', SimpleUploadedFile('a.png', PNG_IMAGE_DATA))
+        AvatarBlob.objects.acquire([existing])
+        data = self._create().data['data']
+        self._put(data, PNG_IMAGE_DATA)
+        
+        self.client.post('/api/user/avatar/direct/confirm/', {'upload_id': data['upload_id']}, format='json')
+        
+        self.assertEqual(UserProfile.objects.get(user=self.user).avatar.name, existing)
+        self.assertEqual(AvatarBlob.objects.get(name=existing).ref_count, 2)
+    
+    @override_settings(AVATAR_MAX_UPLOAD_SIZE=2 * 1024 * 1024)
+    def test_size_message_follows_setting(self):
+        """測試檔案過大的訊息使用設定的上限"""
+        _, response = _validate_stored_avatar(None, 3 * 1024 * 1024)
+        
+        self.assertEqual(response.data['error'], 'FILE_TOO_LARGE')
+        self.assertIn('2MB', response.data['message'])
+    
+    def test_create_rejects_oversized_or_non_image(self):
+        """測試宣告的大小或類型不符時不發出上傳 URL"""
+        self.assertEqual(self._create(size=10 * 1024 * 1024).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._create(content_type='text/html').status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_put_enforces_signed_limits(self):
+        """測試上傳內容超過簽章中的大小或 Content-Type 不符時拒絕"""
+        data = self._create(size=10).data['data']
+        
+        self.assertEqual(self._put(data, PNG_IMAGE_DATA).status_code, 413)
+        self.assertEqual(self._put(data, b'x' * 5, content_type='image/gif').status_code, 403)
+        self.assertEqual(
+            APIClient().put(data['upload_url'] + 'x/', data=b'x', content_type='image/png').status_code,
+            404
+        )
+    
+    def test_confirm_rejects_non_image(self):
+        """測試確認時上傳內容不是圖片則拒絕並刪除"""
+        data = self._create(size=20).data['data']
+        self._put(data, b'not an image at all!')
+        
+        response = self.client.post(
+            '/api/user/avatar/direct/confirm/', {'upload_id': data['upload_id']}, format='json'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'VALIDATION_ERROR')
+        self.assertFalse(UserProfile.objects.get(user=self.user).avatar)
+    
+    def test_confirm_rejects_other_users_upload(self):
+        """測試不能確認其他使用者的上傳"""
+        data = self._create().data['data']
+        self._put(data, PNG_IMAGE_DATA)
+        other = CustomUser.objects.create_user(username='other', password='testpass123')
+        self.client.force_authenticate(user=other)
+        
+        response = self.client.post(
+            '/api/user/avatar/direct/confirm/', {'upload_id': data['upload_id']}, format='json'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'UPLOAD_NOT_FOUND')
+
+
+class ResumableUploadTest(TestCase):
+    """可續傳分段上傳測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.session_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.session_root, ignore_errors=True)
+        session_override = override_settings(AVATAR_UPLOAD_SESSION_ROOT=self.session_root)
+        session_override.enable()
+        self.addCleanup(session_override.disable)
+        
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='resumetest',
+            email='resume@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.content = PNG_IMAGE_DATA
+    
+    def _create(self, content=None, sha256=None):
+        content = self.content if content is None else content
+        response = self.client.post(
+            '/api/user/avatar/sessions/',
+            {'size': len(content), 'sha256': sha256 or hashlib.sha256(content).hexdigest()},
+            format='json'
+        )
+        return f"/api/user/avatar/sessions/{response.data['data']['session_id']}/"
+    
+    def _put(self, url, offset, chunk):
+        return self.client.put(
+            url, data=chunk, content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset)
+        )
+    
+    def test_parts_are_not_stored_under_media_root(self):
+        """測試未完成的暫存檔預設不放在 MEDIA_ROOT 下"""
+        with override_settings(AVATAR_UPLOAD_SESSION_ROOT=None):
+            root = os.path.realpath(get_session_root())
+        
+        self.assertFalse(root.startswith(os.path.realpath(self.media_root) + os.sep))
+    
+    def test_chunked_upload_and_resume(self):
+        """測試分段上傳、中斷後查詢 offset 繼續，完成後更新頭像"""
+        url = self._create()
+        
+        self.assertEqual(self._put(url, 0, self.content[:30])['Upload-Offset'], '30')
+        # 中斷後重新查詢 offset
+        self.assertEqual(self.client.get(url).data['data']['offset'], 30)
+        # 使用錯誤的 offset 時回傳目前位置
+        response = self._put(url, 0, self.content)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Upload-Offset'], '30')
+        
+        self._put(url, 30, self.content[30:])
+        response = self.client.post(url + 'finalize/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.avatar.read(), self.content)
+        self.assertFalse(AvatarUploadSession.objects.exists())
+        self.assertEqual(os.listdir(self.session_root), [])
+    
+    def test_finalize_requires_complete_upload(self):
+        """測試尚未上傳完成時不能完成"""
+        url = self._create()
+        self._put(url, 0, self.content[:10])
+        
+        response = self.client.post(url + 'finalize/')
+        
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['error'], 'UPLOAD_INCOMPLETE')
+    
+    def test_checksum_mismatch(self):
+        """測試 SHA-256 不符時拒絕並刪除 session"""
+        url = self._create(sha256='0' * 64)
+        self._put(url, 0, self.content)
+        
+        response = self.client.post(url + 'finalize/')
+        
+        self.assertEqual(response.data['error'], 'CHECKSUM_MISMATCH')
+        self.assertFalse(AvatarUploadSession.objects.exists())
+        self.assertFalse(UserProfile.objects.get(user=self.user).avatar)
+    
+    def test_first_chunk_must_be_image(self):
+        """測試第一段不是圖片時立即拒絕"""
+        content = b'MZ this is not an image file'
+        url = self._create(content=content)
+        
+        response = self._put(url, 0, content[:20])
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(AvatarUploadSession.objects.exists())
+    
+    def test_chunk_beyond_declared_size(self):
+        """測試上傳內容超過宣告大小時拒絕"""
+        url = self._create()
+        
+        response = self._put(url, 0, self.content + b'extra')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_other_users_session_not_found(self):
+        """測試不能存取其他使用者的 session"""
+        url = self._create()
+        other = CustomUser.objects.create_user(username='resumeother', password='testpass123')
+        self.client.force_authenticate(user=other)
+        
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_cleanup_expired_sessions(self):
+        """測試過期 session 與暫存檔由管理指令清除"""
+        url = self._create()
+        self._put(url, 0, self.content[:10])
+        AvatarUploadSession.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        
+        call_command('cleanup_avatar_uploads', stdout=open(os.devnull, 'w'))
+        
+        self.assertFalse(AvatarUploadSession.objects.exists())
+        self.assertEqual(os.listdir(self.session_root), [])
+
+
+def _png_with_size(width, height):
+    """以 PNG_IMAGE_DATA 為基礎，只修改 IHDR 中的長寬（像素資料不變）"""
+    ihdr = b'IHDR' + width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + PNG_IMAGE_DATA[24:29]
+    return (
+        PNG_IMAGE_DATA[:12] + ihdr + zlib.crc32(ihdr).to_bytes(4, 'big') + PNG_IMAGE_DATA[33:]
+    )
+
+
+class AvatarImageValidationTest(TestCase):
+    """頭像圖片 header-only 驗證測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(
+            username='validatetest',
+            email='validate@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_inspect_reads_header_only(self):
+        """測試只讀取檔頭即可取得格式與長寬"""
+        self.assertEqual(inspect_image(io.BytesIO(_png_with_size(12000, 8000))), ('PNG', 12000, 8000))
+    
+    def test_rejects_huge_dimensions(self):
+        """測試長寬過大的小檔案（decompression bomb）在解碼前被拒絕"""
+        response = self.client.post(
+            '/api/user/avatar/upload/',
+            {'avatar': SimpleUploadedFile('bomb.png', _png_with_size(30000, 30000), 'image/png')},
+            format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('6000', str(response.data['details']['avatar']))
+    
+    @override_settings(AVATAR_MAX_IMAGE_PIXELS=100)
+    def test_rejects_too_many_pixels(self):
+        """測試總像素超過上限時拒絕"""
+        response = self.client.post(
+            '/api/user/avatar/upload/',
+            {'avatar': SimpleUploadedFile('wide.png', _png_with_size(20, 20), 'image/png')},
+            format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_rejects_format_not_allowed(self):
+        """測試 Pillow 可讀取但不允許的格式（BMP）"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4)).save(buffer, 'BMP')
+        
+        with self.assertRaises(ValidationError):
+            inspect_image(buffer)
+    
+    def test_large_jpeg_decoded_with_draft(self):
+        """測試大張 JPEG 產生縮圖時以 draft mode 縮小解碼"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (2400, 1600), (10, 120, 200)).save(buffer, 'JPEG')
+        decoded_sizes = []
+        original_load = Image.Image.load
+        
+        def record_load(image):
+            result = original_load(image)
+            if image.format == 'JPEG':
+                decoded_sizes.append(image.size)
+            return result
+        
+        with mock.patch.object(Image.Image, 'load', record_load):
+            rendered = render_renditions(io.BytesIO(buffer.getvalue()), (64, 512))
+        
+        self.assertEqual(Image.open(io.BytesIO(rendered[512]['webp'])).size, (512, 512))
+        self.assertTrue(decoded_sizes)
+        self.assertLess(decoded_sizes[0][0], 2400)
@@ -0,0 +1,161 @@
+"""
+頭像上傳的串流檢查
+
+在 Django 緩衝整個上傳內容、Pillow 開啟圖片之前就拒絕不合格的上傳：
+
+1. 依 Content-Length 直接拒絕過大的請求（不讀取 body）
+2. 接收過程中累計位元組數，超過上限立即中止
+3. 以檔案開頭的 magic bytes 判斷圖片格式，不是圖片就中止
+"""
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.http.multipartparser import (
+    MultiPartParser as DjangoMultiPartParser,
+    MultiPartParserError,
+)
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+# 頭像檔案大小上限（預設 5MB）
+DEFAULT_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+
+# multipart 邊界與表單欄位的額外空間
+MULTIPART_OVERHEAD = 64 * 1024
+
+# 判斷格式所需的檔頭長度
+HEADER_BYTES = 12
+
+# 各圖片格式對應的副檔名
+IMAGE_EXTENSIONS = {
+    'PNG': '.png',
+    'JPEG': '.jpg',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+}
+
+
+def get_max_upload_size():
+    return getattr(settings, 'AVATAR_MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+
+
+def sniff_image_format(header):
+    """
+    以檔頭 magic bytes 判斷圖片格式
+
+    Returns:
+        str | None: 'PNG'、'JPEG'、'GIF'、'WEBP'，無法辨識時回傳 None
+    """
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class AvatarUploadRejected(APIException):
+    """上傳在解析過程中被拒絕，回應格式與 view 的錯誤回應一致"""
+
+    status_code = status.HTTP_400_BAD_REQUEST
+
+    def __init__(self, error, message, details=None):
+        self.detail = {
+            'success': False,
+            'error': error,
+            'message': message,
+        }
+        if details is not None:
+            self.detail['details'] = details
+
+
+def file_too_large():
+    max_mb = get_max_upload_size() // (1024 * 1024)
+    return AvatarUploadRejected(
+        'FILE_TOO_LARGE',
+        f'圖片檔案過大，請上傳不超過 {max_mb}MB 的圖片'
+    )
+
+
+def invalid_image():
+    return AvatarUploadRejected(
+        'VALIDATION_ERROR',
+        '驗證錯誤',
+        {'avatar': ['不支援的圖片格式，請上傳 JPG、PNG、GIF 或 WebP 圖片']}
+    )
+
+
+class AvatarUploadHandler(FileUploadHandler):
+    """
+    放在 upload handler 鏈最前面的檢查用 handler
+
+    本身不儲存資料，只檢查後把 chunk 原封不動交給後面的
+    MemoryFileUploadHandler / TemporaryFileUploadHandler。
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size or get_max_upload_size()
+        self.received = 0
+        self.header = b''
+        self.sniffed = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size + MULTIPART_OVERHEAD:
+            raise file_too_large()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.header = b''
+        self.sniffed = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            raise file_too_large()
+
+        if not self.sniffed:
+            self.header += raw_data[:HEADER_BYTES - len(self.header)]
+            if len(self.header) >= HEADER_BYTES:
+                self._check_header()
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not self.sniffed:
+            self._check_header()
+        return None
+
+    def _check_header(self):
+        if sniff_image_format(self.header) is None:
+            raise invalid_image()
+        self.sniffed = True
+
+
+class AvatarMultiPartParser(MultiPartParser):
+    """
+    在 upload handler 鏈最前面加入 AvatarUploadHandler 的 multipart parser
+
+    以 parser 的形式掛上 handler，確保不論是 view 或 CSRF 檢查先觸發解析，
+    都會經過串流檢查。
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context['request']
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        meta = request.META.copy()
+        meta['CONTENT_TYPE'] = media_type
+        upload_handlers = [AvatarUploadHandler(request), *request.upload_handlers]
+
+        try:
+            parser = DjangoMultiPartParser(meta, stream, upload_handlers, encoding)
+            data, files = parser.parse()
+            return DataAndFiles(data, files)
+        except MultiPartParserError as exc:
+            raise ParseError('Multipart form parse error - %s' % str(exc))
@@ -6,6 +6,7 @@
 
 from django.urls import path
 from . import views
+from .direct_upload import local_direct_upload
 
 app_name = 'edit_profile'
 
@@ -13,9 +14,28 @@ urlpatterns = [
     # 個人資料（GET 和 PATCH 共用同一路徑）
     path('profile/', views.profile_view, name='profile'),
     
+    # 批次查詢個人資料（後端服務使用）
+    path('profiles/bulk/', views.bulk_profiles, name='bulk_profiles'),
+    
     # 上傳頭像
     path('avatar/upload/', views.upload_avatar, name='upload_avatar'),
     
+    # 頭像直傳：取得上傳 URL、上傳完成後確認
+    path('avatar/direct/', views.create_direct_upload, name='create_direct_upload'),
+    path('avatar/direct/confirm/', views.confirm_direct_upload, name='confirm_direct_upload'),
+    
+    # 本機直傳服務（LocalDirectUploadBackend，開發與測試用）
+    path('avatar/direct/local/<str:token>/', local_direct_upload, name='local_direct_upload'),
+    
+    # 可續傳的分段上傳：建立 session、上傳/查詢 offset、完成
+    path('avatar/sessions/', views.create_upload_session, name='create_upload_session'),
+    path('avatar/sessions/<uuid:session_id>/', views.upload_session_view, name='upload_session'),
+    path(
+        'avatar/sessions/<uuid:session_id>/finalize/',
+        views.finalize_upload_session,
+        name='finalize_upload_session'
+    ),
+    
     # 刪除頭像
     path('avatar/', views.delete_avatar, name='delete_avatar'),
 ]
@@ -0,0 +1,88 @@
+"""
+頭像圖片驗證
+
+只讀取圖片檔頭（Image.open 不會解碼像素），檢查格式與長寬：
+小檔案配上極大的長寬（decompression bomb）在解碼前就會被拒絕，
+驗證成本與圖片大小無關。
+
+實際的解碼在背景產生縮圖時進行（見 avatar_processing.py），
+JPEG 以 draft mode 直接解碼為接近目標大小的縮小版本。
+"""
+
+import warnings
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers
+
+# 允許的圖片格式（Pillow 格式名稱）
+ALLOWED_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# 長或寬的上限（像素）
+DEFAULT_MAX_IMAGE_DIMENSION = 6000
+
+# 總像素上限（長 x 寬）
+DEFAULT_MAX_IMAGE_PIXELS = 24_000_000
+
+INVALID_FORMAT_MESSAGE = '不支援的圖片格式，請上傳 JPG、PNG、GIF 或 WebP 圖片'
+
+
+def get_max_image_dimension():
+    return getattr(settings, 'AVATAR_MAX_IMAGE_DIMENSION', DEFAULT_MAX_IMAGE_DIMENSION)
+
+
+def get_max_image_pixels():
+    return getattr(settings, 'AVATAR_MAX_IMAGE_PIXELS', DEFAULT_MAX_IMAGE_PIXELS)
+
+
+def _too_large_message():
+    return f'圖片尺寸過大，長寬不可超過 {get_max_image_dimension()} 像素'
+
+
+def inspect_image(file):
+    """
+    只讀取檔頭取得圖片格式與長寬
+
+    Args:
+        file: file-like 物件（讀取後會回到開頭）
+
+    Returns:
+        tuple: (格式, 寬, 高)
+
+    Raises:
+        serializers.ValidationError: 無法辨識或不允許的格式
+    """
+    file.seek(0)
+    try:
+        with warnings.catch_warnings():
+            # 長寬的檢查由下方負責，不使用 Pillow 的 DecompressionBombWarning
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(file, formats=ALLOWED_IMAGE_FORMATS) as image:
+                image_format = image.format
+                width, height = image.size
+    except Image.DecompressionBombError:
+        # 像素數超過 Pillow 的硬上限（遠大於頭像的上限）
+        raise serializers.ValidationError(_too_large_message())
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise serializers.ValidationError(INVALID_FORMAT_MESSAGE)
+    finally:
+        file.seek(0)
+    return image_format, width, height
+
+
+def validate_avatar_image(file):
+    """
+    頭像圖片驗證（header-only）
+
+    檢查格式與長寬，並將結果記錄在 file.image_format / file.image_size
+    """
+    image_format, width, height = inspect_image(file)
+
+    max_dimension = get_max_image_dimension()
+    if width <= 0 or height <= 0 or width > max_dimension or height > max_dimension:
+        raise serializers.ValidationError(_too_large_message())
+    if width * height > get_max_image_pixels():
+        raise serializers.ValidationError('圖片像素過多，請縮小圖片後再上傳')
+
+    file.image_format = image_format
+    file.image_size = (width, height)
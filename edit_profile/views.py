@@ -5,56 +5,260 @@
 """
 
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    parser_classes,
+    permission_classes,
+)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.core.files.uploadedfile import UploadedFile
 from django.utils import timezone
+from django.db.models import Q
+from django.utils.http import parse_etags, quote_etag
+import io
 import logging
 
-from .models import UserProfile
+from rest_framework.exceptions import ValidationError
+
+from .authentication import IsServiceClient, ServiceTokenAuthentication
+from .avatar_processing import enqueue_avatar_processing
+from .cache import get_profile_payload, invalidate_profile, peek_profile_payload
+from .models import AvatarBlob, AvatarUploadSession, UserProfile
+from .direct_upload import (
+    HEAD_READ_BYTES,
+    get_direct_upload_backend,
+    get_upload_expires,
+    make_upload_id,
+    new_object_key,
+    read_upload_id,
+)
+from .resumable_upload import discard, file_digest, get_session_ttl, session_path, write_chunk
+from .upload_handlers import (
+    HEADER_BYTES,
+    IMAGE_EXTENSIONS,
+    AvatarMultiPartParser,
+    file_too_large,
+    get_max_upload_size,
+    sniff_image_format,
+)
 from .serializers import (
     UpdateProfileSerializer,
     ProfileResponseSerializer,
     AvatarUploadSerializer,
-    AvatarResponseSerializer
+    AvatarResponseSerializer,
+    BulkProfileRequestSerializer,
+    DirectUploadRequestSerializer,
+    DirectUploadConfirmSerializer,
+    AvatarUploadSessionCreateSerializer,
+    PROFILE_FIELD_SOURCES,
+    parse_profile_fields,
+    project_profile_row,
 )
+from config.routers import use_primary
 from phone_auth.models import CustomUser
+from phone_auth.timing import phase
 
 logger = logging.getLogger(__name__)
 
 
+def _get_profile(user):
+    """
+    以單一查詢讀取使用者的 UserProfile（含 user 關聯）
+
+    Profile 在建立使用者時就會一併建立（見 signals.py），
+    只有尚未執行 backfill_profiles 的舊帳號才會走到建立的分支。
+    """
+    try:
+        return UserProfile.objects.select_related('user').get(user=user)
+    except UserProfile.DoesNotExist:
+        profile, created = UserProfile.objects.get_or_create(user=user)
+        return profile
+
+
+def _parse_if_match(request):
+    """
+    解析 If-Match header 中的版本號
+
+    Returns:
+        list | None: 版本號列表；未帶 header 或為 * 時回傳 None
+    """
+    header = request.headers.get('If-Match')
+    if not header:
+        return None
+    etags = parse_etags(header)
+    if etags == ['*']:
+        return None
+    versions = []
+    for etag in etags:
+        try:
+            versions.append(int(etag.strip('"')))
+        except ValueError:
+            continue
+    return versions
+
+
+def _get_profile_fields(user, fields):
+    """
+    只讀取 ?fields= 指定的欄位（稀疏欄位）
+
+    - 快取中已有完整資料時直接從中取出，不查詢資料庫
+    - 否則以 values() 只查詢需要的欄位；未要求使用者欄位時不 JOIN 使用者資料表
+
+    version 一律讀取，用於 ETag。
+    """
+    cached = peek_profile_payload(user.pk)
+    if cached is not None:
+        return {name: cached[name] for name in fields}, cached['version']
+
+    sources = {PROFILE_FIELD_SOURCES[name] for name in fields} | {'version'}
+    row = UserProfile.objects.filter(user_id=user.pk).values(*sources).first()
+    if row is None:
+        # 尚未 backfill 的舊帳號：建立後回傳完整資料的子集
+        data = _build_profile_payload(user)
+        return {name: data[name] for name in fields}, data['version']
+    return project_profile_row(row, fields), row['version']
+
+
+def _profile_etag(version):
+    return quote_etag(str(version))
+
+
+def _build_profile_payload(user):
+    """
+    讀取 UserProfile 並序列化，供快取未命中時使用
+
+    結果會被快取 TIMEOUT 秒，一律從 primary 讀取，避免把落後的 replica 資料放進快取。
+    """
+    with use_primary():
+        profile = _get_profile(user)
+    with phase('serialize'):
+        return dict(ProfileResponseSerializer(profile).data)
+
+
+def _apply_avatar(request, user, avatar_file=None, stored_name=None):
+    """
+    將已通過驗證的圖片設為使用者頭像（各種上傳方式共用）
+    
+    先寫入檔案以取得 URL，再以單次 UPDATE 寫入所有欄位。
+    檔案以內容雜湊命名，相同內容只存一份（見 storage.py）；
+    縮圖在背景產生，完成前 avatar_url 指向原始檔。
+    
+    Args:
+        avatar_file: 要寫入 storage 的圖片
+        stored_name: 已在頭像 storage 中的檔名（直傳），直接參照而不再寫入
+    
+    Returns:
+        UserProfile: 更新後的個人資料
+    """
+    profile = _get_profile(user)
+    
+    old_files = [profile.avatar.name, *profile.avatar_rendition_files]
+    if stored_name is None:
+        profile.avatar.save(avatar_file.name, avatar_file, save=False)
+    else:
+        profile.avatar = stored_name
+    AvatarBlob.objects.acquire([profile.avatar.name])
+    profile.avatar_uploaded_at = timezone.now()
+    profile.avatar_url = request.build_absolute_uri(profile.avatar.url)
+    profile.avatar_renditions = {}
+    profile.avatar_rendition_files = []
+    profile.save_if_version()
+    invalidate_profile(user.pk)
+    
+    AvatarBlob.objects.release(old_files, profile.avatar.storage)
+    enqueue_avatar_processing(profile, request.build_absolute_uri('/'))
+    return profile
+
+
+def _validate_stored_avatar(stored, size):
+    """
+    檢查已完整存放在伺服器端的圖片（直傳、分段上傳共用）
+    
+    與 multipart 上傳相同：大小上限、檔頭格式、Pillow 驗證（只讀取檔頭）。
+    
+    Args:
+        stored: 已開啟的檔案，或檔案開頭的內容（file-like）
+        size: 檔案大小
+    
+    Returns:
+        tuple: (通過驗證的 UploadedFile, None) 或 (None, 錯誤回應)
+    """
+    if size > get_max_upload_size():
+        return None, Response(file_too_large().detail, status=status.HTTP_400_BAD_REQUEST)
+    
+    image_format = sniff_image_format(stored.read(HEADER_BYTES))
+    stored.seek(0)
+    serializer = AvatarUploadSerializer(data={
+        'avatar': UploadedFile(
+            file=stored,
+            name=f'avatar{IMAGE_EXTENSIONS.get(image_format, "")}',
+            size=size
+        )
+    })
+    if image_format is None or not serializer.is_valid():
+        return None, Response(
+            {
+                'success': False,
+                'error': 'VALIDATION_ERROR',
+                'message': '驗證錯誤',
+                'details': {'avatar': ['不支援的圖片格式，請上傳 JPG、PNG、GIF 或 WebP 圖片']}
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return serializer.validated_data['avatar'], None
+
+
 @api_view(['GET', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def profile_view(request):
     """
     獲取或更新使用者個人資料
     
-    GET: 獲取個人資料
-    PATCH: 更新個人資料
+    GET: 獲取個人資料（回應附帶 ETag，值為個人資料版本號）
+         可用 ?fields=nickname,avatar_url 只取部分欄位
+    PATCH: 更新個人資料（可帶 If-Match，版本不符時回傳 412）
     """
     user = request.user
     
     if request.method == 'GET':
         # 獲取個人資料
         try:
-            # 獲取或建立 UserProfile
-            profile, created = UserProfile.objects.get_or_create(user=user)
-            
-            response_serializer = ProfileResponseSerializer(profile)
+            fields = parse_profile_fields(request.query_params.get('fields'))
+        except ValidationError as e:
+            return Response(
+                {
+                    'success': False,
+                    'error': 'VALIDATION_ERROR',
+                    'message': '驗證錯誤',
+                    'details': e.detail
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            if fields is None:
+                # 優先從快取取得序列化後的個人資料
+                data = get_profile_payload(user.pk, lambda: _build_profile_payload(user))
+                version = data['version']
+            else:
+                data, version = _get_profile_fields(user, fields)
             
-            logger.info(f"使用者 {user.username} 獲取個人資料成功")
+            logger.info("使用者 %s 獲取個人資料成功", user.username)
             
             return Response(
                 {
                     'success': True,
                     'message': '個人資料獲取成功',
-                    'data': response_serializer.data
+                    'data': data
                 },
-                status=status.HTTP_200_OK
+                status=status.HTTP_200_OK,
+                headers={'ETag': _profile_etag(version)}
             )
         
         except Exception as e:
-            logger.error(f"獲取使用者 {user.username} 個人資料時發生錯誤：{str(e)}")
+            logger.error("獲取使用者 %s 個人資料時發生錯誤：%s", user.username, e)
             return Response(
                 {
                     'success': False,
@@ -68,8 +272,10 @@ def profile_view(request):
         # 更新個人資料
         # 驗證輸入資料
         serializer = UpdateProfileSerializer(data=request.data)
-        if not serializer.is_valid():
-            logger.warning(f"使用者 {user.username} 個人資料驗證失敗：{serializer.errors}")
+        with phase('validate'):
+            is_valid = serializer.is_valid()
+        if not is_valid:
+            logger.warning("使用者 %s 個人資料驗證失敗：%s", user.username, serializer.errors)
             return Response(
                 {
                     'success': False,
@@ -83,32 +289,46 @@ def profile_view(request):
         validated_data = serializer.validated_data
         
         try:
-            # 獲取或建立 UserProfile
-            profile, created = UserProfile.objects.get_or_create(user=user)
+            profile = _get_profile(user)
+            
+            # 樂觀並行控制：If-Match 帶回 GET 取得的 ETag（版本號）
+            expected_versions = _parse_if_match(request)
+            expected_version = None
+            if expected_versions is not None:
+                if profile.version not in expected_versions:
+                    return _precondition_failed(user)
+                expected_version = profile.version
             
             # 更新欄位
             for field, value in validated_data.items():
                 if value is not None:
                     setattr(profile, field, value)
             
-            profile.save()
+            # 單次 UPDATE ... WHERE id=? AND version=?，只寫入有變動的欄位
+            was_dirty = profile.is_dirty()
+            if not profile.save_if_version(expected_version):
+                return _precondition_failed(user)
+            if was_dirty:
+                invalidate_profile(user.pk)
             
             # 使用 Serializer 構建回應
-            response_serializer = ProfileResponseSerializer(profile)
+            with phase('serialize'):
+                data = ProfileResponseSerializer(profile).data
             
-            logger.info(f"使用者 {user.username} 個人資料更新成功")
+            logger.info("使用者 %s 個人資料更新成功", user.username)
             
             return Response(
                 {
                     'success': True,
                     'message': '個人資料更新成功',
-                    'data': response_serializer.data
+                    'data': data
                 },
-                status=status.HTTP_200_OK
+                status=status.HTTP_200_OK,
+                headers={'ETag': _profile_etag(profile.version)}
             )
         
         except Exception as e:
-            logger.error(f"更新使用者 {user.username} 個人資料時發生錯誤：{str(e)}")
+            logger.error("更新使用者 %s 個人資料時發生錯誤：%s", user.username, e)
             return Response(
                 {
                     'success': False,
@@ -119,19 +339,37 @@ def profile_view(request):
             )
 
 
+def _precondition_failed(user):
+    logger.warning("使用者 %s 個人資料版本不符（If-Match）", user.username)
+    return Response(
+        {
+            'success': False,
+            'error': 'PRECONDITION_FAILED',
+            'message': '個人資料已在其他裝置更新，請重新取得後再試'
+        },
+        status=status.HTTP_412_PRECONDITION_FAILED
+    )
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@parser_classes([AvatarMultiPartParser])
 def upload_avatar(request):
     """
     上傳使用者頭像
     
     API Endpoint: POST /api/user/avatar/upload/
+    
+    上傳內容在解析時即以串流方式檢查（見 upload_handlers.py）：
+    過大的請求或非圖片檔案會在完整讀取前被拒絕。
     """
     
     # 驗證輸入資料
     serializer = AvatarUploadSerializer(data=request.data)
-    if not serializer.is_valid():
-        logger.warning(f"使用者 {request.user.username} 頭像驗證失敗：{serializer.errors}")
+    with phase('validate'):
+        is_valid = serializer.is_valid()
+    if not is_valid:
+        logger.warning("使用者 %s 頭像驗證失敗：%s", request.user.username, serializer.errors)
         return Response(
             {
                 'success': False,
@@ -146,46 +384,424 @@ def upload_avatar(request):
         user = request.user
         avatar_file = serializer.validated_data['avatar']
         
-        # 檢查圖片尺寸（限制為 5MB）
-        if avatar_file.size > 5 * 1024 * 1024:
-            logger.warning(f"使用者 {user.username} 上傳圖片過大：{avatar_file.size} bytes")
+        # 檢查圖片大小（settings.AVATAR_MAX_UPLOAD_SIZE，解析時已先行檢查）
+        if avatar_file.size > get_max_upload_size():
+            logger.warning("使用者 %s 上傳圖片過大：%s bytes", user.username, avatar_file.size)
+            return Response(file_too_large().detail, status=status.HTTP_400_BAD_REQUEST)
+        
+        profile = _apply_avatar(request, user, avatar_file)
+        
+        with phase('serialize'):
+            data = AvatarResponseSerializer(profile).data
+        
+        logger.info("使用者 %s 頭像上傳成功", user.username)
+        
+        return Response(
+            {
+                'success': True,
+                'message': '頭像上傳成功',
+                'data': data
+            },
+            status=status.HTTP_200_OK
+        )
+    
+    except Exception as e:
+        logger.error("使用者 %s 上傳頭像時發生錯誤：%s", request.user.username, e)
+        return Response(
+            {
+                'success': False,
+                'error': 'UPLOAD_FAILED',
+                'message': '上傳頭像失敗'
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_direct_upload(request):
+    """
+    取得頭像直傳的簽章上傳 URL
+    
+    API Endpoint: POST /api/user/avatar/direct/
+    
+    客戶端以回傳的 method / url / headers 直接將圖片上傳到儲存服務，
+    完成後呼叫 POST /api/user/avatar/direct/confirm/ 帶回 upload_id。
+    
+    Request Body:
+    {
+        "content_type": "image/jpeg",
+        "size": 123456
+    }
+    """
+    
+    serializer = DirectUploadRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(
+            {
+                'success': False,
+                'error': 'VALIDATION_ERROR',
+                'message': '驗證錯誤',
+                'details': serializer.errors
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    key = new_object_key(request.user)
+    upload = get_direct_upload_backend().create_upload(
+        request,
+        key,
+        serializer.validated_data['content_type'],
+        serializer.validated_data['size']
+    )
+    
+    return Response(
+        {
+            'success': True,
+            'data': {
+                'upload_id': make_upload_id(request.user, key),
+                'upload_url': upload['url'],
+                'method': upload['method'],
+                'headers': upload['headers'],
+                'expires_in': get_upload_expires(),
+            }
+        },
+        status=status.HTTP_200_OK
+    )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def confirm_direct_upload(request):
+    """
+    確認頭像直傳
+    
+    API Endpoint: POST /api/user/avatar/direct/confirm/
+    
+    只讀取已上傳物件的大小與開頭（HEAD_READ_BYTES）檢查格式與長寬，
+    通過後將物件移到頭像 storage 的內容定址檔名並直接參照，不經過 worker 複製內容。
+    
+    Request Body:
+    {
+        "upload_id": "..."
+    }
+    """
+    
+    serializer = DirectUploadConfirmSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(
+            {
+                'success': False,
+                'error': 'VALIDATION_ERROR',
+                'message': '驗證錯誤',
+                'details': serializer.errors
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    user = request.user
+    key = read_upload_id(user, serializer.validated_data['upload_id'])
+    backend = get_direct_upload_backend()
+    if key is None or not backend.exists(key):
+        return Response(
+            {
+                'success': False,
+                'error': 'UPLOAD_NOT_FOUND',
+                'message': '找不到上傳的圖片，請重新上傳'
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        size = backend.size(key)
+        head = io.BytesIO(backend.read(key, HEAD_READ_BYTES)) if size <= get_max_upload_size() else None
+        avatar_file, error_response = _validate_stored_avatar(head, size)
+        if error_response is not None:
+            backend.delete(key)
+            logger.warning("使用者 %s 直傳頭像驗證失敗", user.username)
+            return error_response
+        
+        # 以儲存服務在上傳時計算的 SHA-256 組成內容定址檔名，副檔名依檔頭判斷的格式決定
+        storage = UserProfile._meta.get_field('avatar').storage
+        name = storage.hashed_name(f'avatars/{avatar_file.name}', backend.digest(key))
+        stored_name = backend.move(key, storage, name)
+        profile = _apply_avatar(request, user, stored_name=stored_name)
+        
+        logger.info("使用者 %s 頭像直傳成功", user.username)
+        
+        return Response(
+            {
+                'success': True,
+                'message': '頭像上傳成功',
+                'data': AvatarResponseSerializer(profile).data
+            },
+            status=status.HTTP_200_OK
+        )
+    
+    except Exception as e:
+        logger.error("使用者 %s 確認直傳頭像時發生錯誤：%s", user.username, e)
+        return Response(
+            {
+                'success': False,
+                'error': 'UPLOAD_FAILED',
+                'message': '上傳頭像失敗'
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def _upload_session_data(session):
+    return {
+        'session_id': str(session.pk),
+        'size': session.size,
+        'offset': session.offset,
+        'expires_at': session.expires_at,
+    }
+
+
+def _upload_session_response(session, status_code=status.HTTP_200_OK):
+    response = Response(
+        {
+            'success': True,
+            'data': _upload_session_data(session)
+        },
+        status=status_code
+    )
+    response['Upload-Offset'] = str(session.offset)
+    return response
+
+
+def _get_upload_session(user, session_id):
+    """
+    讀取使用者的上傳 session
+    
+    Returns:
+        tuple: (AvatarUploadSession, None) 或 (None, 錯誤回應)
+    """
+    session = AvatarUploadSession.objects.filter(pk=session_id, user=user).first()
+    if session is None:
+        return None, Response(
+            {
+                'success': False,
+                'error': 'SESSION_NOT_FOUND',
+                'message': '找不到上傳 session'
+            },
+            status=status.HTTP_404_NOT_FOUND
+        )
+    if session.expires_at <= timezone.now():
+        discard(session.pk)
+        session.delete()
+        return None, Response(
+            {
+                'success': False,
+                'error': 'SESSION_EXPIRED',
+                'message': '上傳 session 已過期，請重新上傳'
+            },
+            status=status.HTTP_410_GONE
+        )
+    return session, None
+
+
+def _offset_mismatch(session):
+    response = Response(
+        {
+            'success': False,
+            'error': 'OFFSET_MISMATCH',
+            'message': '上傳位置與伺服器不一致，請從伺服器回傳的 offset 繼續',
+            'data': _upload_session_data(session)
+        },
+        status=status.HTTP_409_CONFLICT
+    )
+    response['Upload-Offset'] = str(session.offset)
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload_session(request):
+    """
+    建立可續傳的分段頭像上傳 session
+    
+    API Endpoint: POST /api/user/avatar/sessions/
+    
+    Request Body:
+    {
+        "size": 123456,
+        "sha256": "<檔案的 SHA-256 hex>"
+    }
+    """
+    
+    serializer = AvatarUploadSessionCreateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(
+            {
+                'success': False,
+                'error': 'VALIDATION_ERROR',
+                'message': '驗證錯誤',
+                'details': serializer.errors
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    session = AvatarUploadSession.objects.create(
+        user=request.user,
+        size=serializer.validated_data['size'],
+        sha256=serializer.validated_data['sha256'],
+        expires_at=timezone.now() + get_session_ttl()
+    )
+    return _upload_session_response(session, status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_session_view(request, session_id):
+    """
+    查詢、上傳或取消分段上傳 session
+    
+    API Endpoint: /api/user/avatar/sessions/<session_id>/
+    
+    GET: 查詢伺服器已收到的 offset（中斷後由此繼續）
+    PUT: 以 Upload-Offset header 指定位置，body 為該段的原始內容
+         （Content-Type: application/offset+octet-stream）
+    DELETE: 取消上傳
+    """
+    session, error_response = _get_upload_session(request.user, session_id)
+    if error_response is not None:
+        return error_response
+    
+    if request.method == 'GET':
+        return _upload_session_response(session)
+    
+    if request.method == 'DELETE':
+        discard(session.pk)
+        session.delete()
+        return Response(
+            {
+                'success': True,
+                'message': '已取消上傳'
+            },
+            status=status.HTTP_200_OK
+        )
+    
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except (KeyError, ValueError):
+        offset, length = -1, 0
+    if offset < 0 or length <= 0:
+        return Response(
+            {
+                'success': False,
+                'error': 'VALIDATION_ERROR',
+                'message': '需要 Upload-Offset header 與上傳內容'
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if offset != session.offset:
+        return _offset_mismatch(session)
+    if offset + length > session.size:
+        return Response(
+            {
+                'success': False,
+                'error': 'VALIDATION_ERROR',
+                'message': '上傳內容超過宣告的檔案大小'
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    written = write_chunk(session.pk, offset, request.stream, length)
+    
+    # 第一段就檢查檔頭，不是圖片時不必等到全部上傳完
+    if offset == 0 and written >= min(HEADER_BYTES, session.size):
+        with open(session_path(session.pk), 'rb') as part:
+            header = part.read(HEADER_BYTES)
+        if sniff_image_format(header) is None:
+            discard(session.pk)
+            session.delete()
             return Response(
                 {
                     'success': False,
-                    'error': 'FILE_TOO_LARGE',
-                    'message': '圖片檔案過大，請上傳不超過 5MB 的圖片'
+                    'error': 'VALIDATION_ERROR',
+                    'message': '驗證錯誤',
+                    'details': {'avatar': ['不支援的圖片格式，請上傳 JPG、PNG、GIF 或 WebP 圖片']}
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    # 以條件式 UPDATE 推進 offset，同一段被重複上傳時只有一個請求成功
+    if not AvatarUploadSession.objects.filter(pk=session.pk, offset=offset).update(offset=offset + written):
+        session.refresh_from_db()
+        return _offset_mismatch(session)
+    
+    session.offset = offset + written
+    return _upload_session_response(session)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload_session(request, session_id):
+    """
+    完成分段上傳並更新頭像
+    
+    API Endpoint: POST /api/user/avatar/sessions/<session_id>/finalize/
+    
+    比對 SHA-256 後，以與一般上傳相同的檢查與流程更新頭像。
+    """
+    user = request.user
+    session, error_response = _get_upload_session(user, session_id)
+    if error_response is not None:
+        return error_response
+    
+    if session.offset != session.size:
+        return Response(
+            {
+                'success': False,
+                'error': 'UPLOAD_INCOMPLETE',
+                'message': '檔案尚未上傳完成',
+                'data': _upload_session_data(session)
+            },
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    try:
+        if file_digest(session.pk) != session.sha256:
+            discard(session.pk)
+            session.delete()
+            return Response(
+                {
+                    'success': False,
+                    'error': 'CHECKSUM_MISMATCH',
+                    'message': '檔案內容與宣告的 SHA-256 不符，請重新上傳'
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # 獲取或建立 UserProfile
-        profile, created = UserProfile.objects.get_or_create(user=user)
-        
-        # 更新頭像
-        profile.avatar = avatar_file
-        profile.avatar_uploaded_at = timezone.now()
-        profile.save()
-        
-        # 構建頭像 URL
-        avatar_url = request.build_absolute_uri(profile.avatar.url) if profile.avatar else None
-        profile.avatar_url = avatar_url  # 更新 DB 中的 avatar_url
-        profile.save(update_fields=['avatar_url'])
+        with open(session_path(session.pk), 'rb') as stored:
+            avatar_file, error_response = _validate_stored_avatar(stored, session.size)
+            if error_response is not None:
+                discard(session.pk)
+                session.delete()
+                logger.warning("使用者 %s 分段上傳頭像驗證失敗", user.username)
+                return error_response
+            
+            profile = _apply_avatar(request, user, avatar_file)
         
-        response_serializer = AvatarResponseSerializer(profile)
+        discard(session.pk)
+        session.delete()
         
-        logger.info(f"使用者 {user.username} 頭像上傳成功")
+        logger.info("使用者 %s 分段上傳頭像成功", user.username)
         
         return Response(
             {
                 'success': True,
                 'message': '頭像上傳成功',
-                'data': response_serializer.data
+                'data': AvatarResponseSerializer(profile).data
             },
             status=status.HTTP_200_OK
         )
     
     except Exception as e:
-        logger.error(f"使用者 {request.user.username} 上傳頭像時發生錯誤：{str(e)}")
+        logger.error("使用者 %s 完成分段上傳時發生錯誤：%s", user.username, e)
         return Response(
             {
                 'success': False,
@@ -209,7 +825,8 @@ def delete_avatar(request):
         user = request.user
         
         try:
-            profile = user.profile
+            # 直接查詢，避免使用 user 物件上可能已過期的 profile 快取
+            profile = UserProfile.objects.get(user=user)
         except UserProfile.DoesNotExist:
             return Response(
                 {
@@ -219,15 +836,23 @@ def delete_avatar(request):
                 status=status.HTTP_200_OK
             )
         
-        # 刪除頭像檔案
+        # 釋放頭像與縮圖檔案，沒有其他 Profile 使用的檔案會被刪除
+        # （欄位與其他頭像欄位在下方一併寫入）
+        AvatarBlob.objects.release(
+            [profile.avatar.name, *profile.avatar_rendition_files],
+            profile.avatar.storage
+        )
         if profile.avatar:
-            profile.avatar.delete()
+            profile.avatar = None
         
         profile.avatar_uploaded_at = None
         profile.avatar_url = None
-        profile.save()
+        profile.avatar_renditions = {}
+        profile.avatar_rendition_files = []
+        profile.save_if_version()
+        invalidate_profile(user.pk)
         
-        logger.info(f"使用者 {user.username} 頭像刪除成功")
+        logger.info("使用者 %s 頭像刪除成功", user.username)
         
         return Response(
             {
@@ -238,7 +863,7 @@ def delete_avatar(request):
         )
     
     except Exception as e:
-        logger.error(f"使用者 {request.user.username} 刪除頭像時發生錯誤：{str(e)}")
+        logger.error("使用者 %s 刪除頭像時發生錯誤：%s", request.user.username, e)
         return Response(
             {
                 'success': False,
@@ -248,3 +873,88 @@ def delete_avatar(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+
+@api_view(['POST'])
+@authentication_classes([ServiceTokenAuthentication])
+@permission_classes([IsServiceClient])
+def bulk_profiles(request):
+    """
+    批次查詢個人資料（後端服務使用）
+    
+    API Endpoint: POST /api/user/profiles/bulk/
+    
+    需以 `Authorization: Service <token>` 認證。
+    以單一查詢取得所有指定的個人資料，回傳順序與請求中的 ID 順序相同
+    （先 user_ids、再 profile_ids，重複的 Profile 只回傳一次）。
+    
+    Request Body:
+    {
+        "user_ids": [12, 7],
+        "profile_ids": ["4f1c..."],
+        "fields": ["nickname", "avatar_url"]
+    }
+    
+    Response (Success):
+    {
+        "success": true,
+        "data": [{"user_id": 12, "nickname": "...", "avatar_url": "..."}, ...],
+        "missing": {"user_ids": [7], "profile_ids": []}
+    }
+    """
+    
+    serializer = BulkProfileRequestSerializer(data=request.data)
+    with phase('validate'):
+        is_valid = serializer.is_valid()
+    if not is_valid:
+        return Response(
+            {
+                'success': False,
+                'error': 'VALIDATION_ERROR',
+                'message': '驗證錯誤',
+                'details': serializer.errors
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    validated_data = serializer.validated_data
+    user_ids = list(dict.fromkeys(validated_data['user_ids']))
+    profile_ids = list(dict.fromkeys(validated_data['profile_ids']))
+    fields = validated_data['fields']
+    
+    # 單一查詢：values() 只取需要的欄位，直接組成回應（不經過 Serializer）
+    sources = {PROFILE_FIELD_SOURCES[name] for name in fields} | {'id', 'user_id'}
+    rows = UserProfile.objects.filter(
+        Q(user_id__in=user_ids) | Q(id__in=profile_ids)
+    ).values(*sources)
+    
+    by_user_id = {}
+    by_profile_id = {}
+    for row in rows:
+        by_user_id[row['user_id']] = row
+        by_profile_id[row['id']] = row
+    
+    data = []
+    seen = set()
+    missing = {'user_ids': [], 'profile_ids': []}
+    for key, ids, index in (
+        ('user_ids', user_ids, by_user_id),
+        ('profile_ids', profile_ids, by_profile_id),
+    ):
+        for lookup_id in ids:
+            row = index.get(lookup_id)
+            if row is None:
+                missing[key].append(str(lookup_id) if key == 'profile_ids' else lookup_id)
+            elif row['id'] not in seen:
+                seen.add(row['id'])
+                data.append({'user_id': row['user_id'], **project_profile_row(row, fields)})
+    
+    logger.info("服務 %s 批次查詢個人資料：%s 筆", request.auth, len(data))
+    
+    return Response(
+        {
+            'success': True,
+            'data': data,
+            'missing': missing
+        },
+        status=status.HTTP_200_OK
+    )
@@ -1,12 +1,12 @@
 """
 Django Admin 管理介面設定
 
-提供後台管理使用者與 OTP 驗證記錄的功能。
+提供後台管理使用者、OTP 驗證記錄與慢查詢記錄的功能。
 """
 
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, OTPVerificationLog
+from .models import CustomUser, OTPVerificationLog, SlowQuery
 
 
 @admin.register(CustomUser)
@@ -60,20 +60,25 @@ class CustomUserAdmin(UserAdmin):
 
 @admin.register(OTPVerificationLog)
 class OTPVerificationLogAdmin(admin.ModelAdmin):
-    """OTP 驗證記錄管理介面"""
+    """
+    OTP 驗證記錄管理介面
+    
+    記錄與使用者位於不同的資料庫，不能 JOIN：
+    使用者以 prefetch 另外查詢，依帳號搜尋時先查出 user_id。
+    """
     
     # 列表頁顯示的欄位
     list_display = [
         'id',
-        'user',
+        'user_display',
         'phone_number',
         'action',
         'success',
         'created_at',
     ]
     
-    # 可搜尋的欄位
-    search_fields = ['user__username', 'phone_number']
+    # 可搜尋的欄位（帳號的搜尋見 get_search_results）
+    search_fields = ['phone_number']
     
     # 篩選器
     list_filter = ['action', 'success', 'created_at']
@@ -104,4 +109,48 @@ class OTPVerificationLogAdmin(admin.ModelAdmin):
     
     # 預設排序
     ordering = ['-created_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('user')
+    
+    @admin.display(description='使用者', ordering='user_id')
+    def user_display(self, obj):
+        # 直接讀取 prefetch 的結果：找不到使用者（已刪除）時為 None，只顯示 user_id
+        # （經由 obj.user 存取時，非 null 的外鍵會改為拋出 DoesNotExist）
+        user = OTPVerificationLog.user.field.get_cached_value(obj, default=None)
+        if user is None:
+            return f'#{obj.user_id}'
+        return user
+    
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            user_ids = list(
+                CustomUser.objects.filter(username__icontains=search_term).values_list('pk', flat=True)
+            )
+            if user_ids:
+                results |= queryset.filter(user_id__in=user_ids)
+        return results, may_have_duplicates
 
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    """慢查詢記錄管理介面（依 SQL 彙總請使用 python manage.py slow_queries）"""
+    
+    list_display = ['id', 'view_name', 'database', 'duration_ms', 'created_at']
+    
+    search_fields = ['view_name', 'sql']
+    
+    list_filter = ['view_name', 'database', 'created_at']
+    
+    fields = ['view_name', 'database', 'duration_ms', 'sql', 'params', 'plan', 'created_at']
+    
+    # 唯讀欄位（所有欄位都是唯讀，只供查看）
+    readonly_fields = fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    list_per_page = 100
+    
+    ordering = ['-created_at']
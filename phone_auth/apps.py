@@ -12,3 +12,10 @@ class PhoneAuthConfig(AppConfig):
     name = 'phone_auth'
     verbose_name = '手機驗證'
 
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .sqlite import apply_sqlite_pragmas
+
+        # SQLite 連線調校（settings.SQLITE_PRAGMAS）
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='phone_auth.sqlite_pragmas')
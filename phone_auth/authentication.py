@@ -0,0 +1,57 @@
+"""
+API 的認證類別，以及 DRF 以外的 view 與 middleware 使用的認證
+
+SessionAuthentication、BasicAuthentication 與 DRF 的同名類別相同，
+另將認證時間計入 Server-Timing 的 auth 階段（見 timing.py）。
+DRF 在 view 執行前即完成認證，Basic 認證的密碼雜湊因此不會被 views 中的其他階段涵蓋。
+
+get_api_user 與 API 相同，依 REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES']（session、Basic）辨識使用者，
+讓只以 Basic 認證的 staff 也能使用效能分析（profiling.py）。
+"""
+
+from rest_framework import authentication
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+class PhaseTimedAuthenticationMixin:
+    """將 authenticate() 的時間計入 auth 階段"""
+
+    def authenticate(self, request):
+        # 延後匯入：本模組由 DEFAULT_AUTHENTICATION_CLASSES 載入時 rest_framework.views 尚未載入完成，
+        # timing.py（經由 metrics.py）會匯入 rest_framework.decorators
+        from .timing import phase
+
+        with phase('auth'):
+            return super().authenticate(request)
+
+
+class SessionAuthentication(PhaseTimedAuthenticationMixin, authentication.SessionAuthentication):
+    """DRF 的 SessionAuthentication，計入 auth 階段"""
+
+
+class BasicAuthentication(PhaseTimedAuthenticationMixin, authentication.BasicAuthentication):
+    """DRF 的 BasicAuthentication，計入 auth 階段（包含密碼雜湊的計算）"""
+
+
+def get_api_user(request):
+    """
+    取得 request 的使用者
+
+    已由 AuthenticationMiddleware 以 session 認證時直接回傳，否則依序嘗試 DRF 的認證類別。
+
+    Returns:
+        User | AnonymousUser | None: 帳號密碼錯誤等認證失敗時回傳 None
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    drf_request = Request(
+        request,
+        authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    try:
+        return drf_request.user
+    except APIException:
+        return None
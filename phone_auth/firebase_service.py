@@ -15,6 +15,9 @@ from firebase_admin import credentials, auth
 from django.conf import settings
 import logging
 
+from .metrics import FIREBASE_DURATION
+from .timing import phase
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,9 +61,9 @@ class FirebaseAuthService:
                 cred_path = settings.FIREBASE_CREDENTIALS_PATH
                 cred = credentials.Certificate(cred_path)
                 firebase_admin.initialize_app(cred)
-                logger.info(f"Firebase App 初始化成功，使用憑證：{cred_path}")
+                logger.info("Firebase App 初始化成功，使用憑證：%s", cred_path)
             except Exception as e:
-                logger.error(f"Firebase 初始化失敗：{str(e)}")
+                logger.error("Firebase 初始化失敗：%s", e)
                 raise
     
     def send_otp(self, phone_number: str) -> dict:
@@ -95,7 +98,7 @@ class FirebaseAuthService:
             
             # 注意：實際的 OTP 發送在前端完成
             # 這裡返回成功狀態，實際 verification_id 由前端提供
-            logger.info(f"準備發送 OTP 到：{phone_number}")
+            logger.info("準備發送 OTP 到：%s", phone_number)
             
             # 模擬返回（實際上由前端 Firebase SDK 處理）
             return {
@@ -104,12 +107,13 @@ class FirebaseAuthService:
             }
             
         except Exception as e:
-            logger.error(f"發送 OTP 時發生錯誤：{str(e)}")
+            logger.error("發送 OTP 時發生錯誤：%s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
     
+    @FIREBASE_DURATION.time(call='verify_otp')
     def verify_otp(self, verification_id: str, otp_code: str) -> dict:
         """
         驗證 OTP 代碼（使用 Firebase ID Token）
@@ -133,10 +137,11 @@ class FirebaseAuthService:
             }
         """
         try:
-            logger.info(f"開始驗證 Firebase ID Token，OTP code: {otp_code}")
+            logger.info("開始驗證 Firebase ID Token，OTP code: %s", otp_code)
             
             # 使用 Firebase Admin SDK 驗證 ID Token
-            decoded_token = auth.verify_id_token(verification_id)
+            with phase('firebase'):
+                decoded_token = auth.verify_id_token(verification_id)
             
             # 從 token 中取得已驗證的資訊
             uid = decoded_token.get('uid')
@@ -149,7 +154,7 @@ class FirebaseAuthService:
                     'error': 'ID Token 中沒有手機號碼資訊，請確認前端使用 Phone Auth 方式登入'
                 }
             
-            logger.info(f"驗證成功：uid={uid}, phone={phone_number}")
+            logger.info("驗證成功：uid=%s, phone=%s", uid, phone_number)
             
             return {
                 'success': True,
@@ -171,12 +176,13 @@ class FirebaseAuthService:
                 'error': '驗證碼已過期，請重新發送'
             }
         except Exception as e:
-            logger.error(f"驗證 OTP 時發生錯誤：{str(e)}")
+            logger.error("驗證 OTP 時發生錯誤：%s", e)
             return {
                 'success': False,
                 'error': f'驗證失敗：{str(e)}'
             }
     
+    @FIREBASE_DURATION.time(call='get_user_by_phone')
     def get_user_by_phone(self, phone_number: str):
         """
         根據手機號碼查詢 Firebase 使用者
@@ -188,13 +194,14 @@ class FirebaseAuthService:
             UserRecord 或 None
         """
         try:
-            user = auth.get_user_by_phone_number(phone_number)
+            with phase('firebase'):
+                user = auth.get_user_by_phone_number(phone_number)
             return user
         except auth.UserNotFoundError:
-            logger.info(f"找不到手機號碼對應的 Firebase 使用者：{phone_number}")
+            logger.info("找不到手機號碼對應的 Firebase 使用者：%s", phone_number)
             return None
         except Exception as e:
-            logger.error(f"查詢 Firebase 使用者時發生錯誤：{str(e)}")
+            logger.error("查詢 Firebase 使用者時發生錯誤：%s", e)
             return None
 
 
@@ -0,0 +1,231 @@
+"""
+非同步的日誌處理
+
+settings.LOGGING 中的 logger 只連到 QueuedHandler：request 的執行緒只把 LogRecord 放進佇列，
+由每個 worker 行程各自的 QueueListener 執行緒寫入 console 與檔案。
+
+- QueuedHandler：在行程第一次記錄時啟動 listener（gunicorn fork 出的 worker 各自啟動），
+  佇列已滿時捨棄記錄而不阻塞 request；行程結束時由 logging.shutdown() 寫完佇列中的記錄
+- configure_logging：settings.LOGGING_CONFIG，在 Python 3.11 補上 3.12 起 dictConfig 對 QueueHandler 的處理
+- RateLimitFilter：相同的 WARNING 訊息（例如「請求過於頻繁」）每段時間只保留前幾筆，
+  以 % 格式化前的訊息範本區分，下一筆保留的記錄附上略過的筆數（suppressed）
+- JSONFormatter：每筆記錄輸出一行 JSON，包含 access log 的 view、status、phases、queries
+
+logger 呼叫需使用 % 格式：logger.warning('使用者 %s 請求過於頻繁', user.username)，
+被過濾的記錄不會格式化，RateLimitFilter 也才能以訊息範本分組。
+"""
+
+import copy
+import json
+import logging
+import logging.config
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+
+# JSONFormatter 輸出的 extra 欄位
+EXTRA_FIELDS = ('view', 'status', 'phases', 'queries', 'suppressed')
+
+# 未指定 queue 時佇列的上限
+DEFAULT_MAX_PENDING = 10000
+
+
+class Listener(QueueListener):
+    """結束時佇列已滿，等待空間放入結束標記，而不是捨棄"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class QueuedHandler(QueueHandler):
+    """
+    將記錄交給背景的 QueueListener 寫入
+
+    settings.LOGGING 中的設定（與標準庫 QueueHandler 相同）：
+        'queue': {
+            'class': 'phone_auth.log_handlers.QueuedHandler',
+            'handlers': ['console', 'file'],
+            'respect_handler_level': True,
+            'queue': {'()': 'queue.Queue', 'maxsize': 10000},
+        }
+
+    dictConfig 將 handlers 解析為已設定的 handler 並建立 listener（Python 3.12 起內建，
+    3.11 由 configure_logging 處理），與 handler 名稱的排序無關。
+    實際執行的 listener 由 start() 在每個行程中以相同的 handlers 重新建立。
+    """
+
+    def __init__(self, queue=None, handlers=(), respect_handler_level=True):
+        if any(isinstance(handler, str) for handler in handlers):
+            raise TypeError('handlers 需為 handler 物件，Python 3.11 請以 configure_logging 套用設定')
+        super().__init__(queue if queue is not None else Queue(maxsize=DEFAULT_MAX_PENDING))
+        self.handlers = list(handlers)
+        self.respect_handler_level = respect_handler_level
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def listener(self):
+        return self._listener
+
+    @listener.setter
+    def listener(self, listener):
+        # dictConfig（3.12 起）建立的 QueueListener：取用其 handlers 設定，不直接啟動
+        if listener is not None:
+            self.handlers = list(listener.handlers)
+            self.respect_handler_level = listener.respect_handler_level
+
+    def start(self):
+        """啟動此行程的 listener（fork 後的行程沒有 listener 執行緒，重新建立佇列與 listener）"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = Queue(maxsize=self.queue.maxsize)
+            self._listener = Listener(
+                self.queue, *self.handlers, respect_handler_level=self.respect_handler_level
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # 參數可能是 model 等物件，在呼叫的執行緒中完成格式化，listener 只處理字串
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def flush(self):
+        """等待佇列中的記錄寫入完畢"""
+        if self._listener is not None and self._pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
+        self._pid = None
+        super().close()
+
+
+class DictConfigurator(logging.config.DictConfigurator):
+    """
+    Python 3.11 的 dictConfig 補上 3.12 起對 QueueHandler 設定的處理
+
+    handlers 以名稱解析為已設定的 handler（尚未設定時由 dictConfig 延後再試），queue 可用 '()' 指定。
+    """
+
+    def configure_handler(self, config):
+        klass = config.get('class')
+        if klass is None or '()' in config:
+            return super().configure_handler(config)
+        if not callable(klass):
+            klass = self.resolve(klass)
+        if not issubclass(klass, QueueHandler):
+            return super().configure_handler(config)
+
+        handlers = []
+        for name in config.get('handlers', ()):
+            handler = self.config['handlers'][name]
+            if not isinstance(handler, logging.Handler):
+                # 訊息與標準庫相同，dictConfig 在其他 handler 設定完成後再試一次
+                raise ValueError(f'Unable to set required handler {name!r}') from TypeError(
+                    'target not configured yet'
+                )
+            handlers.append(handler)
+        config['handlers'] = handlers
+        if isinstance(config.get('queue'), dict):
+            config['queue'] = self.configure_custom(dict(config['queue']))
+        return super().configure_handler(config)
+
+
+def configure_logging(config):
+    """
+    settings.LOGGING_CONFIG：以 dictConfig 設定 logging
+
+    Python 3.12 起直接使用 logging.config.dictConfig，3.11 使用上方的 DictConfigurator。
+    """
+    if sys.version_info >= (3, 12):
+        logging.config.dictConfig(config)
+    else:
+        DictConfigurator(config).configure()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    相同訊息範本的記錄每 per 秒只保留前 rate 筆
+
+    只處理 level（預設 WARNING）的記錄；ERROR 以上與 INFO（access log）都不受影響。
+    """
+
+    # 訊息範本的上限（以 f-string 產生的訊息每筆都不同，超過時清除）
+    MAX_KEYS = 1000
+
+    def __init__(self, rate=10, per=60, level='WARNING'):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.levelno = level if isinstance(level, int) else logging.getLevelName(level)
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno != self.levelno:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._windows and len(self._windows) >= self.MAX_KEYS:
+                self._windows.clear()
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.per:
+                started, count = now, 0
+            if count >= self.rate:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+            self._windows[key] = (started, count + 1, 0)
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """每筆記錄輸出一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
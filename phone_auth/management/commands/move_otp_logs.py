@@ -0,0 +1,79 @@
+"""
+將主資料庫中既有的 OTP 驗證記錄搬到 otp_logs 資料庫
+
+設定 otp_logs 之後，OTPLogRouter 只讀寫 otp_logs，
+更新前寫入主資料庫 phone_auth_otpverificationlog 資料表的記錄不會再出現在 Admin 與查詢中。
+本指令依主鍵分批複製（保留原本的 id，已存在的記錄略過，可重複執行），
+指定 --delete 時複製完成的批次會從主資料庫刪除。
+
+使用方式：
+    python manage.py migrate --database otp_logs   # 先建立 otp_logs 的資料表
+    python manage.py move_otp_logs
+    python manage.py move_otp_logs --batch-size 5000 --delete
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+
+from phone_auth.models import OTPVerificationLog
+
+
+class Command(BaseCommand):
+    help = '將主資料庫中既有的 OTP 驗證記錄搬到 otp_logs 資料庫'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批複製的筆數（預設 1000）'
+        )
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            help='複製完成後從主資料庫刪除'
+        )
+
+    def handle(self, *args, **options):
+        source = DEFAULT_DB_ALIAS
+        target = router.db_for_write(OTPVerificationLog)
+        if target == source:
+            raise CommandError('OTPVerificationLog 未設定獨立的資料庫（otp_logs），不需要搬移')
+
+        table = OTPVerificationLog._meta.db_table
+        with connections[source].cursor() as cursor:
+            if table not in connections[source].introspection.table_names(cursor):
+                self.stdout.write(self.style.SUCCESS('主資料庫沒有 OTP 驗證記錄資料表，不需要搬移'))
+                return
+
+        batch_size = options['batch_size']
+        copied = 0
+        last_pk = 0
+        while True:
+            # 以主鍵分頁（keyset pagination），避免一次載入所有記錄
+            logs = list(
+                OTPVerificationLog.objects.using(source)
+                .filter(pk__gt=last_pk)
+                .order_by('pk')[:batch_size]
+            )
+            if not logs:
+                break
+            # ignore_conflicts：中斷後重新執行時略過已複製的記錄
+            OTPVerificationLog.objects.using(target).bulk_create(logs, ignore_conflicts=True)
+            if options['delete']:
+                OTPVerificationLog.objects.using(source).filter(
+                    pk__gt=last_pk, pk__lte=logs[-1].pk
+                ).delete()
+            copied += len(logs)
+            last_pk = logs[-1].pk
+
+        # 保留原本的 id 寫入後，重設 otp_logs 的主鍵序列（PostgreSQL 等），之後新增的記錄才不會衝突
+        statements = connections[target].ops.sequence_reset_sql(no_style(), [OTPVerificationLog])
+        if statements:
+            with transaction.atomic(using=target), connections[target].cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+        action = '搬移' if options['delete'] else '複製'
+        self.stdout.write(self.style.SUCCESS(f'已{action} {copied} 筆 OTP 驗證記錄到 {target}'))
@@ -0,0 +1,70 @@
+"""
+列出總執行時間最多的慢查詢
+
+依 SQL 與 view 分組，依總時間排序。
+
+使用方式：
+    python manage.py slow_queries                  # 最近 7 天的前 10 名
+    python manage.py slow_queries --days 1 --limit 20
+    python manage.py slow_queries --explain        # 同時顯示最近一次的執行計畫
+    python manage.py slow_queries --purge 30       # 刪除 30 天前的記錄
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max, Sum
+from django.utils import timezone
+
+from phone_auth.models import SlowQuery
+from phone_auth.slow_queries import get_setting
+
+
+class Command(BaseCommand):
+    help = '列出總執行時間最多的慢查詢'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='統計最近幾天的記錄（預設 7）')
+        parser.add_argument('--limit', type=int, default=10, help='列出的筆數（預設 10）')
+        parser.add_argument('--explain', action='store_true', help='顯示最近一次的執行計畫')
+        parser.add_argument('--purge', type=float, default=None, metavar='DAYS', help='刪除幾天前的記錄')
+
+    def handle(self, *args, **options):
+        records = SlowQuery.objects.using(get_setting('DATABASE'))
+
+        if options['purge'] is not None:
+            deleted, _ = records.filter(
+                created_at__lt=timezone.now() - timedelta(days=options['purge'])
+            ).delete()
+            self.stdout.write(self.style.SUCCESS(f'已刪除 {deleted} 筆慢查詢記錄'))
+            return
+
+        offenders = (
+            records.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+            .values('sql', 'view_name')
+            .annotate(
+                count=Count('id'),
+                total_ms=Sum('duration_ms'),
+                avg_ms=Avg('duration_ms'),
+                max_ms=Max('duration_ms'),
+                last_id=Max('id'),
+            )
+            .order_by('-total_ms')[:options['limit']]
+        )
+
+        if not offenders:
+            self.stdout.write('沒有慢查詢記錄')
+            return
+
+        for rank, offender in enumerate(offenders, start=1):
+            self.stdout.write(self.style.WARNING(
+                f"#{rank} {offender['view_name']}：{offender['count']} 次，"
+                f"總計 {offender['total_ms']:.1f} ms，平均 {offender['avg_ms']:.1f} ms，"
+                f"最長 {offender['max_ms']:.1f} ms"
+            ))
+            self.stdout.write(f"    {offender['sql']}")
+            if options['explain']:
+                latest = records.get(pk=offender['last_id'])
+                self.stdout.write(f'    參數：{latest.params}')
+                for line in latest.plan.splitlines():
+                    self.stdout.write(f'    {line}')
@@ -0,0 +1,60 @@
+"""
+SQLite WAL checkpoint
+
+將 WAL 檔的內容寫回資料庫檔案，TRUNCATE 模式並會將 WAL 檔截斷為 0。
+
+使用方式：
+    python manage.py sqlite_checkpoint                    # 執行一次（例如由 cron 定期呼叫）
+    python manage.py sqlite_checkpoint --mode PASSIVE     # 不等待讀寫中的連線
+    python manage.py sqlite_checkpoint --interval 300     # 持續執行，每 300 秒一次
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from phone_auth.sqlite import CHECKPOINT_MODES, checkpoint
+
+
+class Command(BaseCommand):
+    help = 'SQLite WAL checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='資料庫 alias（預設 default）'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=CHECKPOINT_MODES,
+            default='TRUNCATE',
+            help='checkpoint 模式（預設 TRUNCATE）'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='持續執行的間隔秒數；未指定時只執行一次'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"資料庫 {options['database']} 不是 SQLite")
+
+        while True:
+            busy, log_frames, checkpointed = checkpoint(connection, options['mode'])
+            if busy:
+                self.stdout.write(self.style.WARNING(
+                    f'checkpoint 未完成（有連線正在使用資料庫）：WAL {log_frames} frames，已寫回 {checkpointed}'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'checkpoint 完成：WAL {log_frames} frames，已寫回 {checkpointed}'
+                ))
+            if options['interval'] is None:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
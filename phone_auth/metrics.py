@@ -0,0 +1,424 @@
+"""
+行程內 metrics 與 Prometheus 端點
+
+提供低成本的 Counter 與固定 bucket 的 Histogram，以 Prometheus 文字格式輸出：
+
+- http_request_duration_seconds / http_requests_total：每個 view 的處理時間與次數（MetricsMiddleware）
+- firebase_call_duration_seconds：FirebaseAuthService.verify_otp、get_user_by_phone 的時間
+- db_queries_per_request / db_duration_seconds：每個 view 的查詢次數與資料庫時間（QueryMetricsMiddleware）
+
+多個 gunicorn worker：設定 settings.METRICS['DIRECTORY'] 後，每個行程將數值寫入該目錄下
+自己的 mmap 檔案（<pid>.db，只有該行程寫入，不需跨行程鎖定），輸出時加總所有檔案。
+未設定時數值只存在目前的行程中。目錄需在 gunicorn 啟動時清空（見 clear_directory）。
+
+p50 / p95 / p99 由 Prometheus 以 histogram_quantile 計算，例如：
+
+    histogram_quantile(0.99, sum by (le, view) (rate(http_request_duration_seconds_bucket[5m])))
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+# 預設設定，可在 settings.METRICS 中覆寫
+DEFAULTS = {
+    'ENABLED': True,
+    'DIRECTORY': '',  # 多行程共用的 mmap 目錄；空字串表示只在行程內
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+DB_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+
+def get_setting(name):
+    """讀取 METRICS 設定，未設定時使用預設值"""
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+class MmapedDict:
+    """
+    以 mmap 檔案存放 key → float
+
+    檔案開頭 8 bytes 為已使用的長度，之後每筆為：
+    key 長度（uint32）、key（UTF-8，補齊讓 value 對齊 8 bytes）、value（float64）。
+    新的一筆寫完後才更新已使用的長度，其他行程讀取時不會讀到寫到一半的 key。
+    """
+
+    INITIAL_SIZE = 1 << 16
+
+    def __init__(self, path, read_only=False):
+        self._file = open(path, 'rb' if read_only else 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if not read_only and size == 0:
+            self._file.truncate(self.INITIAL_SIZE)
+            size = self.INITIAL_SIZE
+        self._capacity = size
+        self._mmap = mmap.mmap(
+            self._file.fileno(), size, access=mmap.ACCESS_READ if read_only else mmap.ACCESS_WRITE
+        )
+        if not read_only and self._used() == 0:
+            struct.pack_into('Q', self._mmap, 0, 8)
+        self._positions = {key: position for key, _, position in self._entries()}
+
+    def _used(self):
+        return struct.unpack_from('Q', self._mmap, 0)[0]
+
+    def _entries(self):
+        end = min(self._used(), self._capacity)
+        position = 8
+        while position + 4 <= end:
+            (length,) = struct.unpack_from('I', self._mmap, position)
+            value_position = position + 4 + length + (-(4 + length) % 8)
+            if value_position + 8 > end:
+                break
+            key = self._mmap[position + 4:position + 4 + length].decode()
+            (value,) = struct.unpack_from('d', self._mmap, value_position)
+            yield key, value, value_position
+            position = value_position + 8
+
+    def _add_key(self, key):
+        encoded = key.encode()
+        padding = -(4 + len(encoded)) % 8
+        entry = struct.pack('I', len(encoded)) + encoded + b'\0' * padding + struct.pack('d', 0.0)
+        used = self._used()
+        if used + len(entry) > self._capacity:
+            capacity = self._capacity
+            while used + len(entry) > capacity:
+                capacity *= 2
+            self._mmap.close()
+            self._file.truncate(capacity)
+            self._capacity = capacity
+            self._mmap = mmap.mmap(self._file.fileno(), capacity)
+        self._mmap[used:used + len(entry)] = entry
+        struct.pack_into('Q', self._mmap, 0, used + len(entry))
+        self._positions[key] = used + len(entry) - 8
+        return self._positions[key]
+
+    def increment(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._add_key(key)
+        (value,) = struct.unpack_from('d', self._mmap, position)
+        struct.pack_into('d', self._mmap, position, value + amount)
+
+    def items(self):
+        return [(key, value) for key, value, _ in self._entries()]
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+class LocalValues:
+    """只在目前行程的數值（未設定 DIRECTORY 時）"""
+
+    def __init__(self):
+        self._values = {}
+
+    def increment(self, key, amount):
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def items(self):
+        return list(self._values.items())
+
+    def close(self):
+        pass
+
+
+def sample_key(name, labels):
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def view_name_of(request):
+    """request 解析出的 view 名稱（例如 phone_auth:send_otp）"""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else UNRESOLVED_VIEW
+
+
+class Registry:
+    """metrics 定義與數值儲存（每個行程一份，fork 後重新開啟自己的檔案）"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._values = None
+        self._owner = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _storage(self):
+        owner = (os.getpid(), get_setting('DIRECTORY'))
+        if self._owner != owner:
+            if self._values is not None:
+                self._values.close()
+            pid, directory = owner
+            if directory:
+                Path(directory).mkdir(parents=True, exist_ok=True)
+                self._values = MmapedDict(os.path.join(directory, f'{pid}.db'))
+            else:
+                self._values = LocalValues()
+            self._owner = owner
+        return self._values
+
+    def increment(self, key, amount=1):
+        with self._lock:
+            self._storage().increment(key, amount)
+
+    def collect(self):
+        """
+        取得所有行程的數值加總
+
+        Returns:
+            dict: {(sample 名稱, labels): 數值}
+        """
+        with self._lock:
+            storage = self._storage()
+            directory = get_setting('DIRECTORY')
+            sources = [storage.items()] if not directory else []
+        if directory:
+            for path in Path(directory).glob('*.db'):
+                if path.stat().st_size < 8:
+                    continue
+                values = MmapedDict(path, read_only=True)
+                try:
+                    sources.append(values.items())
+                finally:
+                    values.close()
+
+        totals = {}
+        for items in sources:
+            for key, value in items:
+                name, labels = json.loads(key)
+                sample = (name, tuple(tuple(label) for label in labels))
+                totals[sample] = totals.get(sample, 0.0) + value
+        return totals
+
+    def get_sample_value(self, name, labels=None):
+        """取得單一 sample 的數值（測試用），不存在時為 None"""
+        return self.collect().get((name, tuple(sorted((labels or {}).items()))))
+
+    def render(self):
+        """輸出 Prometheus 文字格式"""
+        samples = self.collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render(samples))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Counter:
+    """只會遞增的計數"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        if not get_setting('ENABLED'):
+            return
+        values = tuple(str(labels[name]) for name in self.labelnames)
+        key = self._keys.get(values)
+        if key is None:
+            key = self._keys.setdefault(values, sample_key(self.name, dict(zip(self.labelnames, values))))
+        registry.increment(key, amount)
+
+    def render(self, samples):
+        return [
+            f'{name}{format_labels(labels)} {format_value(value)}'
+            for (name, labels), value in sorted(samples.items())
+            if name == self.name
+        ]
+
+
+class Timer(ContextDecorator):
+    """Histogram.time() 的 context manager / decorator"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def _recreate_cm(self):
+        # 作為 decorator 時每次呼叫使用新的 Timer（可同時在多個執行緒中執行）
+        return Timer(self.histogram, self.labels)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+        return False
+
+
+class Histogram:
+    """固定 bucket 的分佈（各 bucket 分別計數，輸出時轉為累計）"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets) + (float('inf'),)
+        self._keys = {}
+        registry.register(self)
+
+    def _sample_keys(self, values):
+        labels = dict(zip(self.labelnames, values))
+        return (
+            [sample_key(f'{self.name}_bucket', {**labels, 'le': format_value(bound)}) for bound in self.buckets],
+            sample_key(f'{self.name}_sum', labels),
+            sample_key(f'{self.name}_count', labels),
+        )
+
+    def observe(self, value, **labels):
+        if not get_setting('ENABLED'):
+            return
+        values = tuple(str(labels[name]) for name in self.labelnames)
+        keys = self._keys.get(values)
+        if keys is None:
+            keys = self._keys.setdefault(values, self._sample_keys(values))
+        bucket_keys, sum_key, count_key = keys
+        registry.increment(bucket_keys[bisect_left(self.buckets, value)])
+        registry.increment(sum_key, value)
+        registry.increment(count_key)
+
+    def time(self, **labels):
+        """量測區塊或函式的執行時間（秒）"""
+        return Timer(self, labels)
+
+    def render(self, samples):
+        bucket_name = f'{self.name}_bucket'
+        order = {format_value(bound): index for index, bound in enumerate(self.buckets)}
+        series = {}
+        lines = []
+        for (name, labels), value in samples.items():
+            if name == bucket_name:
+                base = tuple(label for label in labels if label[0] != 'le')
+                le = dict(labels)['le']
+                series.setdefault(base, [0.0] * len(self.buckets))[order[le]] += value
+
+        for base in sorted(series):
+            running = 0.0
+            for bound, count in zip(self.buckets, series[base]):
+                running += count
+                labels = base + (('le', format_value(bound)),)
+                lines.append(f'{bucket_name}{format_labels(labels)} {format_value(running)}')
+            for suffix in ('_sum', '_count'):
+                value = samples.get((f'{self.name}{suffix}', base), 0.0)
+                lines.append(f'{self.name}{suffix}{format_labels(base)} {format_value(value)}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'View 處理時間（秒）', ['view', 'method']
+)
+REQUESTS = Counter(
+    'http_requests_total', 'Request 次數', ['view', 'method', 'status']
+)
+FIREBASE_DURATION = Histogram(
+    'firebase_call_duration_seconds', 'Firebase 呼叫時間（秒）', ['call']
+)
+DB_QUERIES = Histogram(
+    'db_queries_per_request', '每個 request 的查詢次數', ['view'], buckets=QUERY_BUCKETS
+)
+DB_DURATION = Histogram(
+    'db_duration_seconds', '每個 request 的資料庫時間（秒）', ['view'], buckets=DB_TIME_BUCKETS
+)
+
+
+def clear_directory(directory=None):
+    """
+    刪除 mmap 目錄中的檔案（在 gunicorn 啟動、worker 建立前呼叫）
+
+    例如 gunicorn.conf.py：
+        def on_starting(server):
+            from phone_auth.metrics import clear_directory
+            clear_directory()
+    """
+    directory = directory or get_setting('DIRECTORY')
+    if not directory:
+        return
+    for path in Path(directory).glob('*.db'):
+        path.unlink(missing_ok=True)
+
+
+class MetricsMiddleware:
+    """
+    記錄每個 view 的處理時間與次數
+
+    需放在 MIDDLEWARE 最前面，時間才會包含其他 middleware。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view = view_name_of(request)
+        REQUEST_DURATION.observe(duration, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """
+    Prometheus 文字格式的 metrics（只限 staff）
+
+    API Endpoint: GET /metrics/
+
+    Prometheus 可用 basic_auth 設定 staff 帳號抓取。
+    """
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('phone_auth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_name', models.CharField(db_index=True, max_length=200, verbose_name='View')),
+                ('database', models.CharField(max_length=100, verbose_name='資料庫')),
+                ('sql', models.TextField(verbose_name='SQL')),
+                ('params', models.JSONField(default=list, verbose_name='參數（已遮蔽）')),
+                ('duration_ms', models.FloatField(verbose_name='執行時間（毫秒）')),
+                ('plan', models.TextField(blank=True, verbose_name='執行計畫')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='建立時間')),
+            ],
+            options={
+                'verbose_name': '慢查詢記錄',
+                'verbose_name_plural': '慢查詢記錄列表',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
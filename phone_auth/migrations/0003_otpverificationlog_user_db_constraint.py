@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-19 15:20
+
+import copy
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def drop_user_constraint(apps, schema_editor):
+    """
+    OTPVerificationLog.user 不再建立外鍵約束（記錄存放在 otp_logs 資料庫，使用者資料表不在同一個資料庫）
+
+    - 資料表已存在（0001 建立，含外鍵約束）：移除約束
+    - 資料表不存在（otp_logs 資料庫，0001 不會在此建立，見 OTPLogRouter）：建立沒有約束的資料表
+    """
+    model = apps.get_model('phone_auth', 'OTPVerificationLog')
+    connection = schema_editor.connection
+    if model._meta.db_table not in connection.introspection.table_names():
+        schema_editor.create_model(model)
+        return
+    new_field = model._meta.get_field('user')
+    old_field = copy.copy(new_field)
+    old_field.db_constraint = True
+    schema_editor.alter_field(model, old_field, new_field)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('phone_auth', '0002_slowquery'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='otpverificationlog',
+                    name='user',
+                    field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='otp_logs', to=settings.AUTH_USER_MODEL, verbose_name='使用者'),
+                ),
+            ],
+        ),
+        # 在 state 更新後執行，取得的是沒有約束的 model
+        migrations.RunPython(
+            drop_user_constraint,
+            migrations.RunPython.noop,
+            hints={'model_name': 'otpverificationlog'},
+        ),
+    ]
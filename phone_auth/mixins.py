@@ -0,0 +1,107 @@
+"""
+Model Mixins
+
+提供多個 app 共用的 Model 行為。
+"""
+
+import copy
+
+from django.db.models.fields.files import FieldFile
+
+
+class DirtyFieldsMixin:
+    """
+    追蹤欄位變動，save() 時只寫入有變動的欄位
+
+    - 未指定 update_fields 時，自動以有變動的欄位作為 update_fields
+    - 沒有任何欄位變動時直接略過 UPDATE（也不會觸發 pre_save / post_save）
+    - 新增資料（INSERT）或明確指定 update_fields 時行為與 Django 相同
+
+    使用方式：
+        class MyModel(DirtyFieldsMixin, models.Model):
+            ...
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._original_state = self._field_snapshot()
+
+    @staticmethod
+    def _snapshot_value(value):
+        if isinstance(value, FieldFile):
+            return value.name
+        if isinstance(value, (dict, list)):
+            return copy.deepcopy(value)
+        return value
+
+    def _field_snapshot(self, fields=None):
+        """記錄目前已載入欄位的值（不含 deferred 欄位）"""
+        deferred = self.get_deferred_fields()
+        return {
+            field.attname: self._snapshot_value(getattr(self, field.attname))
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred
+            and (fields is None or field.name in fields or field.attname in fields)
+        }
+
+    def get_dirty_fields(self):
+        """
+        取得自載入（或上次儲存）後有變動的欄位名稱
+
+        Returns:
+            list: 欄位名稱列表
+        """
+        current = self._field_snapshot()
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in current
+            and (
+                field.attname not in self._original_state
+                or current[field.attname] != self._original_state[field.attname]
+            )
+        ]
+
+    def is_dirty(self):
+        return bool(self.get_dirty_fields())
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and not self._state.adding
+            and not kwargs.get('force_insert')
+            and kwargs.get('update_fields') is None
+        ):
+            dirty_fields = self.get_dirty_fields()
+            if not dirty_fields:
+                return
+            # auto_now 欄位（例如 updated_at）在有寫入時一併更新
+            dirty_fields += [
+                field.name
+                for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False) and field.name not in dirty_fields
+            ]
+            kwargs['update_fields'] = dirty_fields
+
+        super().save(*args, **kwargs)
+        self.reset_dirty_state(kwargs.get('update_fields'))
+
+    def reset_dirty_state(self, fields=None):
+        """
+        將目前的值視為已儲存的狀態
+
+        透過 QuerySet.update() 等方式寫入資料庫後呼叫。
+
+        Args:
+            fields: 只重置指定欄位，None 表示全部
+        """
+        if fields is None:
+            self._original_state = self._field_snapshot()
+        else:
+            self._original_state.update(self._field_snapshot(set(fields)))
+
+    def refresh_from_db(self, using=None, fields=None, *args, **kwargs):
+        # 其餘參數（例如 Django 5.1 的 from_queryset）原樣傳給 Model.refresh_from_db
+        super().refresh_from_db(using, fields, *args, **kwargs)
+        self.reset_dirty_state(fields)
@@ -10,12 +10,15 @@ from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 import uuid
 
+from .mixins import DirtyFieldsMixin
+
 # 為手機驗證而新增的 user data DB 欄位
-class CustomUser(AbstractUser):
+class CustomUser(DirtyFieldsMixin, AbstractUser):
     """
     擴展 Django 原生 User Model，新增手機驗證相關欄位
     
     如果你的專案已有 User Model，請將以下欄位複製到你的 Model 中。
+    save() 只會寫入有變動的欄位（見 DirtyFieldsMixin）。
     """
     
     # 手機號碼（包含國碼，例如：+886987654321）
@@ -108,11 +111,14 @@ class OTPVerificationLog(models.Model):
     OTP 驗證記錄表（可選）
     
     用於記錄所有 OTP 發送與驗證的歷史，方便追蹤與除錯。
+    存放在獨立的資料庫（settings.DATABASES['otp_logs']，見 config/routers.py 的 OTPLogRouter），
+    因此 user 只儲存 user_id，不建立外鍵約束；刪除使用者時保留其記錄。
     """
     
     user = models.ForeignKey(
         CustomUser,
-        on_delete=models.CASCADE,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
         related_name='otp_logs',
         verbose_name='使用者'
     )
@@ -164,3 +170,55 @@ class OTPVerificationLog(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.action} - {self.created_at}"
 
+
+
+class SlowQuery(models.Model):
+    """
+    慢查詢記錄
+
+    由 SlowQueryMiddleware 在背景寫入（見 phone_auth/slow_queries.py），
+    SQL 中的參數以 %s 表示，params 只保留不含個資的值。
+    """
+    
+    view_name = models.CharField(
+        max_length=200,
+        db_index=True,
+        verbose_name='View'
+    )
+    
+    database = models.CharField(
+        max_length=100,
+        verbose_name='資料庫'
+    )
+    
+    sql = models.TextField(
+        verbose_name='SQL'
+    )
+    
+    params = models.JSONField(
+        default=list,
+        verbose_name='參數（已遮蔽）'
+    )
+    
+    duration_ms = models.FloatField(
+        verbose_name='執行時間（毫秒）'
+    )
+    
+    plan = models.TextField(
+        blank=True,
+        verbose_name='執行計畫'
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='建立時間'
+    )
+    
+    class Meta:
+        verbose_name = '慢查詢記錄'
+        verbose_name_plural = '慢查詢記錄列表'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.view_name} - {self.duration_ms:.1f} ms"
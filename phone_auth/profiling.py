@@ -0,0 +1,197 @@
+"""
+staff 的 request 效能分析
+
+staff 使用者（session 或 Basic 認證，與 API 相同）在 request 加上 `X-Profile: 1` header 或 `?_profile=1` 時，
+ProfilingMiddleware 以 cProfile 執行該 request，結果存放在 settings.PROFILING['DIRECTORY']：
+
+- 最多保留 MAX_DUMPS 個檔案，超過時刪除最舊的（各 worker 共用同一個目錄）
+- 回應附上 X-Profile-Id header，以 GET /debug/profiles/<id>/ 下載
+- `X-Profile: sampling` 在已安裝 pyinstrument 時改用 sampling profiler（輸出 HTML），未安裝時使用 cProfile
+
+一般 request 只檢查 header 與 query string，不載入使用者、不啟動 profiler。
+
+下載的 .prof 檔可用 `python -m pstats <檔案>` 或 snakeviz 查看。
+"""
+
+import cProfile
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:  # pyinstrument 為選用套件
+    SamplingProfiler = None
+
+from .authentication import get_api_user
+
+logger = logging.getLogger(__name__)
+
+# 預設設定，可在 settings.PROFILING 中覆寫
+DEFAULTS = {
+    'ENABLED': True,
+    'DIRECTORY': os.path.join(tempfile.gettempdir(), 'phone-auth-profiles'),
+    'MAX_DUMPS': 20,
+}
+
+HEADER = 'HTTP_X_PROFILE'
+QUERY_PARAM = '_profile'
+
+DUMP_NAME_RE = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9]{6}-[0-9]+-[A-Z]+-[\w.-]+\.(prof|html)$', re.ASCII)
+
+
+def get_setting(name):
+    """讀取 PROFILING 設定，未設定時使用預設值"""
+    return getattr(settings, 'PROFILING', {}).get(name, DEFAULTS[name])
+
+
+def get_directory():
+    return Path(get_setting('DIRECTORY'))
+
+
+def requested_mode(request):
+    """request 要求的 profiler（cprofile 或 sampling），未要求時為 None"""
+    value = request.META.get(HEADER) or request.GET.get(QUERY_PARAM)
+    if not value or value in ('0', 'false'):
+        return None
+    return 'sampling' if value == 'sampling' and SamplingProfiler is not None else 'cprofile'
+
+
+def dump_name(request, extension):
+    slug = re.sub(r'[^\w.-]+', '_', request.path.strip('/'), flags=re.ASCII)[:80] or 'root'
+    # 以時間開頭，檔名排序即為時間順序；加上 pid 避免不同 worker 的檔名相同
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S-%f')
+    return f'{stamp}-{os.getpid()}-{request.method}-{slug}.{extension}'
+
+
+def list_dumps():
+    """
+    Returns:
+        list: 依時間由新到舊排列的 dump 檔案
+    """
+    directory = get_directory()
+    if not directory.is_dir():
+        return []
+    dumps = [path for path in directory.iterdir() if DUMP_NAME_RE.match(path.name)]
+    return sorted(dumps, key=lambda path: path.name, reverse=True)
+
+
+def trim_dumps():
+    """刪除超過 MAX_DUMPS 的舊檔案"""
+    for path in list_dumps()[get_setting('MAX_DUMPS'):]:
+        path.unlink(missing_ok=True)
+
+
+def save_dump(name, write):
+    """先寫入暫存檔再改名，其他 worker 不會讀到寫到一半的檔案"""
+    directory = get_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    partial = directory / f'.{name}.partial'
+    write(partial)
+    os.replace(partial, directory / name)
+    trim_dumps()
+
+
+class ProfilingMiddleware:
+    """
+    以 profiler 執行 staff 要求分析的 request
+
+    需放在 AuthenticationMiddleware 之後；staff 以 session 或 Basic 認證（get_api_user）。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = requested_mode(request)
+        if mode is None or not get_setting('ENABLED'):
+            return self.get_response(request)
+        # 與 API 相同接受 session 與 Basic 認證
+        user = get_api_user(request)
+        if user is None or not user.is_staff:
+            return self.get_response(request)
+
+        if mode == 'sampling':
+            return self._run_sampling(request)
+        return self._run_cprofile(request)
+
+    def _run_cprofile(self, request):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一個行程中已有其他 profiler 在執行
+            logger.warning('無法啟動 cProfile，略過此 request 的效能分析')
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+
+        name = dump_name(request, 'prof')
+        save_dump(name, lambda path: profiler.dump_stats(str(path)))
+        response['X-Profile-Id'] = name
+        return response
+
+    def _run_sampling(self, request):
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        name = dump_name(request, 'html')
+        save_dump(name, lambda path: path.write_text(profiler.output_html(), encoding='utf-8'))
+        response['X-Profile-Id'] = name
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """
+    列出保留中的效能分析結果（只限 staff）
+
+    API Endpoint: GET /debug/profiles/
+    """
+    dumps = []
+    for path in list_dumps():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # 已被其他 worker 刪除
+            continue
+        dumps.append({
+            'id': path.name,
+            'size': stat.st_size,
+            'created_at': datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+            'url': request.build_absolute_uri(f'{request.path}{path.name}/'),
+        })
+    return Response({'success': True, 'data': dumps})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_download(request, profile_id):
+    """
+    下載效能分析結果（只限 staff）
+
+    API Endpoint: GET /debug/profiles/<id>/
+    """
+    if not DUMP_NAME_RE.match(profile_id):
+        raise Http404
+    try:
+        dump = open(get_directory() / profile_id, 'rb')
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(dump, as_attachment=True, filename=profile_id)
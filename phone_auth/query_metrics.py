@@ -0,0 +1,152 @@
+"""
+每個端點的查詢次數與資料庫時間
+
+QueryMetricsMiddleware 以 connection.execute_wrapper 包住每個 request 的所有 SQL，
+依解析出的 view 名稱（例如 phone_auth:send_otp、edit_profile:profile）累計：
+
+- 每個 request 的查詢次數分佈（metrics.DB_QUERIES）
+- 每個 request 的資料庫時間分佈（metrics.DB_DURATION，秒）
+
+統計由 phone_auth/metrics.py 的 /metrics/ 端點輸出；
+request.query_counter 也是 Server-Timing 中 db 階段的來源（見 phone_auth/timing.py）。
+
+測試可使用 QueryBudgetMixin，在端點的查詢次數超出宣告的預算時失敗。
+執行過的 SQL 只在 COLLECT_SQL 開啟時保留（QueryBudgetMixin 會自動開啟），正式環境不保留。
+"""
+
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import override_settings
+
+from .metrics import DB_DURATION, DB_QUERIES, view_name_of
+
+# 預設設定，可在 settings.QUERY_METRICS 中覆寫
+DEFAULTS = {
+    'ENABLED': True,
+    # 保留每個 request 執行過的 SQL（只供測試列出超出預算的查詢）
+    'COLLECT_SQL': False,
+}
+
+
+def get_setting(name):
+    """讀取 QUERY_METRICS 設定，未設定時使用預設值"""
+    return getattr(settings, 'QUERY_METRICS', {}).get(name, DEFAULTS[name])
+
+
+class QueryCounter:
+    """
+    execute_wrapper：累計查詢次數與執行時間
+
+    collect_sql 為 True 時在 sql 中保留執行過的 SQL（超出預算時顯示），否則 sql 為 None。
+    設定 slow_threshold（秒）時，另外在 slow 中收集執行時間超過門檻的查詢（見 slow_queries.py）。
+    """
+
+    def __init__(self, slow_threshold=None, collect_sql=False):
+        self.count = 0
+        self.duration = 0.0
+        self.sql = [] if collect_sql else None
+        self.slow_threshold = slow_threshold
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.duration += duration
+            self.count += 1
+            if self.sql is not None:
+                self.sql.append(sql)
+            if self.slow_threshold is not None and duration >= self.slow_threshold:
+                self.slow.append({
+                    'alias': context['connection'].alias,
+                    'sql': sql,
+                    'params': params,
+                    'many': many,
+                    'duration_ms': duration * 1000,
+                })
+
+
+@contextmanager
+def count_queries(counter):
+    """在所有資料庫連線上套用 counter"""
+    with ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(counter))
+        yield counter
+
+
+class QueryMetricsMiddleware:
+    """
+    累計每個 request 的查詢次數與資料庫時間
+
+    需放在 MIDDLEWARE 前段，session 與使用者的查詢才會計入。
+    request.query_counter 為該 request 的 QueryCounter。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        counter = QueryCounter(collect_sql=get_setting('COLLECT_SQL'))
+        request.query_counter = counter
+        with count_queries(counter):
+            response = self.get_response(request)
+
+        view_name = view_name_of(request)
+        DB_QUERIES.observe(counter.count, view=view_name)
+        DB_DURATION.observe(counter.duration, view=view_name)
+        return response
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin：端點的查詢次數超出宣告的預算時測試失敗
+
+    以 QueryMetricsMiddleware 的計數為準（包含 session 與使用者的查詢）。
+    測試類別執行期間開啟 COLLECT_SQL，超出預算時列出執行過的 SQL。
+
+    使用方式：
+        class MyTest(QueryBudgetMixin, TestCase):
+            query_budgets = {'phone_auth:send_otp': 6}
+
+            def test_send_otp(self):
+                response = self.client.post(...)
+                self.assertWithinQueryBudget(response)
+    """
+
+    query_budgets = {}
+
+    @classmethod
+    def setUpClass(cls):
+        collect_sql = override_settings(
+            QUERY_METRICS={**getattr(settings, 'QUERY_METRICS', {}), 'COLLECT_SQL': True}
+        )
+        collect_sql.enable()
+        cls.addClassCleanup(collect_sql.disable)
+        super().setUpClass()
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        request = response.wsgi_request
+        counter = getattr(request, 'query_counter', None)
+        if counter is None:
+            self.fail('QueryMetricsMiddleware 未啟用，無法檢查查詢預算')
+
+        view_name = view_name_of(request)
+        if budget is None:
+            if view_name not in self.query_budgets:
+                self.fail(f'{view_name} 沒有宣告查詢預算')
+            budget = self.query_budgets[view_name]
+
+        if counter.count > budget:
+            executed = '\n'.join(
+                f'{index}. {sql}' for index, sql in enumerate(counter.sql or (), start=1)
+            )
+            self.fail(f'{view_name} 執行了 {counter.count} 次查詢，超出預算 {budget} 次：\n{executed}')
@@ -0,0 +1,199 @@
+"""
+慢查詢記錄
+
+SlowQueryMiddleware 從 QueryMetricsMiddleware 的 request.query_counter 取得每個 request 中
+超過 settings.SLOW_QUERIES['THRESHOLD_MS'] 的查詢（不另外包一層 execute_wrapper），
+在回應產生後交給背景執行緒：
+
+- 以相同的參數執行 EXPLAIN（connection.ops.explain_query_prefix()），取得執行計畫
+- 參數只保留數字、布林值與日期等型別，字串與 bytes 以型別與長度取代（手機號碼、token 不會寫入）
+- 寫入 SlowQuery 資料表（含 view 名稱、資料庫 alias 與執行時間）
+
+EXPLAIN 與寫入都不在 request 的執行路徑上；背景佇列已滿時直接捨棄。
+以 python manage.py slow_queries 列出總時間最多的查詢。
+"""
+
+import logging
+import os
+import queue
+import re
+import threading
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from .metrics import view_name_of
+from .query_metrics import QueryCounter, count_queries
+
+logger = logging.getLogger(__name__)
+
+# 預設設定，可在 settings.SLOW_QUERIES 中覆寫
+DEFAULTS = {
+    'ENABLED': True,
+    'THRESHOLD_MS': 100,
+    'EXPLAIN': True,
+    'BACKGROUND': True,         # False 時在回應產生後直接處理（測試用）
+    'MAX_PENDING': 100,         # 背景佇列上限
+    'DATABASE': DEFAULT_DB_ALIAS,  # SlowQuery 寫入的資料庫
+}
+
+# IN (%s, %s, ...) 依參數個數會有不同的 SQL，統一為 IN (...)
+PLACEHOLDER_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+
+SAFE_PARAM_TYPES = (int, float, bool, type(None))
+
+
+def get_setting(name):
+    """讀取 SLOW_QUERIES 設定，未設定時使用預設值"""
+    return getattr(settings, 'SLOW_QUERIES', {}).get(name, DEFAULTS[name])
+
+
+def normalize_sql(sql):
+    """同一個查詢在不同參數個數下的 SQL 視為相同"""
+    return PLACEHOLDER_LIST_RE.sub('(...)', sql)
+
+
+def redact_param(value):
+    if isinstance(value, SAFE_PARAM_TYPES):
+        return value
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return f'<{type(value).__name__}>'
+
+
+def redact_params(params, many=False):
+    if params is None:
+        return []
+    if many:
+        # executemany 只記錄筆數
+        return [f'<{len(params)} rows>']
+    if isinstance(params, dict):
+        return {key: redact_param(value) for key, value in params.items()}
+    return [redact_param(value) for value in params]
+
+
+def explain(alias, sql, params):
+    """
+    以原本的參數執行 EXPLAIN（不實際執行查詢）
+
+    Returns:
+        str: 執行計畫（每列一行）
+    """
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{prefix} {sql}', params)
+        return '\n'.join(' | '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def record(entry):
+    """執行 EXPLAIN 並寫入 SlowQuery"""
+    from .models import SlowQuery
+
+    plan = ''
+    if get_setting('EXPLAIN') and not entry['many']:
+        try:
+            plan = explain(entry['alias'], entry['sql'], entry['params'])
+        except Exception as exc:
+            plan = f'EXPLAIN 失敗：{exc}'
+
+    SlowQuery.objects.using(get_setting('DATABASE')).create(
+        view_name=entry['view_name'],
+        database=entry['alias'],
+        sql=normalize_sql(entry['sql']),
+        params=redact_params(entry['params'], entry['many']),
+        duration_ms=entry['duration_ms'],
+        plan=plan,
+    )
+
+
+class SlowQueryRecorder:
+    """在背景執行緒中處理慢查詢（每個 worker 行程一個執行緒，fork 後重新建立）"""
+
+    def __init__(self):
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _get_queue(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=get_setting('MAX_PENDING'))
+                    threading.Thread(
+                        target=self._run, args=(self._queue,), name='slow-query-recorder', daemon=True
+                    ).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, entries):
+        while True:
+            entry = entries.get()
+            try:
+                record(entry)
+            except Exception:
+                logger.exception('慢查詢記錄失敗')
+            finally:
+                close_old_connections()
+                entries.task_done()
+
+    def submit(self, entries):
+        if not get_setting('BACKGROUND'):
+            for entry in entries:
+                record(entry)
+            return
+
+        pending = self._get_queue()
+        for entry in entries:
+            try:
+                pending.put_nowait(entry)
+            except queue.Full:
+                self.dropped += 1
+                logger.warning('慢查詢佇列已滿，捨棄記錄（累計 %d 筆）', self.dropped)
+
+    def flush(self):
+        """等待背景佇列處理完畢"""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+
+recorder = SlowQueryRecorder()
+
+
+class SlowQueryMiddleware:
+    """
+    記錄 request 中超過門檻的查詢
+
+    需放在 QueryMetricsMiddleware 之後，使用同一個 QueryCounter。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        with ExitStack() as stack:
+            counter = getattr(request, 'query_counter', None)
+            if counter is None:
+                # QueryMetricsMiddleware 未啟用時自行計數
+                counter = stack.enter_context(count_queries(QueryCounter()))
+            counter.slow_threshold = get_setting('THRESHOLD_MS') / 1000
+            try:
+                response = self.get_response(request)
+            finally:
+                # 之後的查詢（包含寫入 SlowQuery）不再收集
+                counter.slow_threshold = None
+
+        entries = counter.slow
+        if entries:
+            view_name = view_name_of(request)
+            for entry in entries:
+                entry['view_name'] = view_name
+            recorder.submit(entries)
+        return response
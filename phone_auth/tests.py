@@ -0,0 +1,1107 @@
+"""
+手機驗證模組測試
+"""
+
+import base64
+import contextvars
+import copy
+import json
+import logging
+import logging.config
+import multiprocessing
+import os
+import pstats
+import re
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import ExitStack
+from io import StringIO
+from queue import Queue
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.migrations.loader import MigrationLoader
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from config import routers
+from edit_profile import cache as profile_cache
+from edit_profile.models import UserProfile
+from . import log_handlers, metrics, profiling, slow_queries, timing
+from .log_handlers import JSONFormatter, QueuedHandler, RateLimitFilter
+from .firebase_service import firebase_service
+from .models import CustomUser, OTPVerificationLog, SlowQuery
+from .query_metrics import QueryBudgetMixin
+from .sqlite import checkpoint
+
+
+class DirtyFieldsTest(TestCase):
+    """只寫入變動欄位（DirtyFieldsMixin）測試"""
+    
+    def setUp(self):
+        """設置測試數據"""
+        self.user = CustomUser.objects.create_user(
+            username='dirtytest',
+            password='testpass123'
+        )
+        self.user = CustomUser.objects.get(pk=self.user.pk)
+    
+    def test_save_writes_only_changed_fields(self):
+        """測試 save() 只更新有變動的欄位"""
+        self.user.verification_status = CustomUser.VerificationStatus.OTP_SENT
+        self.user.last_otp_sent_at = timezone.now()
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertIn('"verification_status"', sql)
+        self.assertIn('"last_otp_sent_at"', sql)
+        self.assertNotIn('"password"', sql)
+    
+    def test_save_without_changes_skips_update(self):
+        """測試沒有變動時不執行 UPDATE"""
+        self.user.otp_attempts = 0  # 與資料庫中的值相同
+        
+        with self.assertNumQueries(0):
+            self.user.save()
+    
+    def test_dirty_state_resets_after_save(self):
+        """測試儲存後變動狀態重置"""
+        self.user.phone_verified = True
+        self.assertEqual(self.user.get_dirty_fields(), ['phone_verified'])
+        
+        self.user.save()
+        
+        self.assertFalse(self.user.is_dirty())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.phone_verified)
+    
+    def test_refresh_from_db_forwards_arguments(self):
+        """測試 refresh_from_db 的其餘參數原樣傳給 Django"""
+        self.user.otp_attempts = 3
+        
+        with mock.patch('django.db.models.Model.refresh_from_db') as refresh:
+            self.user.refresh_from_db(None, ['otp_attempts'], from_queryset='queryset')
+        
+        refresh.assert_called_once_with(None, ['otp_attempts'], from_queryset='queryset')
+        self.assertFalse(self.user.is_dirty())
+
+
+def increment_in_child(directory):
+    """在 fork 出的子行程中遞增 counter（MetricsTest 使用）"""
+    with override_settings(METRICS={'DIRECTORY': directory}):
+        metrics.REQUESTS.inc(view='child', method='GET', status=200)
+
+
+def log_in_child(handler):
+    """在 fork 出的子行程中記錄一筆並等待寫入（LogPipelineTest 使用）"""
+    handler.handle(logging.makeLogRecord({
+        'name': 'child', 'msg': 'from %s', 'args': ('child',), 'levelno': logging.INFO,
+    }))
+    handler.flush()
+
+
+class SQLitePragmaTest(TestCase):
+    """SQLite 連線調校（SQLITE_PRAGMAS）測試"""
+    
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'pragma.sqlite3')
+    
+    def _open(self):
+        """以相同設定建立連到暫存檔案的新連線"""
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': self.path}, alias='pragma_test')
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+    
+    def _pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+    
+    def test_pragmas_applied_on_connect(self):
+        """測試新連線套用 WAL、synchronous、busy_timeout 等設定"""
+        wrapper = self._open()
+        
+        self.assertEqual(self._pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self._pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self._pragma(wrapper, 'busy_timeout'), 5000)
+        self.assertEqual(self._pragma(wrapper, 'temp_store'), 2)  # MEMORY
+        self.assertEqual(self._pragma(wrapper, 'cache_size'), -20000)
+    
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_empty_profile_keeps_defaults(self):
+        """測試 SQLITE_PRAGMAS 為空時不調整"""
+        wrapper = self._open()
+        
+        self.assertEqual(self._pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertEqual(self._pragma(wrapper, 'synchronous'), 2)  # FULL
+    
+    def test_checkpoint_truncates_wal(self):
+        """測試 checkpoint 將 WAL 寫回並截斷"""
+        wrapper = self._open()
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (value TEXT)')
+            cursor.executemany('INSERT INTO t VALUES (%s)', [('x' * 100,)] * 100)
+        self.assertGreater(os.path.getsize(self.path + '-wal'), 0)
+        
+        busy, log_frames, checkpointed = checkpoint(wrapper, 'TRUNCATE')
+        
+        self.assertEqual(busy, 0)
+        self.assertEqual(log_frames, checkpointed)
+        self.assertEqual(os.path.getsize(self.path + '-wal'), 0)
+    
+    def test_checkpoint_command(self):
+        """測試 sqlite_checkpoint 指令"""
+        out = StringIO()
+        call_command('sqlite_checkpoint', stdout=out)
+        
+        self.assertIn('checkpoint 完成', out.getvalue())
+
+
+class OTPLogDatabaseTest(TestCase):
+    """OTP 驗證記錄獨立資料庫（OTPLogRouter）測試"""
+    
+    databases = {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='logtest', password='testpass123')
+    
+    def _log(self, user, action='SEND'):
+        return OTPVerificationLog.objects.create(
+            user=user, phone_number='+886987654321', action=action, success=True
+        )
+    
+    def test_logs_stored_in_log_database(self):
+        """測試記錄寫入 otp_logs 資料庫，並可從使用者反查"""
+        with CaptureQueriesContext(connections[routers.OTP_LOG_DB_ALIAS]) as log_queries:
+            log = self._log(self.user)
+        
+        self.assertEqual(log._state.db, routers.OTP_LOG_DB_ALIAS)
+        self.assertEqual(len(log_queries), 1)
+        self.assertEqual(list(self.user.otp_logs.all()), [log])
+    
+    def test_send_otp_writes_log_to_log_database(self):
+        """測試 send_otp 的記錄寫入 otp_logs 資料庫（session 登入，request.user 為 lazy object）"""
+        self.client.force_login(self.user)
+        
+        response = self.client.post(
+            '/auth/phone/send-otp/',
+            {'country_code': '+886', 'phone_number': '987654321'},
+            content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        log = OTPVerificationLog.objects.get(user_id=self.user.pk)
+        self.assertEqual(log.action, 'SEND')
+        self.assertEqual(log._state.db, routers.OTP_LOG_DB_ALIAS)
+    
+    def test_deleting_user_keeps_logs(self):
+        """測試刪除使用者時保留記錄（跨資料庫，沒有外鍵約束）"""
+        log = self._log(self.user)
+        user_id = self.user.pk
+        
+        self.user.delete()
+        
+        log.refresh_from_db()
+        self.assertEqual(log.user_id, user_id)
+    
+    def test_migrations_only_on_log_database(self):
+        """測試記錄資料表只建立在 otp_logs，其他資料表不建立在 otp_logs"""
+        router = routers.OTPLogRouter()
+        
+        self.assertFalse(router.allow_migrate(DEFAULT_DB_ALIAS, 'phone_auth', 'otpverificationlog'))
+        self.assertTrue(router.allow_migrate(routers.OTP_LOG_DB_ALIAS, 'phone_auth', 'otpverificationlog'))
+        self.assertFalse(router.allow_migrate(routers.OTP_LOG_DB_ALIAS, 'phone_auth', 'customuser'))
+        self.assertIsNone(router.allow_migrate(DEFAULT_DB_ALIAS, 'phone_auth', 'customuser'))
+    
+    def test_log_table_created_without_user_constraint(self):
+        """測試 0001 含外鍵約束的記錄資料表不建立在 otp_logs，改由 0003 建立沒有約束的資料表"""
+        router = routers.OTPLogRouter()
+        loader = MigrationLoader(connections[routers.OTP_LOG_DB_ALIAS])
+        initial = loader.project_state(('phone_auth', '0001_initial')).apps.get_model('phone_auth', 'OTPVerificationLog')
+        
+        self.assertFalse(router.allow_migrate(
+            routers.OTP_LOG_DB_ALIAS, 'phone_auth', 'otpverificationlog', model=initial
+        ))
+        self.assertTrue(router.allow_migrate(
+            routers.OTP_LOG_DB_ALIAS, 'phone_auth', 'otpverificationlog', model=OTPVerificationLog
+        ))
+        with connections[routers.OTP_LOG_DB_ALIAS].cursor() as cursor:
+            constraints = connections[routers.OTP_LOG_DB_ALIAS].introspection.get_constraints(
+                cursor, OTPVerificationLog._meta.db_table
+            )
+        self.assertFalse([c for c in constraints.values() if c['foreign_key']])
+    
+    def test_admin_changelist_and_search(self):
+        """測試 Admin 列表與依帳號搜尋（不跨資料庫 JOIN）"""
+        admin_user = CustomUser.objects.create_superuser(username='admin', password='adminpass123')
+        deleted = CustomUser.objects.create_user(username='gone')
+        self._log(self.user)
+        self._log(deleted)
+        deleted_id = deleted.pk
+        deleted.delete()
+        self.client.force_login(admin_user)
+        
+        response = self.client.get('/admin/phone_auth/otpverificationlog/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'logtest')
+        self.assertContains(response, f'<td class="field-user_display">#{deleted_id}</td>', html=True)
+        
+        response = self.client.get('/admin/phone_auth/otpverificationlog/', {'q': 'logtest'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class MoveOTPLogsCommandTest(TestCase):
+    """move_otp_logs 管理指令測試（主資料庫中既有的記錄）"""
+    
+    databases = {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+    
+    @classmethod
+    def setUpClass(cls):
+        # 模擬更新前的部署：主資料庫仍有記錄資料表（須在 TestCase 的交易開始前建立）
+        with connection.schema_editor() as editor:
+            editor.create_model(OTPVerificationLog)
+        super().setUpClass()
+    
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(OTPVerificationLog)
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='movetest', password='testpass123')
+        OTPVerificationLog.objects.using(DEFAULT_DB_ALIAS).bulk_create([
+            OTPVerificationLog(id=pk, user=self.user, phone_number='+886987654321', action='SEND')
+            for pk in (1, 2, 3)
+        ])
+    
+    def _run(self, *args):
+        out = StringIO()
+        call_command('move_otp_logs', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+    
+    def test_copies_existing_logs(self):
+        """測試保留 id 複製到 otp_logs，重複執行不會重複複製"""
+        self._run()
+        self._run()
+        
+        self.assertEqual(
+            list(OTPVerificationLog.objects.order_by('pk').values_list('pk', flat=True)), [1, 2, 3]
+        )
+        self.assertEqual(OTPVerificationLog.objects.using(DEFAULT_DB_ALIAS).count(), 3)
+        # 之後新增的記錄不會與複製的 id 衝突
+        self.assertEqual(
+            OTPVerificationLog.objects.create(user=self.user, phone_number='+886987654321', action='SEND').pk,
+            4
+        )
+    
+    def test_delete_removes_logs_from_primary(self):
+        """測試 --delete 複製後從主資料庫刪除"""
+        output = self._run('--delete')
+        
+        self.assertIn('已搬移 3 筆', output)
+        self.assertEqual(OTPVerificationLog.objects.count(), 3)
+        self.assertEqual(OTPVerificationLog.objects.using(DEFAULT_DB_ALIAS).count(), 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    """讀寫分離 router 與 read-your-writes 測試"""
+    
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+    
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        """測試讀取送往 replica、寫入送往 primary"""
+        self.assertEqual(self.router.db_for_read(CustomUser), 'replica_1')
+        self.assertEqual(self.router.db_for_read(UserProfile), 'replica_1')
+        self.assertEqual(self.router.db_for_write(CustomUser), DEFAULT_DB_ALIAS)
+    
+    def test_write_pins_later_reads_to_primary(self):
+        """測試範圍內寫入後的讀取改用 primary（包含在複製的 context 中寫入），離開範圍後還原"""
+        with routers.read_your_writes():
+            contextvars.copy_context().run(self.router.db_for_write, CustomUser)
+            
+            self.assertEqual(self.router.db_for_read(CustomUser), DEFAULT_DB_ALIAS)
+        
+        self.assertEqual(self.router.db_for_read(CustomUser), 'replica_1')
+    
+    def test_write_outside_scope_does_not_pin_process(self):
+        """測試範圍外（管理指令、worker）的寫入不會讓之後的讀取都改用 primary"""
+        self.router.db_for_write(CustomUser)
+        
+        self.assertEqual(self.router.db_for_read(CustomUser), 'replica_1')
+    
+    def test_use_primary(self):
+        """測試 use_primary() 範圍內的讀取使用 primary"""
+        with routers.use_primary():
+            self.assertEqual(self.router.db_for_read(UserProfile), DEFAULT_DB_ALIAS)
+        
+        self.assertEqual(self.router.db_for_read(UserProfile), 'replica_1')
+    
+    def test_other_apps_and_migrations(self):
+        """測試其他 app 不處理、replica 不執行 migration"""
+        self.assertIsNone(self.router.db_for_read(Session))
+        self.assertIsNone(self.router.db_for_write(Session))
+        self.assertFalse(self.router.allow_migrate('replica_1', 'phone_auth'))
+        self.assertIsNone(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'phone_auth'))
+    
+    def _middleware(self, write=False):
+        seen = {}
+        
+        def view(request):
+            seen['read_db'] = self.router.db_for_read(CustomUser)
+            if write:
+                self.router.db_for_write(CustomUser)
+                seen['read_db_after_write'] = self.router.db_for_read(CustomUser)
+            return HttpResponse()
+        
+        return routers.PrimaryPinningMiddleware(view), seen
+    
+    def test_write_request_sets_pin_cookie(self):
+        """測試有寫入的 request 設定 pin cookie，之後的 request 讀取 primary"""
+        factory = RequestFactory()
+        middleware, seen = self._middleware(write=True)
+        response = middleware(factory.post('/'))
+        
+        self.assertEqual(seen['read_db'], DEFAULT_DB_ALIAS)
+        self.assertIn(routers.PIN_COOKIE_NAME, response.cookies)
+        self.assertFalse(routers.is_pinned())
+        
+        middleware, seen = self._middleware()
+        request = factory.get('/')
+        request.COOKIES[routers.PIN_COOKIE_NAME] = response.cookies[routers.PIN_COOKIE_NAME].value
+        response = middleware(request)
+        
+        self.assertEqual(seen['read_db'], DEFAULT_DB_ALIAS)
+        self.assertNotIn(routers.PIN_COOKIE_NAME, response.cookies)
+    
+    def test_read_request_without_pin_uses_replica(self):
+        """測試沒有 pin 的讀取 request 使用 replica"""
+        middleware, seen = self._middleware()
+        request = RequestFactory().get('/')
+        request.COOKIES[routers.PIN_COOKIE_NAME] = '1'  # 已過期
+        middleware(request)
+        
+        self.assertEqual(seen['read_db'], 'replica_1')
+    
+    def test_write_in_read_request_pins_rest_of_request(self):
+        """測試沒有 pin cookie 的 GET request 寫入後，同一個 request 之後的讀取使用 primary"""
+        middleware, seen = self._middleware(write=True)
+        response = middleware(RequestFactory().get('/'))
+        
+        self.assertEqual(seen['read_db'], 'replica_1')
+        self.assertEqual(seen['read_db_after_write'], DEFAULT_DB_ALIAS)
+        self.assertIn(routers.PIN_COOKIE_NAME, response.cookies)
+        self.assertFalse(routers.is_pinned())
+
+
+class QueryMetricsTest(QueryBudgetMixin, TestCase):
+    """每個端點的查詢次數與資料庫時間（QueryMetricsMiddleware）測試"""
+    
+    databases = {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+    
+    # 包含 session 與使用者的查詢
+    query_budgets = {
+        'phone_auth:send_otp': 6,  # 含手機號碼變動時遞增個人資料版本
+        'phone_auth:verify_otp': 4,
+        'edit_profile:profile': 3,
+    }
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='metrictest', password='testpass123')
+        self.client.force_login(self.user)
+    
+    def send_otp(self):
+        return self.client.post(
+            '/auth/phone/send-otp/',
+            {'country_code': '+886', 'phone_number': '987654321'},
+            content_type='application/json'
+        )
+    
+    def sample(self, name):
+        return metrics.registry.get_sample_value(name, {'view': 'phone_auth:send_otp'}) or 0
+    
+    def test_records_queries_per_view(self):
+        """測試依 view 名稱累計查詢次數與資料庫時間"""
+        requests = self.sample('db_queries_per_request_count')
+        queries = self.sample('db_queries_per_request_sum')
+        db_time = self.sample('db_duration_seconds_sum')
+        
+        response = self.send_otp()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sample('db_queries_per_request_count'), requests + 1)
+        self.assertEqual(
+            self.sample('db_queries_per_request_sum'),
+            queries + response.wsgi_request.query_counter.count
+        )
+        self.assertGreater(self.sample('db_duration_seconds_sum'), db_time)
+    
+    def test_endpoints_within_query_budget(self):
+        """測試 send_otp、verify_otp 與個人資料端點不超出查詢預算"""
+        self.assertWithinQueryBudget(self.send_otp())
+        self.assertWithinQueryBudget(self.client.post(
+            '/auth/phone/verify-otp/',
+            {'verification_id': 'invalid-token', 'otp_code': '123456'},
+            content_type='application/json'
+        ))
+        self.assertWithinQueryBudget(self.client.get('/api/user/profile/'))
+    
+    def test_over_budget_fails_with_executed_sql(self):
+        """測試超出預算時失敗並列出執行過的 SQL"""
+        with self.assertRaisesMessage(AssertionError, '超出預算 1 次') as failure:
+            self.assertWithinQueryBudget(self.send_otp(), budget=1)
+        self.assertIn('1. SELECT', str(failure.exception))
+    
+    def test_sql_collected_only_when_enabled(self):
+        """測試只在 COLLECT_SQL 開啟時保留 SQL（正式環境的 request 不保留）"""
+        self.assertTrue(self.send_otp().wsgi_request.query_counter.sql)
+        
+        with override_settings(QUERY_METRICS={'ENABLED': True}):
+            counter = self.send_otp().wsgi_request.query_counter
+        self.assertGreater(counter.count, 0)
+        self.assertIsNone(counter.sql)
+    
+    @override_settings(QUERY_METRICS={'ENABLED': False})
+    def test_disabled(self):
+        """測試停用時不累計"""
+        requests = self.sample('db_queries_per_request_count')
+        
+        response = self.send_otp()
+        
+        self.assertFalse(hasattr(response.wsgi_request, 'query_counter'))
+        self.assertEqual(self.sample('db_queries_per_request_count'), requests)
+
+
+@override_settings(SERVER_TIMING={'ENABLED': True})
+class PhaseTimingTest(TestCase):
+    """每個 request 的階段時間（PhaseTimingMiddleware）測試"""
+    
+    databases = {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='timingtest', password='testpass123', phone_number='+886987654321'
+        )
+        self.client.force_login(self.user)
+    
+    def phases(self, response):
+        return {
+            name: float(duration)
+            for name, duration in re.findall(r'(\w+);dur=([0-9.]+)', response['Server-Timing'])
+        }
+    
+    def test_server_timing_header(self):
+        """測試 Server-Timing 包含 auth、db、firebase、validate、serialize、total"""
+        response = self.client.post(
+            '/auth/phone/send-otp/',
+            {'country_code': '+886', 'phone_number': '987654321'},
+            content_type='application/json'
+        )
+        
+        phases = self.phases(response)
+        self.assertEqual(list(phases), ['auth', 'db', 'firebase', 'validate', 'serialize', 'total'])
+        self.assertGreater(phases['auth'], 0)
+        self.assertGreater(phases['validate'], 0)
+        self.assertGreaterEqual(phases['total'], phases['auth'])
+        count = response.wsgi_request.query_counter.count
+        self.assertIn(f'desc="{count} queries"', response['Server-Timing'])
+    
+    def test_firebase_phase(self):
+        """測試 FirebaseAuthService 的呼叫計入 firebase"""
+        def slow_verify(token):
+            time.sleep(0.02)
+            return {'uid': 'uid-1', 'phone_number': '+886987654321'}
+        
+        with mock.patch('phone_auth.firebase_service.auth.verify_id_token', side_effect=slow_verify):
+            response = self.client.post(
+                '/auth/phone/verify-otp/',
+                {'verification_id': 'token', 'otp_code': '123456'},
+                content_type='application/json'
+            )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(self.phases(response)['firebase'], 20)
+    
+    def test_basic_auth_counted_in_auth_phase(self):
+        """測試 DRF 在 view 之前執行的 Basic 認證（密碼雜湊）計入 auth"""
+        self.client.logout()
+        user = self.user
+        
+        def slow_authenticate(request=None, **credentials):
+            time.sleep(0.02)
+            return user
+        
+        credentials = base64.b64encode(b'timingtest:testpass123').decode()
+        with mock.patch('rest_framework.authentication.authenticate', side_effect=slow_authenticate):
+            response = self.client.get('/api/user/profile/', HTTP_AUTHORIZATION=f'Basic {credentials}')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(self.phases(response)['auth'], 20)
+        self.assertLess(self.phases(response)['serialize'], 20)
+    
+    def test_nested_phase_counted_once(self):
+        """測試巢狀的同名階段只計算最外層"""
+        timer = timing.PhaseTimer()
+        with timing.Phase(timer, 'auth'):
+            with timing.Phase(timer, 'auth'):
+                time.sleep(0.01)
+        
+        self.assertLess(timer.durations['auth'], 0.02)
+    
+    def test_access_log(self):
+        """測試 access log 記錄相同的階段時間"""
+        with self.assertLogs('phone_auth.access', 'INFO') as logs:
+            response = self.client.get('/api/user/profile/')
+        
+        record = logs.records[0]
+        self.assertIn(response['Server-Timing'], record.getMessage())
+        self.assertEqual(record.view, 'edit_profile:profile')
+        self.assertEqual(record.status, 200)
+        self.assertEqual(set(record.phases), {'auth', 'db', 'firebase', 'validate', 'serialize', 'total'})
+    
+    @override_settings(SERVER_TIMING={'ENABLED': False})
+    def test_disabled(self):
+        """測試未開啟時不附上 header，phase() 不計時"""
+        response = self.client.get('/api/user/profile/')
+        
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertIs(timing.phase('db'), timing.NULL_PHASE)
+
+
+class MetricsTest(TestCase):
+    """metrics registry 與 /metrics/ 端點測試"""
+    
+    databases = {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='metricuser', password='testpass123')
+        self.staff = CustomUser.objects.create_user(
+            username='metricstaff', password='testpass123', is_staff=True
+        )
+    
+    def test_view_latency_recorded(self):
+        """測試記錄每個 view 的處理時間與次數"""
+        labels = {'view': 'edit_profile:profile', 'method': 'GET'}
+        before = metrics.registry.get_sample_value('http_request_duration_seconds_count', labels) or 0
+        self.client.force_login(self.user)
+        
+        self.client.get('/api/user/profile/')
+        
+        self.assertEqual(
+            metrics.registry.get_sample_value('http_request_duration_seconds_count', labels), before + 1
+        )
+        self.assertGreaterEqual(
+            metrics.registry.get_sample_value('http_requests_total', {**labels, 'status': '200'}), 1
+        )
+    
+    def test_firebase_calls_timed(self):
+        """測試 FirebaseAuthService.verify_otp 與 get_user_by_phone 的時間"""
+        def count(call):
+            return metrics.registry.get_sample_value(
+                'firebase_call_duration_seconds_count', {'call': call}
+            ) or 0
+        
+        verify_before, lookup_before = count('verify_otp'), count('get_user_by_phone')
+        
+        with mock.patch('phone_auth.firebase_service.auth.verify_id_token', return_value={}), \
+                mock.patch('phone_auth.firebase_service.auth.get_user_by_phone_number', return_value=None):
+            firebase_service.verify_otp('token', '123456')
+            firebase_service.get_user_by_phone('+886987654321')
+        
+        self.assertEqual(count('verify_otp'), verify_before + 1)
+        self.assertEqual(count('get_user_by_phone'), lookup_before + 1)
+    
+    def test_endpoint_staff_only(self):
+        """測試 /metrics/ 只限 staff"""
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+    
+    def test_endpoint_prometheus_format(self):
+        """測試輸出 Prometheus 文字格式，bucket 為累計值"""
+        self.client.force_login(self.staff)
+        self.client.get('/api/user/profile/')
+        
+        response = self.client.get('/metrics/')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('# TYPE firebase_call_duration_seconds histogram', body)
+        self.assertIn('# TYPE db_queries_per_request histogram', body)
+        labels = 'method="GET",view="edit_profile:profile"'
+        count = re.search(rf'^http_request_duration_seconds_count\{{{labels}\}} (\S+)$', body, re.M)
+        inf = re.search(rf'^http_request_duration_seconds_bucket\{{{labels},le="\+Inf"\}} (\S+)$', body, re.M)
+        self.assertEqual(count.group(1), inf.group(1))
+    
+    def test_multiprocess_directory(self):
+        """測試各行程寫入 mmap 目錄後加總"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        labels = {'view': 'child', 'method': 'GET', 'status': '200'}
+        
+        with override_settings(METRICS={'DIRECTORY': directory}):
+            metrics.REQUESTS.inc(**labels)
+            child = multiprocessing.get_context('fork').Process(target=increment_in_child, args=(directory,))
+            child.start()
+            child.join()
+            
+            self.assertEqual(child.exitcode, 0)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertEqual(metrics.registry.get_sample_value('http_requests_total', labels), 2)
+            
+            metrics.clear_directory()
+            self.assertEqual(os.listdir(directory), [])
+    
+    def test_mmaped_dict_grows(self):
+        """測試 mmap 檔案空間不足時擴充，並可由其他行程讀取"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'values.db')
+        values = metrics.MmapedDict(path)
+        for index in range(5000):
+            values.increment(f'key-{index}', index)
+        values.increment('key-1', 1)
+        
+        reader = metrics.MmapedDict(path, read_only=True)
+        items = dict(reader.items())
+        reader.close()
+        values.close()
+        
+        self.assertEqual(len(items), 5000)
+        self.assertEqual(items['key-1'], 2)
+        self.assertEqual(items['key-4999'], 4999)
+
+
+@override_settings(SLOW_QUERIES={'THRESHOLD_MS': 0, 'BACKGROUND': False})
+class SlowQueryTest(TestCase):
+    """慢查詢記錄（SlowQueryMiddleware）測試"""
+    
+    databases = {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='slowtest', password='testpass123', phone_number='+886912345678'
+        )
+        self.client.force_login(self.user)
+    
+    def send_otp(self):
+        return self.client.post(
+            '/auth/phone/send-otp/',
+            {'country_code': '+886', 'phone_number': '987654321'},
+            content_type='application/json'
+        )
+    
+    def test_records_slow_queries_with_plan(self):
+        """測試記錄超過門檻的查詢、view 名稱與執行計畫"""
+        self.send_otp()
+        
+        records = SlowQuery.objects.filter(view_name='phone_auth:send_otp')
+        self.assertTrue(records.exists())
+        select = records.filter(sql__startswith='SELECT').first()
+        self.assertIn('phone_auth_customuser', select.sql)
+        self.assertTrue(select.plan)
+        self.assertEqual(
+            set(records.values_list('database', flat=True)),
+            {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+        )
+    
+    def test_uses_request_query_counter(self):
+        """測試慢查詢由 QueryMetricsMiddleware 的 QueryCounter 收集，不另外包一層 execute_wrapper"""
+        with mock.patch.object(slow_queries, 'count_queries') as count_queries:
+            response = self.send_otp()
+        
+        count_queries.assert_not_called()
+        counter = response.wsgi_request.query_counter
+        self.assertTrue(counter.slow)
+        self.assertEqual(SlowQuery.objects.count(), len(counter.slow))
+    
+    @override_settings(QUERY_METRICS={'ENABLED': False})
+    def test_without_query_metrics(self):
+        """測試 QueryMetricsMiddleware 停用時仍記錄慢查詢"""
+        self.send_otp()
+        
+        self.assertTrue(SlowQuery.objects.filter(view_name='phone_auth:send_otp').exists())
+    
+    def test_params_redacted(self):
+        """測試參數中的字串（手機號碼等）不會寫入"""
+        self.send_otp()
+        
+        params = [record.params for record in SlowQuery.objects.all()]
+        self.assertNotIn('987654321', str(params))
+        self.assertIn('<str:13>', str(params))
+    
+    def test_normalize_sql(self):
+        """測試 IN 參數個數不同的查詢視為相同"""
+        self.assertEqual(
+            slow_queries.normalize_sql('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            slow_queries.normalize_sql('SELECT * FROM t WHERE id IN (%s, %s)'),
+        )
+    
+    @override_settings(SLOW_QUERIES={'THRESHOLD_MS': 60_000, 'BACKGROUND': False})
+    def test_fast_queries_not_recorded(self):
+        """測試未超過門檻的查詢不記錄"""
+        self.send_otp()
+        
+        self.assertFalse(SlowQuery.objects.exists())
+    
+    def test_slow_queries_command(self):
+        """測試 slow_queries 指令依總時間列出查詢"""
+        self.send_otp()
+        self.send_otp()
+        out = StringIO()
+        
+        call_command('slow_queries', '--limit', '3', '--explain', stdout=out)
+        
+        output = out.getvalue()
+        self.assertIn('#1 phone_auth:send_otp', output)
+        self.assertNotIn('#4', output)
+        
+        call_command('slow_queries', '--purge', '0', stdout=out)
+        self.assertFalse(SlowQuery.objects.exists())
+
+
+class SlowQueryBackgroundTest(TransactionTestCase):
+    """慢查詢在背景執行緒中 EXPLAIN 與寫入"""
+    
+    # 設定 replica 時，讀取會送往 replica
+    databases = '__all__'
+    
+    @override_settings(SLOW_QUERIES={'THRESHOLD_MS': 0})
+    def test_recorded_off_request_thread(self):
+        """測試 request 結束後由背景執行緒寫入"""
+        user = CustomUser.objects.create_user(username='slowbg', password='testpass123')
+        self.client.force_login(user)
+        
+        response = self.client.get('/api/user/profile/')
+        slow_queries.recorder.flush()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(SlowQuery.objects.filter(view_name='edit_profile:profile').exists())
+
+
+class ProfilingTest(TestCase):
+    """staff 的 request 效能分析（ProfilingMiddleware）測試"""
+    
+    databases = {DEFAULT_DB_ALIAS, routers.OTP_LOG_DB_ALIAS}
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(PROFILING={'DIRECTORY': self.directory, 'MAX_DUMPS': 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.user = CustomUser.objects.create_user(username='profileuser', password='testpass123')
+        self.staff = CustomUser.objects.create_user(
+            username='profilestaff', password='testpass123', is_staff=True
+        )
+    
+    def test_staff_request_profiled(self):
+        """測試 staff 加上 X-Profile header 時產生 cProfile 結果"""
+        self.client.force_login(self.staff)
+        
+        response = self.client.get('/api/user/profile/', HTTP_X_PROFILE='1')
+        
+        self.assertEqual(response.status_code, 200)
+        name = response['X-Profile-Id']
+        self.assertRegex(name, r'-GET-api_user_profile\.prof$')
+        stats = pstats.Stats(os.path.join(self.directory, name))
+        self.assertTrue(any('profile_view' in func[2] for func in stats.stats))
+    
+    def test_query_param(self):
+        """測試以 ?_profile=1 要求"""
+        self.client.force_login(self.staff)
+        
+        response = self.client.get('/api/user/profile/?_profile=1')
+        
+        self.assertIn('X-Profile-Id', response)
+    
+    def test_basic_auth_staff(self):
+        """測試以 Basic 認證的 staff（沒有 session）也能要求分析，帳號密碼錯誤時不分析"""
+        credentials = base64.b64encode(b'profilestaff:testpass123').decode()
+        response = self.client.get(
+            '/api/user/profile/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=f'Basic {credentials}'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Profile-Id', response)
+        
+        credentials = base64.b64encode(b'profilestaff:wrong').decode()
+        response = self.client.get(
+            '/api/user/profile/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=f'Basic {credentials}'
+        )
+        self.assertNotIn('X-Profile-Id', response)
+    
+    def test_non_staff_ignored(self):
+        """測試非 staff 與沒有 header 的 request 不產生結果"""
+        self.client.force_login(self.user)
+        response = self.client.get('/api/user/profile/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/user/profile/')
+        self.assertNotIn('X-Profile-Id', response)
+        
+        self.assertEqual(os.listdir(self.directory), [])
+    
+    def test_keeps_latest_dumps(self):
+        """測試只保留最新的 MAX_DUMPS 個結果"""
+        self.client.force_login(self.staff)
+        
+        names = [
+            self.client.get('/api/user/profile/', HTTP_X_PROFILE='1')['X-Profile-Id']
+            for _ in range(3)
+        ]
+        
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(names[1:]))
+    
+    def test_list_and_download(self):
+        """測試 staff 列出與下載結果"""
+        self.client.force_login(self.staff)
+        name = self.client.get('/api/user/profile/', HTTP_X_PROFILE='1')['X-Profile-Id']
+        
+        response = self.client.get('/debug/profiles/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([dump['id'] for dump in response.json()['data']], [name])
+        
+        response = self.client.get(f'/debug/profiles/{name}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        with open(os.path.join(self.directory, name), 'rb') as dump:
+            self.assertEqual(b''.join(response.streaming_content), dump.read())
+    
+    def test_views_staff_only(self):
+        """測試非 staff 無法列出或下載"""
+        self.client.force_login(self.user)
+        
+        self.assertEqual(self.client.get('/debug/profiles/').status_code, 403)
+        self.assertEqual(
+            self.client.get('/debug/profiles/20260101T000000-000000-1-GET-x.prof/').status_code, 403
+        )
+    
+    def test_download_rejects_other_files(self):
+        """測試只能下載目錄中的結果檔案"""
+        self.client.force_login(self.staff)
+        with open(os.path.join(self.directory, 'secret.txt'), 'w') as secret:
+            secret.write('secret')
+        
+        self.assertEqual(self.client.get('/debug/profiles/secret.txt/').status_code, 404)
+        self.assertEqual(self.client.get('/debug/profiles/..%2Fsettings.py/').status_code, 404)
+        self.assertEqual(
+            self.client.get('/debug/profiles/20260101T000000-000000-1-GET-x.prof/').status_code, 404
+        )
+
+
+class LogPipelineTest(SimpleTestCase):
+    """非同步日誌處理（QueuedHandler、RateLimitFilter、JSONFormatter）測試"""
+    
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'test.log')
+        self.target = logging.FileHandler(self.path)
+        self.addCleanup(self.target.close)
+        self.handler = QueuedHandler(handlers=[self.target])
+        self.addCleanup(self.handler.close)
+    
+    def record(self, msg='使用者 %s 請求過於頻繁', args=('alice',), level=logging.WARNING, **extra):
+        return logging.makeLogRecord({
+            'name': 'phone_auth.views', 'msg': msg, 'args': args, 'levelno': level,
+            'levelname': logging.getLevelName(level), **extra,
+        })
+    
+    def read_log(self):
+        with open(self.path, encoding='utf-8') as log:
+            return log.read().splitlines()
+    
+    def test_settings_use_queue(self):
+        """測試 phone_auth 與 edit_profile 的 logger 只連到 QueuedHandler"""
+        for name in ('phone_auth', 'edit_profile'):
+            handlers = logging.getLogger(name).handlers
+            self.assertEqual([type(handler) for handler in handlers], [QueuedHandler])
+    
+    def _configure_from_settings(self, configure):
+        """以 settings.LOGGING（檔案改為暫存檔）設定 logging，結束後還原"""
+        config = copy.deepcopy(settings.LOGGING)
+        config['handlers']['file']['filename'] = self.path
+        config['handlers']['console']['class'] = 'logging.NullHandler'
+        self.addCleanup(configure, settings.LOGGING)
+        configure(config)
+        
+        handler = logging.getLogger('phone_auth').handlers[0]
+        logging.getLogger('phone_auth').info('configured %s', 'ok')
+        handler.flush()
+        self.assertIsInstance(handler, QueuedHandler)
+        self.assertEqual(
+            [type(target).__name__ for target in handler.handlers], ['NullHandler', 'FileHandler']
+        )
+        self.assertTrue(handler.respect_handler_level)
+        self.assertEqual(handler.queue.maxsize, 10000)
+        self.assertIn('configured ok', self.read_log()[-1])
+    
+    def test_configure_logging(self):
+        """測試以 LOGGING_CONFIG（configure_logging）套用 settings.LOGGING"""
+        self._configure_from_settings(log_handlers.configure_logging)
+    
+    @unittest.skipUnless(sys.version_info >= (3, 12), 'Python 3.12 起 dictConfig 內建 QueueHandler 的處理')
+    def test_stdlib_dict_config(self):
+        """測試直接以 logging.config.dictConfig 套用 settings.LOGGING（Python 3.12+）"""
+        self._configure_from_settings(logging.config.dictConfig)
+    
+    def test_written_by_listener(self):
+        """測試記錄在呼叫的執行緒格式化，由 listener 寫入"""
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = self.record(exc_info=sys.exc_info())
+        
+        self.handler.handle(record)
+        self.handler.flush()
+        
+        lines = self.read_log()
+        self.assertEqual(lines[0], '使用者 alice 請求過於頻繁')
+        self.assertIn('ValueError: boom', lines[-1])
+        self.assertEqual(record.args, ('alice',))
+    
+    def test_full_queue_drops(self):
+        """測試佇列已滿時捨棄記錄而不阻塞"""
+        handler = QueuedHandler(Queue(maxsize=1), handlers=[self.target])
+        self.addCleanup(handler.close)
+        with mock.patch.object(QueuedHandler, 'start'):
+            for _ in range(3):
+                handler.handle(self.record())
+        
+        self.assertEqual(handler.dropped, 2)
+    
+    def test_listener_started_in_forked_worker(self):
+        """測試 fork 出的行程啟動自己的 listener"""
+        self.handler.handle(self.record(msg='from %s', args=('parent',)))
+        self.handler.flush()
+        
+        child = multiprocessing.get_context('fork').Process(target=log_in_child, args=(self.handler,))
+        child.start()
+        child.join()
+        
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(self.read_log(), ['from parent', 'from child'])
+    
+    def test_rate_limit(self):
+        """測試相同的 WARNING 訊息範本每段時間只保留前幾筆"""
+        rate_limit = RateLimitFilter(rate=2, per=60)
+        
+        with mock.patch('phone_auth.log_handlers.time.monotonic', return_value=1000):
+            kept = [rate_limit.filter(self.record(args=(f'user{index}',))) for index in range(5)]
+            self.assertEqual(kept, [True, True, False, False, False])
+            self.assertTrue(rate_limit.filter(self.record(msg='使用者 %s 已被鎖定')))
+            self.assertTrue(rate_limit.filter(self.record(level=logging.INFO)))
+            self.assertTrue(rate_limit.filter(self.record(level=logging.ERROR)))
+        
+        with mock.patch('phone_auth.log_handlers.time.monotonic', return_value=1060):
+            record = self.record()
+            self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.suppressed, 3)
+    
+    def test_json_formatter(self):
+        """測試 JSON 輸出包含訊息與 access log 的欄位"""
+        record = self.record(
+            msg='%s %s', args=('GET', '/api/user/profile/'), level=logging.INFO,
+            view='edit_profile:profile', status=200, phases={'db': 1.2}, queries=3,
+        )
+        
+        entry = json.loads(JSONFormatter().format(record))
+        
+        self.assertEqual(entry['message'], 'GET /api/user/profile/')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'phone_auth.views')
+        self.assertEqual(entry['view'], 'edit_profile:profile')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['phases'], {'db': 1.2})
+        self.assertEqual(entry['queries'], 3)
+        self.assertNotIn('suppressed', entry)
+
+
+@unittest.skipUnless(settings.DATABASE_REPLICAS, '需設定 DATABASE_REPLICA_URLS')
+class ReplicaReadYourWritesTest(TransactionTestCase):
+    """實際連線到 replica 的讀寫分離測試（replica 在測試中指向 default 的測試資料庫）"""
+    
+    databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='replicatest', password='testpass123')
+        self.client = APIClient()
+        self.client.login(username='replicatest', password='testpass123')
+    
+    def _replica_queries(self, request):
+        """回傳 request 在所有 replica 上執行的查詢數"""
+        with ExitStack() as stack:
+            captured = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in settings.DATABASE_REPLICAS
+            ]
+            response = request()
+        self.assertLess(response.status_code, 400)
+        return sum(len(queries) for queries in captured)
+    
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_reads_use_primary(self):
+        """測試未設定 replica 時全部使用 primary"""
+        self.assertEqual(CustomUser.objects.all().db, DEFAULT_DB_ALIAS)
+    
+    def test_profile_reads_follow_pin(self):
+        """測試個人資料讀取使用 replica，寫入後的讀取改用 primary"""
+        self.assertIn(CustomUser.objects.all().db, settings.DATABASE_REPLICAS)
+        self.client.get('/api/user/profile/')
+        
+        self.assertGreater(self._replica_queries(lambda: self.client.get('/api/user/profile/')), 0)
+        self.assertEqual(
+            self._replica_queries(lambda: self.client.patch(
+                '/api/user/profile/', {'nickname': 'replica'}, format='json'
+            )),
+            0
+        )
+        # pin cookie 仍有效時讀取 primary
+        self.assertEqual(self._replica_queries(lambda: self.client.get('/api/user/profile/')), 0)
+    
+    def test_profile_cache_is_built_from_primary(self):
+        """測試快取未命中時從 primary 讀取個人資料（replica 落後時不會快取舊資料）"""
+        profile_cache.local_cache.clear()
+        cache.clear()
+        with ExitStack() as stack:
+            captured = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in settings.DATABASE_REPLICAS
+            ]
+            response = self.client.get('/api/user/profile/')
+        
+        self.assertEqual(response.status_code, 200)
+        replica_sql = [query['sql'] for queries in captured for query in queries]
+        self.assertFalse([sql for sql in replica_sql if 'edit_profile_userprofile' in sql])
@@ -0,0 +1,183 @@
+"""
+每個 request 的階段時間（Server-Timing）
+
+PhaseTimingMiddleware 在 settings.SERVER_TIMING['ENABLED'] 開啟時，
+記錄每個 request 花在各階段的時間，附在回應的 Server-Timing header 並寫入 access log：
+
+    Server-Timing: auth;dur=1.8, db;dur=3.2;desc="4 queries", firebase;dur=120.4, validate;dur=0.4, serialize;dur=0.9, total;dur=131.0
+
+- auth：DRF 的認證（phone_auth/authentication.py 的 SessionAuthentication、BasicAuthentication
+  與 ServiceTokenAuthentication，包含 Basic 認證的密碼雜湊），以及 AuthenticationMiddleware 的 request.user
+- db：所有 SQL 的時間（QueryMetricsMiddleware 的 QueryCounter）
+- firebase：FirebaseAuthService 的呼叫
+- validate：views 中以 phase('validate') 標示的輸入驗證（serializer.is_valid()）
+- serialize：views 中以 phase('serialize') 標示的回應序列化，以及回應的 render
+- total：整個 request
+
+各階段可能重疊（例如 auth 中的查詢同時計入 db）；同名的階段巢狀時只計算最外層。
+views 與服務以 `with phase('firebase'):` 標示階段；未開啟時 phase() 只回傳共用的 nullcontext。
+"""
+
+import logging
+import time
+from contextlib import ExitStack, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.utils.functional import SimpleLazyObject
+
+from .metrics import view_name_of
+from .query_metrics import QueryCounter, count_queries
+
+access_logger = logging.getLogger('phone_auth.access')
+
+# 預設設定，可在 settings.SERVER_TIMING 中覆寫
+DEFAULTS = {
+    'ENABLED': False,
+    'ACCESS_LOG': True,
+}
+
+PHASES = ('auth', 'db', 'firebase', 'validate', 'serialize')
+
+NULL_PHASE = nullcontext()
+
+_current = ContextVar('phase_timer', default=None)
+
+
+def get_setting(name):
+    """讀取 SERVER_TIMING 設定，未設定時使用預設值"""
+    return getattr(settings, 'SERVER_TIMING', {}).get(name, DEFAULTS[name])
+
+
+class PhaseTimer:
+    """一個 request 的各階段累計時間（秒）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        # 進行中的階段（巢狀的同名階段不重複計時）
+        self.active = set()
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def milliseconds(self):
+        return {name: round(seconds * 1000, 1) for name, seconds in self.durations.items()}
+
+
+class Phase:
+    """將區塊的執行時間計入 PhaseTimer"""
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self._outermost = self.name not in self.timer.active
+        if self._outermost:
+            self.timer.active.add(self.name)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._outermost:
+            self.timer.active.discard(self.name)
+            self.timer.add(self.name, time.perf_counter() - self._start)
+        return False
+
+
+def phase(name):
+    """
+    標示一個階段
+
+    使用方式：
+        with phase('serialize'):
+            data = Serializer(instance).data
+    """
+    timer = _current.get()
+    if timer is None:
+        return NULL_PHASE
+    return Phase(timer, name)
+
+
+def add_server_timing(response, metric):
+    """附加一筆 Server-Timing 指標（保留其他 middleware 已設定的指標）"""
+    existing = response.get('Server-Timing')
+    response['Server-Timing'] = f'{existing}, {metric}' if existing else metric
+
+
+def server_timing(timer):
+    metrics = []
+    for name, milliseconds in timer.milliseconds().items():
+        if name == 'db':
+            metrics.append(f'db;dur={milliseconds};desc="{timer.queries} queries"')
+        else:
+            metrics.append(f'{name};dur={milliseconds}')
+    return ', '.join(metrics)
+
+
+class PhaseTimingMiddleware:
+    """
+    記錄 request 的階段時間，輸出 Server-Timing header 與 access log
+
+    需放在 AuthenticationMiddleware 之後（計時 request.user 的載入）。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        timer = PhaseTimer()
+        token = _current.set(timer)
+        if hasattr(request, 'user'):
+            request.user = SimpleLazyObject(lambda: self._load_user(request, timer))
+        try:
+            with ExitStack() as stack:
+                counter = getattr(request, 'query_counter', None)
+                if counter is None:
+                    counter = stack.enter_context(count_queries(QueryCounter()))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        timer.add('db', counter.duration)
+        timer.queries = counter.count
+        timer.add('total', time.perf_counter() - timer.started)
+
+        timing = server_timing(timer)
+        add_server_timing(response, timing)
+        if get_setting('ACCESS_LOG'):
+            access_logger.info(
+                '%s %s %s %s',
+                request.method,
+                request.path,
+                response.status_code,
+                timing,
+                extra={
+                    'view': view_name_of(request),
+                    'status': response.status_code,
+                    'phases': timer.milliseconds(),
+                    'queries': timer.queries,
+                },
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF Response 在 middleware 之後才 render（轉為 JSON），render 時間計入 serialize
+        timer = _current.get()
+        if timer is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: timer.add('serialize', time.perf_counter() - start)
+            )
+        return response
+
+    @staticmethod
+    def _load_user(request, timer):
+        with Phase(timer, 'auth'):
+            return get_user(request)
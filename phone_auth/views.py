@@ -24,6 +24,7 @@ from .serializers import (
 )
 from .firebase_service import firebase_service
 from .models import CustomUser, OTPVerificationLog
+from .timing import phase
 
 logger = logging.getLogger(__name__)
 
@@ -65,7 +66,9 @@ def send_otp(request):
     
     # 驗證輸入資料
     serializer = SendOTPSerializer(data=request.data)
-    if not serializer.is_valid():
+    with phase('validate'):
+        is_valid = serializer.is_valid()
+    if not is_valid:
         return Response(
             {
                 'error': 'VALIDATION_ERROR',
@@ -84,7 +87,7 @@ def send_otp(request):
         time_since_last = timezone.now() - user.last_otp_sent_at
         if time_since_last < timedelta(seconds=60):
             remaining = 60 - int(time_since_last.total_seconds())
-            logger.warning(f"使用者 {user.username} 請求過於頻繁")
+            logger.warning("使用者 %s 請求過於頻繁", user.username)
             return Response(
                 {
                     'status': 'TOO_MANY_REQUESTS',
@@ -101,7 +104,7 @@ def send_otp(request):
     ).exclude(id=user.id).first()
     
     if existing_user:
-        logger.warning(f"手機號碼 {full_phone_number} 已被其他使用者綁定")
+        logger.warning("手機號碼 %s 已被其他使用者綁定", full_phone_number)
         return Response(
             {
                 'error': 'PHONE_ALREADY_BOUND',
@@ -130,7 +133,7 @@ def send_otp(request):
             success=True
         )
         
-        logger.info(f"OTP 發送請求成功：user={user.username}, phone={full_phone_number}")
+        logger.info("OTP 發送請求成功：user=%s, phone=%s", user.username, full_phone_number)
         
         return Response(
             {
@@ -144,7 +147,7 @@ def send_otp(request):
     else:
         # 發送失敗
         error_msg = result.get('error', '未知錯誤')
-        logger.error(f"OTP 發送失敗：user={user.username}, error={error_msg}")
+        logger.error("OTP 發送失敗：user=%s, error=%s", user.username, error_msg)
         
         # 記錄日誌
         OTPVerificationLog.objects.create(
@@ -206,7 +209,9 @@ def verify_otp(request):
     
     # 驗證輸入資料
     serializer = VerifyOTPSerializer(data=request.data)
-    if not serializer.is_valid():
+    with phase('validate'):
+        is_valid = serializer.is_valid()
+    if not is_valid:
         return Response(
             {
                 'error': 'VALIDATION_ERROR',
@@ -221,7 +226,7 @@ def verify_otp(request):
     
     # 檢查是否已鎖定
     if user.verification_status == CustomUser.VerificationStatus.LOCKED:
-        logger.warning(f"使用者 {user.username} 已被鎖定")
+        logger.warning("使用者 %s 已被鎖定", user.username)
         return Response(
             {
                 'status': 'LOCKED',
@@ -243,7 +248,7 @@ def verify_otp(request):
         
         # 檢查手機號碼是否與使用者當前綁定的號碼一致
         if user.phone_number and user.phone_number != verified_phone:
-            logger.warning(f"手機號碼不符：user.phone={user.phone_number}, verified={verified_phone}")
+            logger.warning("手機號碼不符：user.phone=%s, verified=%s", user.phone_number, verified_phone)
             return Response(
                 {
                     'error': 'PHONE_MISMATCH',
@@ -267,7 +272,7 @@ def verify_otp(request):
             success=True
         )
         
-        logger.info(f"手機驗證成功：user={user.username}, phone={verified_phone}, uid={firebase_uid}")
+        logger.info("手機驗證成功：user=%s, phone=%s, uid=%s", user.username, verified_phone, firebase_uid)
         
         return Response(
             {
@@ -346,7 +351,9 @@ def resend_otp(request):
     
     # 驗證輸入資料
     serializer = ResendOTPSerializer(data=request.data)
-    if not serializer.is_valid():
+    with phase('validate'):
+        is_valid = serializer.is_valid()
+    if not is_valid:
         return Response(
             {
                 'error': 'VALIDATION_ERROR',
@@ -362,7 +369,7 @@ def resend_otp(request):
     
     # 驗證手機號碼是否屬於當前使用者
     if user.phone_number != phone_number:
-        logger.warning(f"使用者 {user.username} 嘗試重發不屬於自己的手機號碼 OTP")
+        logger.warning("使用者 %s 嘗試重發不屬於自己的手機號碼 OTP", user.username)
         return Response(
             {
                 'error': 'PHONE_MISMATCH',
@@ -376,7 +383,7 @@ def resend_otp(request):
         time_since_last = timezone.now() - user.last_otp_sent_at
         if time_since_last < timedelta(seconds=60):
             remaining = 60 - int(time_since_last.total_seconds())
-            logger.warning(f"使用者 {user.username} 重發請求過於頻繁")
+            logger.warning("使用者 %s 重發請求過於頻繁", user.username)
             return Response(
                 {
                     'status': 'TOO_MANY_REQUESTS',
@@ -404,7 +411,7 @@ def resend_otp(request):
             success=True
         )
         
-        logger.info(f"OTP 重發成功：user={user.username}, phone={phone_number}")
+        logger.info("OTP 重發成功：user=%s, phone=%s", user.username, phone_number)
         
         return Response(
             {
@@ -418,7 +425,7 @@ def resend_otp(request):
     else:
         # 發送失敗
         error_msg = result.get('error', '未知錯誤')
-        logger.error(f"OTP 重發失敗：user={user.username}, error={error_msg}")
+        logger.error("OTP 重發失敗：user=%s, error=%s", user.username, error_msg)
         
         # 記錄日誌
         OTPVerificationLog.objects.create(